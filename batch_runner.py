@@ -0,0 +1,212 @@
+"""
+Пакетный запуск стартовых скриптов над одним образом.
+
+Образ загружается один раз, затем для каждого скрипта порождается процесс
+через fork: дочерний процесс разделяет страницы памяти родителя (copy-on-write)
+и работает со своей изолированной копией состояния VFS - изменения одного
+скрипта не видны другим. Одновременно выполняется не больше --workers скриптов.
+Вывод и код завершения каждого скрипта собираются в общий отчет.
+
+Коды завершения скрипта: 0 - без ошибок, 1 - команды вернули Error,
+2 - скрипт завершился исключением.
+
+Примеры:
+    python batch_runner.py --vfs-path vfs_variants/deep_structure.csv start_scripts
+    python batch_runner.py --vfs-path image.csv --workers 8 --report report.json a.txt b.txt
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import selectors
+import sys
+import time
+import traceback
+
+from emulator import COMMANDS, EmulatorState, run_start_script
+from script_runner import compile_script_file
+from vfs import VirtualFileSystem
+
+STATUS_TEXT = {0: 'ok', 1: 'errors', 2: 'crashed'}
+
+
+class ScriptResult:
+    __slots__ = ('path', 'status', 'output', 'elapsed')
+
+    def __init__(self, path, status, output, elapsed):
+        self.path = path
+        self.status = status    # код завершения дочернего процесса
+        self.output = output
+        self.elapsed = elapsed  # секунды от fork до завершения
+
+
+def collect_scripts(paths):
+    """
+    Раскрывает директории в отсортированный список файлов скриптов
+    """
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            scripts.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                           if os.path.isfile(os.path.join(path, name)))
+        else:
+            scripts.append(path)
+    return scripts
+
+
+def run_script_child(script_path, vfs, write_fd):
+    """
+    Тело дочернего процесса: выполняет скрипт, пишет вывод в канал и завершается.
+    os._exit не вызывает обработчики atexit и не сбрасывает буферы родителя
+    """
+    status = 2
+    captured = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(captured):
+            run_start_script(script_path, vfs, EmulatorState())
+        has_errors = any(line.startswith("Error")
+                         for line in captured.getvalue().splitlines())
+        status = 1 if has_errors else 0
+    except BaseException:
+        captured.write(traceback.format_exc())
+    finally:
+        data = captured.getvalue().encode('utf-8')
+        with contextlib.suppress(OSError):
+            with os.fdopen(write_fd, 'wb') as pipe:
+                pipe.write(data)
+        os._exit(status)
+
+
+def run_batch(vfs, scripts, workers):
+    """
+    Выполняет скрипты в дочерних процессах, не больше workers одновременно.
+    Вывод читается из каналов по мере готовности, чтобы заполненный буфер
+    канала не блокировал дочерний процесс
+    """
+    # План каждого скрипта компилируется и кэшируется заранее:
+    # дочерние процессы только читают кэш и не гоняются за его запись
+    with contextlib.redirect_stdout(io.StringIO()):
+        for script_path in scripts:
+            compile_script_file(script_path, COMMANDS)
+
+    # Объекты образа исключаются из сборки мусора: иначе проход сборщика
+    # в дочернем процессе копировал бы все страницы кучи родителя
+    gc.collect()
+    gc.freeze()
+
+    results = [None] * len(scripts)
+    pending = list(enumerate(scripts))
+    pending.reverse()
+    running = {}  # {read_fd: (индекс, pid, начало, [куски вывода])}
+    selector = selectors.DefaultSelector()
+    sys.stdout.flush()
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                index, script_path = pending.pop()
+                read_fd, write_fd = os.pipe()
+                pid = os.fork()
+                if pid == 0:
+                    os.close(read_fd)
+                    run_script_child(script_path, vfs, write_fd)
+                os.close(write_fd)
+                running[read_fd] = (index, pid, time.perf_counter(), [])
+                selector.register(read_fd, selectors.EVENT_READ)
+
+            for key, _ in selector.select():
+                read_fd = key.fd
+                index, pid, start, chunks = running[read_fd]
+                data = os.read(read_fd, 65536)
+                if data:
+                    chunks.append(data)
+                    continue
+                # Конец вывода - процесс завершается, забираем код возврата
+                selector.unregister(read_fd)
+                os.close(read_fd)
+                del running[read_fd]
+                _, wait_status = os.waitpid(pid, 0)
+                status = os.waitstatus_to_exitcode(wait_status)
+                output = b''.join(chunks).decode('utf-8', errors='replace')
+                results[index] = ScriptResult(scripts[index], status, output,
+                                              time.perf_counter() - start)
+    finally:
+        selector.close()
+        gc.unfreeze()
+    return results
+
+
+def format_report(results, elapsed, workers):
+    lines = []
+    for result in results:
+        status = STATUS_TEXT.get(result.status, f'exit {result.status}')
+        lines.append(f"=== {result.path}: {status} ({result.elapsed * 1000:.1f} ms) ===")
+        output = result.output.strip('\n')
+        if output:
+            lines.append(output)
+
+    failed = sum(1 for result in results if result.status != 0)
+    rate = len(results) / elapsed if elapsed > 0 else 0.0
+    lines.append("")
+    lines.append(f"Scripts: {len(results)}, passed: {len(results) - failed}, failed: {failed}")
+    lines.append(f"Workers: {workers}, total: {elapsed:.3f} s, {rate:.1f} scripts/s")
+    return "\n".join(lines)
+
+
+def write_json_report(results, elapsed, report_path):
+    report = {
+        'elapsed': elapsed,
+        'scripts': [{'path': result.path, 'status': result.status,
+                     'elapsed': result.elapsed, 'output': result.output}
+                    for result in results],
+    }
+    with open(report_path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many start scripts against one VFS image')
+    parser.add_argument('scripts', nargs='+', metavar='SCRIPT',
+                        help='Script files or directories with scripts')
+    parser.add_argument('--vfs-path', required=True,
+                        help='Path to VFS CSV file or binary snapshot')
+    parser.add_argument('--lazy-load', action='store_true',
+                        help='Memory-map the VFS CSV and decode file contents on first access')
+    parser.add_argument('--node-store', choices=['objects', 'columnar'], default='objects',
+                        help='Node storage backend: Python objects or compact columnar arrays')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, metavar='N',
+                        help='Scripts running at the same time (default: number of CPUs)')
+    parser.add_argument('--report', metavar='PATH',
+                        help='Also write the report as JSON to PATH')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        print("Error: batch runner requires os.fork (not available on this platform)")
+        sys.exit(2)
+
+    scripts = collect_scripts(args.scripts)
+    if not scripts:
+        print("Error: no scripts to run")
+        sys.exit(2)
+
+    vfs = VirtualFileSystem(node_store=args.node_store)
+    with contextlib.redirect_stdout(io.StringIO()) as load_output:
+        vfs.load(args.vfs_path, lazy=args.lazy_load)
+    if vfs.root is None:
+        print(load_output.getvalue().strip('\n'))
+        sys.exit(2)
+
+    workers = max(args.workers, 1)
+    start = time.perf_counter()
+    results = run_batch(vfs, scripts, workers)
+    elapsed = time.perf_counter() - start
+
+    print(format_report(results, elapsed, workers))
+    if args.report:
+        write_json_report(results, elapsed, args.report)
+    sys.exit(1 if any(result.status != 0 for result in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Генератор синтетических CSV-образов VFS для бенчмарков.
+
+Пример:
+    python benchmarks/generate_vfs.py out.csv --nodes 100000 --depth 6 --fanout 20
+"""
+import argparse
+import base64
+import csv
+import os
+import random
+import string
+import sys
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from exporter import CSV_FIELDS  # noqa: E402
+
+WORDS_ALPHABET = string.ascii_lowercase + '      \n'
+
+
+def random_text(rng, size):
+    return ''.join(rng.choices(WORDS_ALPHABET, k=size))
+
+
+def generate_rows(nodes, depth, fanout, content_size, base64_ratio, dir_ratio, seed):
+    """
+    Строки образа в порядке обхода в ширину: у каждой директории до fanout
+    детей, директории создаются до глубины depth, остальное - файлы
+    """
+    rng = random.Random(seed)
+    yield {'type': 'directory', 'path': '/', 'name': 'root', 'content': '',
+           'encoding': 'text', 'permissions': 'rwxr-xr-x'}
+    count = 1
+    directories = deque([('/', 0)])
+    all_directories = ['/']
+    serial = 0
+    
+    while count < nodes:
+        if not directories:
+            # Глубина исчерпана - дозаполняем существующие директории файлами
+            directories.extend((path, depth) for path in all_directories)
+        parent, level = directories.popleft()
+        base = parent.rstrip('/')
+        
+        for _ in range(fanout):
+            if count >= nodes:
+                break
+            serial += 1
+            if level < depth and rng.random() < dir_ratio:
+                name = f"dir{serial}"
+                path = f"{base}/{name}"
+                directories.append((path, level + 1))
+                all_directories.append(path)
+                yield {'type': 'directory', 'path': path, 'name': name, 'content': '',
+                       'encoding': 'text', 'permissions': 'rwxr-xr-x'}
+            else:
+                name = f"file{serial}.log"
+                content = random_text(rng, content_size)
+                encoding = 'text'
+                if rng.random() < base64_ratio:
+                    content = base64.b64encode(content.encode('utf-8')).decode('ascii')
+                    encoding = 'base64'
+                yield {'type': 'file', 'path': f"{base}/{name}", 'name': name,
+                       'content': content, 'encoding': encoding, 'permissions': 'rw-r--r--'}
+            count += 1
+
+
+def generate(csv_path, nodes=1000, depth=6, fanout=20, content_size=64,
+             base64_ratio=0.3, dir_ratio=0.2, seed=0):
+    """
+    Записывает образ в csv_path построчно, не держа его в памяти
+    """
+    with open(csv_path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=CSV_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for row in generate_rows(nodes, depth, fanout, content_size, base64_ratio, dir_ratio, seed):
+            writer.writerow(row)
+    return csv_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic VFS CSV image')
+    parser.add_argument('output', help='Path to the CSV file to write')
+    parser.add_argument('--nodes', type=int, default=1000, help='Total number of nodes')
+    parser.add_argument('--depth', type=int, default=6, help='Maximum directory depth')
+    parser.add_argument('--fanout', type=int, default=20, help='Children per directory')
+    parser.add_argument('--content-size', type=int, default=64, help='Characters per file body')
+    parser.add_argument('--base64-ratio', type=float, default=0.3,
+                        help='Fraction of files stored base64-encoded')
+    parser.add_argument('--dir-ratio', type=float, default=0.2,
+                        help='Fraction of children that are directories')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    
+    generate(args.output, args.nodes, args.depth, args.fanout, args.content_size,
+             args.base64_ratio, args.dir_ratio, args.seed)
+    print(f"Generated {args.nodes} nodes into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
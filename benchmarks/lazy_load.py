@@ -0,0 +1,79 @@
+"""
+Бенчмарк ленивой загрузки: обычная загрузка CSV против --lazy-load на образе
+с большими телами файлов. Ленивая загрузка только размечает поля в
+отображенном файле и не декодирует содержимое, поэтому на таких образах
+она должна быть быстрее; иначе скрипт завершается с кодом 1.
+
+Пример:
+    python benchmarks/lazy_load.py --nodes 5000 --content-size 50000
+"""
+import argparse
+import contextlib
+import gc
+import io
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from generate_vfs import generate  # noqa: E402
+from vfs import VirtualFileSystem  # noqa: E402
+
+DEFAULT_DATA_DIR = os.path.join(BENCH_DIR, '.data')
+
+
+def ensure_image(data_dir, nodes, content_size, seed):
+    os.makedirs(data_dir, exist_ok=True)
+    image = os.path.join(data_dir, f"vfs_{nodes}_{content_size}_{seed}.csv")
+    if not os.path.exists(image):
+        print(f"Generating {image} ...")
+        generate(image, nodes=nodes, content_size=content_size, seed=seed)
+    return image
+
+
+def load_seconds(image, lazy, repeat):
+    """
+    Лучшее время загрузки из repeat попыток
+    """
+    best = None
+    for _ in range(repeat):
+        vfs = VirtualFileSystem()
+        gc.collect()
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            start = time.perf_counter()
+            vfs.load_from_csv(image, lazy=lazy)
+            elapsed = time.perf_counter() - start
+        if vfs.root is None:
+            raise RuntimeError(f"Failed to load {image}: {output.getvalue()}")
+        best = elapsed if best is None else min(best, elapsed)
+        del vfs
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Eager vs lazy CSV load benchmark')
+    parser.add_argument('--nodes', type=int, default=5000, help='Total number of nodes')
+    parser.add_argument('--content-size', type=int, default=50000, help='Characters per file body')
+    parser.add_argument('--repeat', type=int, default=3, help='Loads per mode (best is reported)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Where generated images are cached')
+    args = parser.parse_args()
+    
+    image = ensure_image(args.data_dir, args.nodes, args.content_size, args.seed)
+    size_mb = os.path.getsize(image) / (1024 * 1024)
+    eager = load_seconds(image, False, args.repeat)
+    lazy = load_seconds(image, True, args.repeat)
+    
+    print(f"Image: {image} ({args.nodes} nodes, {size_mb:.0f} MB)")
+    print(f"eager load: {eager:.2f} s")
+    print(f"lazy load:  {lazy:.2f} s ({eager / lazy:.1f}x faster)")
+    if lazy >= eager:
+        print("REGRESSION: lazy load is not faster than eager load")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Нагрузочный тест сервера сессий: N одновременных сессий, каждая выполняет
+набор команд и отключается. Печатает сессии в секунду и задержки команд
+(p50/p95/p99) с точки зрения клиента.
+
+Без --connect сервер запускается автоматически на синтетическом образе.
+
+Примеры:
+    python benchmarks/load_test.py --sessions 1000
+    python benchmarks/load_test.py --connect 127.0.0.1:8022 --sessions 1000
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+from generate_vfs import generate  # noqa: E402
+from metrics import CommandMetrics  # noqa: E402
+
+END_OF_OUTPUT = b'\x04'
+DEFAULT_COMMANDS = 'pwd;ls;cd dir3;ls;du;cd ..;whoami'
+
+
+async def open_connection(address):
+    if address.startswith('unix:'):
+        return await asyncio.open_unix_connection(address[len('unix:'):])
+    host, _, port = address.rpartition(':')
+    return await asyncio.open_connection(host or '127.0.0.1', int(port))
+
+
+async def run_session(address, commands, metrics, start_gate):
+    await start_gate.wait()
+    reader, writer = await open_connection(address)
+    try:
+        for command_line in commands + ['exit']:
+            start = time.perf_counter_ns()
+            writer.write(command_line.encode('utf-8') + b'\n')
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("Server closed the connection")
+                if line.rstrip(b'\n').endswith(END_OF_OUTPUT):
+                    break
+            metrics.record(command_line.split()[0], time.perf_counter_ns() - start)
+    finally:
+        writer.close()
+
+
+async def run_load(address, sessions, commands):
+    metrics = CommandMetrics()
+    start_gate = asyncio.Event()
+    tasks = [asyncio.create_task(run_session(address, commands, metrics, start_gate))
+             for _ in range(sessions)]
+    start = time.perf_counter()
+    start_gate.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    failures = [result for result in results if isinstance(result, Exception)]
+    return metrics, elapsed, failures
+
+
+def start_server(address, nodes, seed):
+    """
+    Запускает эмулятор в режиме сервера на сгенерированном образе
+    """
+    data_dir = os.path.join(BENCH_DIR, '.data')
+    os.makedirs(data_dir, exist_ok=True)
+    image = os.path.join(data_dir, f"vfs_{nodes}_{seed}.csv")
+    if not os.path.exists(image):
+        print(f"Generating {image} ...")
+        generate(image, nodes=nodes, seed=seed)
+    
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT_DIR, 'emulator.py'), '--vfs-path', image, '--serve', address],
+        stdout=subprocess.PIPE, text=True)
+    for line in server.stdout:
+        if line.startswith('Serving on'):
+            return server
+    raise RuntimeError("Server exited before it started listening")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Session server load test')
+    parser.add_argument('--connect', metavar='ADDRESS', help='Existing server (host:port or unix:/path)')
+    parser.add_argument('--sessions', type=int, default=1000, help='Concurrent sessions')
+    parser.add_argument('--commands', default=DEFAULT_COMMANDS, help='Semicolon-separated commands per session')
+    parser.add_argument('--nodes', type=int, default=10000, help='Image size when starting a server')
+    parser.add_argument('--port', type=int, default=18022, help='Port when starting a server')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    # Каждая сессия - открытый сокет
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+    
+    server = None
+    address = args.connect
+    if address is None:
+        address = f"127.0.0.1:{args.port}"
+        server = start_server(address, args.nodes, args.seed)
+    
+    commands = [command.strip() for command in args.commands.split(';') if command.strip()]
+    try:
+        metrics, elapsed, failures = asyncio.run(run_load(address, args.sessions, commands))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    
+    completed = args.sessions - len(failures)
+    print(f"{completed} sessions in {elapsed:.2f} s: {completed / elapsed:.0f} sessions/s, "
+          f"{sum(metrics.counts.values()) / elapsed:.0f} commands/s")
+    if failures:
+        print(f"{len(failures)} sessions failed, first error: {failures[0]!r}")
+    print(metrics.report())
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Бенчмарки эмулятора: load_from_csv, get_node, ls, cd, du, chmod, chmod -R и cp
+на синтетических образах разного размера.
+
+Каждый масштаб запускается в отдельном процессе, чтобы пиковая память
+(ru_maxrss) относилась только к нему; запуск повторяется --repeat раз,
+и берется медиана каждого замера, чтобы шум машины не давал ложных регрессий. Результаты сравниваются с сохраненной
+базовой линией (benchmarks/baseline.json); при регрессии больше допуска,
+а также если базовой линии для масштаба нет, скрипт завершается с кодом 1.
+
+Примеры:
+    python benchmarks/run_benchmarks.py --scales 1k,100k
+    python benchmarks/run_benchmarks.py --scales 1k,100k --repeat 5 --save-baseline
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from generate_vfs import generate  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_DATA_DIR = os.path.join(BENCH_DIR, '.data')
+OPERATIONS = ('load', 'get_node', 'ls', 'cd', 'du', 'chmod', 'chmod_r', 'cp')
+
+
+def parse_scale(text):
+    """
+    '1k' -> 1000, '100k' -> 100000, '1m' -> 1000000
+    """
+    text = text.strip().lower()
+    multiplier = 1
+    if text.endswith('k'):
+        multiplier, text = 1000, text[:-1]
+    elif text.endswith('m'):
+        multiplier, text = 1000000, text[:-1]
+    return int(float(text) * multiplier)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux ru_maxrss в килобайтах, в macOS - в байтах
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def sample_paths(vfs, limit, rng):
+    """
+    Случайные пути директорий и файлов (обход без рекурсии)
+    """
+    directories = []
+    files = []
+    stack = [vfs.root]
+    while stack:
+        node = stack.pop()
+        (directories if node.type == 'directory' else files).append(node.path)
+        stack.extend(node.children.values())
+    rng.shuffle(directories)
+    rng.shuffle(files)
+    return directories[:limit], files[:limit]
+
+
+def timed(operations, action):
+    start = time.perf_counter()
+    for _ in range(operations):
+        action()
+    elapsed = time.perf_counter() - start
+    return operations / elapsed if elapsed else float('inf')
+
+
+def run_worker(image, operations, node_store, lazy, seed):
+    """
+    Замеры для одного образа; возвращает словарь операция -> операций/с
+    """
+    from vfs import VirtualFileSystem
+    
+    rng = random.Random(seed)
+    vfs = VirtualFileSystem(node_store=node_store)
+    quiet = io.StringIO()
+    results = {}
+    
+    with contextlib.redirect_stdout(quiet):
+        start = time.perf_counter()
+        vfs.load_from_csv(image, lazy=lazy)
+        load_seconds = time.perf_counter() - start
+        if vfs.root is None:
+            raise RuntimeError(f"Failed to load {image}: {quiet.getvalue()}")
+        
+        directories, files = sample_paths(vfs, 1000, rng)
+        paths = directories + files
+        # Записи CSV, а не строки: содержимое файлов может содержать переводы строк
+        with open(image, newline='', encoding='utf-8') as file:
+            results['nodes'] = sum(1 for _ in csv.reader(file)) - 1
+        results['load'] = results['nodes'] / load_seconds
+        
+        results['get_node'] = timed(operations, lambda: vfs.get_node(rng.choice(paths)))
+        results['ls'] = timed(operations, lambda: vfs.list_directory(rng.choice(directories)))
+        
+        def cd():
+            vfs.change_directory(rng.choice(directories))
+            vfs.change_directory('..')
+        results['cd'] = timed(operations, cd)
+        
+        results['du'] = timed(operations, lambda: vfs.calculate_directory_size(rng.choice(directories)))
+        results['chmod'] = timed(operations, lambda: vfs.change_permissions(rng.choice(paths), rng.choice(('755', '644'))))
+        # chmod -R по всему образу: узлов в секунду
+        results['chmod_r'] = results['nodes'] * timed(
+            3, lambda: vfs.change_permissions('/', rng.choice(('u+x,go-w', '755')), recursive=True))
+        
+        counter = iter(range(operations))
+        
+        def cp():
+            source = rng.choice(paths)
+            target = rng.choice(directories).rstrip('/')
+            vfs.copy_node(source, f"{target}/bench_copy{next(counter)}")
+        results['cp'] = timed(operations, cp)
+    
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def ensure_image(data_dir, nodes, seed):
+    os.makedirs(data_dir, exist_ok=True)
+    image = os.path.join(data_dir, f"vfs_{nodes}_{seed}.csv")
+    if not os.path.exists(image):
+        print(f"Generating {image} ...")
+        generate(image, nodes=nodes, seed=seed)
+    return image
+
+
+def compare(results, baseline, tolerance):
+    """
+    Список регрессий: пропускная способность упала или память выросла больше допуска
+    """
+    regressions = []
+    for scale, measured in results.items():
+        reference = baseline.get(scale)
+        if not reference:
+            regressions.append(f"{scale}: no baseline measurements (run with --save-baseline)")
+            continue
+        for operation in OPERATIONS:
+            if operation in reference and measured[operation] < reference[operation] * (1 - tolerance):
+                regressions.append(f"{scale} {operation}: {measured[operation]:.0f} ops/s "
+                                   f"< baseline {reference[operation]:.0f} ops/s")
+        if 'peak_rss_mb' in reference and measured['peak_rss_mb'] > reference['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{scale} peak memory: {measured['peak_rss_mb']:.1f} MB "
+                               f"> baseline {reference['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def print_report(results):
+    header = f"{'scale':>10}" + ''.join(f"{op:>12}" for op in OPERATIONS) + f"{'peak MB':>10}"
+    print(header)
+    for scale, measured in results.items():
+        print(f"{scale:>10}" + ''.join(f"{measured[op]:>12.0f}" for op in OPERATIONS)
+              + f"{measured['peak_rss_mb']:>10.1f}")
+    print("(throughput in operations per second; load and chmod_r in nodes per second)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='VFS emulator benchmarks')
+    parser.add_argument('--scales', default='1k,100k,1m', help='Comma-separated node counts (1k, 100k, 1m)')
+    parser.add_argument('--operations', type=int, default=2000, help='Operations per benchmark')
+    parser.add_argument('--node-store', choices=['objects', 'columnar'], default='objects')
+    parser.add_argument('--lazy', action='store_true', help='Use lazy mmap-backed loading')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per scale (median is reported)')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Where generated images are cached')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='Store results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative regression')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker:
+        results = run_worker(args.worker, args.operations, args.node_store, args.lazy, args.seed)
+        print(json.dumps(results))
+        return 0
+    
+    results = {}
+    for scale in args.scales.split(','):
+        nodes = parse_scale(scale)
+        image = ensure_image(args.data_dir, nodes, args.seed)
+        command = [sys.executable, os.path.abspath(__file__), '--worker', image,
+                   '--operations', str(args.operations), '--node-store', args.node_store,
+                   '--seed', str(args.seed)]
+        if args.lazy:
+            command.append('--lazy')
+        print(f"Running {scale} ({nodes} nodes) ...")
+        runs = []
+        for _ in range(max(args.repeat, 1)):
+            output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results[scale.strip()] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    
+    print_report(results)
+    
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+    
+    if args.save_baseline:
+        # Замеры других масштабов в базовой линии сохраняются
+        baseline.update(results)
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(baseline, file, indent=2)
+            file.write('\n')
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    
+    if not baseline:
+        print(f"Error: baseline {args.baseline} not found - run with --save-baseline to create one")
+        return 1
+    
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
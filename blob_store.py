@@ -0,0 +1,194 @@
+"""
+Хранилище содержимого файлов с адресацией по содержимому.
+
+Одинаковые тела файлов (шаблоны конфигов, .profile в тысячах домашних
+директорий) хранятся одной строкой: словарь строк - это хэш-таблица,
+ключ которой - хэш содержимого с проверкой на равенство, поэтому
+коллизии невозможны. Для каждого тела ведется счетчик ссылок - число
+узлов VFSNode, которые на него указывают; тело без ссылок удаляется.
+
+При включенном сжатии (--compress-content) тела не короче порога хранятся
+сжатыми (CompressedBody) и распаковываются при чтении. Последние
+прочитанные тела держатся распакованными в небольшом LRU-кэше, поэтому
+повторные cat и grep по одним и тем же файлам не платят за распаковку.
+Сжатые тела тоже общие: ключ в словаре - сжатые байты.
+"""
+import lzma
+import sys
+import zlib
+from collections import OrderedDict
+
+# Алгоритмы сжатия: (сжать, распаковать)
+CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+# Тела короче порога (в символах) не сжимаются
+COMPRESS_THRESHOLD = 1024
+# Сжатое тело хранится, только если оно меньше исходного хотя бы на эту долю
+MIN_SAVING = 0.1
+# Объем распакованных тел в LRU-кэше (в байтах UTF-8)
+CONTENT_CACHE_SIZE = 8 * 1024 * 1024
+
+
+class CompressedBody:
+    """
+    Сжатое содержимое файла - хранится в узле вместо строки
+    """
+    __slots__ = ('data', 'codec', 'length', 'nbytes', 'logical')
+
+    def __init__(self, data, codec, length, nbytes, logical):
+        self.data = data          # сжатые байты
+        self.codec = codec        # 'zlib' или 'lzma'
+        self.length = length      # длина содержимого в символах
+        self.nbytes = nbytes      # размер содержимого в UTF-8
+        self.logical = logical    # sys.getsizeof исходной строки
+
+    def __len__(self):
+        # Как у строки: du и оценки памяти не распаковывают тело
+        return self.length
+
+    def decompress(self):
+        return CODECS[self.codec][1](self.data).decode('utf-8', 'surrogatepass')
+
+
+class BlobStore:
+    def __init__(self, compression=None, threshold=COMPRESS_THRESHOLD):
+        self.blobs = {}  # {содержимое или сжатые байты: [общий экземпляр, число ссылок]}
+        self.compression = compression  # None - без сжатия, иначе ключ CODECS
+        self.threshold = threshold
+        self.cache_size = CONTENT_CACHE_SIZE
+        self._cache = OrderedDict()  # {CompressedBody: распакованная строка}
+        self._cache_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def acquire(self, content):
+        """
+        Возвращает общий экземпляр тела и увеличивает счетчик ссылок.
+        Строки не короче порога при включенном сжатии возвращаются сжатыми
+        """
+        if not content:
+            return content
+        if isinstance(content, CompressedBody):
+            return self._acquire_key(content.data, content)
+        if self.compression is not None and len(content) >= self.threshold:
+            body = self._compress(content)
+            if body is not None:
+                return self._acquire_key(body.data, body)
+        return self._acquire_key(content, content)
+
+    def _acquire_key(self, key, content):
+        entry = self.blobs.get(key)
+        if entry is None:
+            self.blobs[key] = [content, 1]
+            return content
+        entry[1] += 1
+        return entry[0]
+
+    def _compress(self, content):
+        """
+        Сжатое тело или None, если сжатие почти ничего не дает
+        """
+        raw = content.encode('utf-8', 'surrogatepass')
+        data = CODECS[self.compression][0](raw)
+        if len(data) > len(raw) * (1 - MIN_SAVING):
+            return None
+        return CompressedBody(data, self.compression, len(content), len(raw), sys.getsizeof(content))
+
+    def release(self, content):
+        if not content:
+            return
+        compressed = isinstance(content, CompressedBody)
+        key = content.data if compressed else content
+        entry = self.blobs.get(key)
+        if entry is None:
+            return
+        if entry[1] <= 1:
+            del self.blobs[key]
+            if compressed:
+                self._uncache(entry[0])
+        else:
+            entry[1] -= 1
+
+    def read(self, body):
+        """
+        Распакованное содержимое сжатого тела через LRU-кэш
+        """
+        cache = self._cache
+        content = cache.get(body)
+        if content is not None:
+            cache.move_to_end(body)
+            self.cache_hits += 1
+            return content
+        self.cache_misses += 1
+        content = body.decompress()
+        if body.nbytes <= self.cache_size:
+            cache[body] = content
+            self._cache_bytes += body.nbytes
+            while self._cache_bytes > self.cache_size:
+                old, _ = cache.popitem(last=False)
+                self._cache_bytes -= old.nbytes
+        return content
+
+    def _uncache(self, body):
+        if self._cache.pop(body, None) is not None:
+            self._cache_bytes -= body.nbytes
+
+    def clear(self):
+        self.blobs.clear()
+        self._cache.clear()
+        self._cache_bytes = 0
+
+    def stats(self):
+        """
+        (уникальных тел, ссылок, логический объем, хранимый объем) в байтах памяти
+        """
+        blobs = len(self.blobs)
+        references = 0
+        logical = 0
+        stored = 0
+        for content, count in self.blobs.values():
+            size = _stored_size(content)
+            references += count
+            logical += size * count
+            stored += size
+        return blobs, references, logical, stored
+
+    def compression_stats(self):
+        """
+        (сжатых тел, их объем до сжатия, объем после сжатия) в байтах памяти
+        """
+        bodies = logical = stored = 0
+        for content, _ in self.blobs.values():
+            if isinstance(content, CompressedBody):
+                bodies += 1
+                logical += content.logical
+                stored += _stored_size(content)
+        return bodies, logical, stored
+
+    def cache_stats(self):
+        """
+        (тел в кэше, их объем, попаданий, промахов)
+        """
+        return len(self._cache), self._cache_bytes, self.cache_hits, self.cache_misses
+
+    def report(self):
+        blobs, references, logical, stored = self.stats()
+        if not references:
+            return "No file contents stored"
+        ratio = logical / stored if stored else 1.0
+        return "\n".join([
+            f"Blobs:          {blobs}",
+            f"References:     {references}",
+            f"Logical size:   {logical} bytes",
+            f"Stored size:    {stored} bytes",
+            f"Dedup ratio:    {ratio:.2f}x",
+            f"Memory saved:   {logical - stored} bytes",
+        ])
+
+
+def _stored_size(content):
+    if isinstance(content, CompressedBody):
+        return sys.getsizeof(content) + sys.getsizeof(content.data)
+    return sys.getsizeof(content)
@@ -0,0 +1,95 @@
+"""
+Клиент сервера сессий эмулятора (python emulator.py --serve ...).
+
+Примеры:
+    python client.py --connect 127.0.0.1:8022
+    python client.py --connect unix:/tmp/vfs.sock -c "cd home" -c "ls"
+"""
+import argparse
+import socket
+import sys
+
+END_OF_OUTPUT = '\x04'
+
+
+def connect(address):
+    """
+    address - 'host:port' или 'unix:/path/to.sock'
+    """
+    if address.startswith('unix:'):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address[len('unix:'):])
+    else:
+        host, _, port = address.rpartition(':')
+        sock = socket.create_connection((host or '127.0.0.1', int(port)))
+    return sock
+
+
+class SessionClient:
+    def __init__(self, address):
+        self.sock = connect(address)
+        self.stream = self.sock.makefile('rwb')
+
+    def run(self, command_line):
+        """
+        Отправляет команду и возвращает ее вывод
+        """
+        self.stream.write(command_line.encode('utf-8') + b'\n')
+        self.stream.flush()
+        lines = []
+        for raw in self.stream:
+            line = raw.decode('utf-8').rstrip('\n')
+            if line.endswith(END_OF_OUTPUT):
+                lines.append(line[:-len(END_OF_OUTPUT)])
+                break
+            lines.append(line)
+        else:
+            raise ConnectionError("Server closed the connection")
+        return '\n'.join(lines).rstrip('\n')
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulator session client')
+    parser.add_argument('--connect', required=True, metavar='ADDRESS',
+                        help='Server address: host:port or unix:/path')
+    parser.add_argument('-c', dest='commands', action='append', metavar='COMMAND',
+                        help='Run the command and exit (may be repeated)')
+    args = parser.parse_args()
+    
+    try:
+        client = SessionClient(args.connect)
+    except OSError as e:
+        print(f"Error: cannot connect to {args.connect}: {e}")
+        sys.exit(1)
+    
+    try:
+        if args.commands:
+            for command_line in args.commands:
+                output = client.run(command_line)
+                if output:
+                    print(output)
+            return
+        
+        while True:
+            try:
+                command_line = input("[vfs] $ ")
+            except EOFError:
+                command_line = "exit"
+            output = client.run(command_line)
+            if output:
+                print(output)
+            if command_line.strip() == "exit":
+                print("Goodbye!")
+                break
+    except ConnectionError as e:
+        print(f"Error: {e}")
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
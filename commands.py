@@ -1,24 +1,195 @@
-from vfs import VirtualFileSystem
+import hashlib
+import re
+from collections import deque
+from itertools import chain, islice
 
-def execute_ls(args, vfs):
+from search import grep_files
+from vfs import VirtualFileSystem, iter_tree, parse_mode, read_content
+
+def iter_lines(output):
     """
-    Реализация команды ls - список файлов и папок
+    Вывод команды как итератор строк: строка режется по переводам строк
+    лениво, генератор возвращается как есть
     """
-    if not args:
+    if output is None:
+        return iter(())
+    if not isinstance(output, str):
+        return output
+    return _iter_text_lines(output)
+
+def _iter_text_lines(text):
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+def _input_lines(command, paths, vfs, stdin):
+    """
+    Строки входа команды: содержимое файлов или вывод предыдущей команды конвейера.
+    Ошибка возвращается строкой до начала чтения
+    """
+    if not paths:
+        if stdin is None:
+            return f"Error: {command} requires a file or piped input"
+        return stdin
+    
+    nodes = []
+    for path in paths:
+        node = vfs.get_node(path)
+        if not node:
+            return f"Error: File '{path}' not found"
+        if node.type != 'file':
+            return f"Error: '{path}' is a directory"
+        nodes.append(node)
+    return chain.from_iterable(_iter_text_lines(node.content or '') for node in nodes)
+
+def _line_count_option(command, args, default=10):
+    """
+    Разбирает -n N или -N для head и tail: (число строк, остальные аргументы)
+    """
+    count = default
+    rest = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "-n":
+            if i + 1 >= len(args) or not args[i + 1].isdigit():
+                return f"Error: {command} -n requires a non-negative number", None
+            count = int(args[i + 1])
+            i += 2
+            continue
+        if arg.startswith("-") and arg[1:].isdigit():
+            count = int(arg[1:])
+        else:
+            rest.append(arg)
+        i += 1
+    return count, rest
+
+def execute_cat(args, vfs, stdin=None):
+    """
+    Реализация команды cat - вывод файлов (или входа конвейера) построчно
+    """
+    return _input_lines("cat", args, vfs, stdin)
+
+def execute_head(args, vfs, stdin=None):
+    """
+    Реализация команды head - первые N строк. head [-n N] [файл]
+    """
+    count, paths = _line_count_option("head", args)
+    if paths is None:
+        return count
+    lines = _input_lines("head", paths, vfs, stdin)
+    if isinstance(lines, str):
+        return lines
+    # Остаток входа не читается - ls /huge | head -5 завершается сразу
+    return islice(lines, count)
+
+def execute_tail(args, vfs, stdin=None):
+    """
+    Реализация команды tail - последние N строк. tail [-n N] [файл]
+    """
+    count, paths = _line_count_option("tail", args)
+    if paths is None:
+        return count
+    lines = _input_lines("tail", paths, vfs, stdin)
+    if isinstance(lines, str):
+        return lines
+    # В памяти держатся только последние N строк
+    return iter(deque(lines, maxlen=count)) if count else iter(())
+
+def execute_wc(args, vfs, stdin=None):
+    """
+    Реализация команды wc - число строк, слов и символов. wc [-l|-w|-c] [файл]
+    """
+    options = [arg for arg in args if arg in ("-l", "-w", "-c")]
+    paths = [arg for arg in args if arg not in ("-l", "-w", "-c")]
+    lines = _input_lines("wc", paths, vfs, stdin)
+    if isinstance(lines, str):
+        return lines
+    
+    line_count = word_count = char_count = 0
+    for line in lines:
+        line_count += 1
+        word_count += len(line.split())
+        char_count += len(line) + 1
+    
+    counts = {"-l": line_count, "-w": word_count, "-c": char_count}
+    selected = [counts[option] for option in options] or [line_count, word_count, char_count]
+    result = " ".join(str(count) for count in selected)
+    return f"{result} {paths[0]}" if len(paths) == 1 else result
+
+def execute_sort(args, vfs, stdin=None):
+    """
+    Реализация команды sort - сортировка строк. sort [-r] [-n] [-u] [файл]
+    """
+    options = {arg for arg in args if arg in ("-r", "-n", "-u")}
+    paths = [arg for arg in args if arg not in ("-r", "-n", "-u")]
+    lines = _input_lines("sort", paths, vfs, stdin)
+    if isinstance(lines, str):
+        return lines
+    
+    if "-u" in options:
+        lines = set(lines)
+    key = None
+    if "-n" in options:
+        def key(line):
+            match = re.match(r'\s*(-?\d+(?:\.\d*)?)', line)
+            return (float(match.group(1)) if match else 0.0, line)
+    # Сортировка требует всего входа, но отдает результат построчно
+    return iter(sorted(lines, key=key, reverse="-r" in options))
+
+def execute_ls(args, vfs, piped=False):
+    """
+    Реализация команды ls - список файлов и папок.
+    ls [--offset N] [--limit N] [путь|шаблон], например: ls /var/log/*.log
+    В конвейере имена выдаются по одному на строку, без копирования списка
+    """
+    offset = 0
+    limit = None
+    paths = []
+    i = 0
+    while i < len(args):
+        if args[i] in ("--offset", "--limit"):
+            if i + 1 >= len(args) or not args[i + 1].isdigit():
+                return f"Error: {args[i]} requires a non-negative number\nUsage: ls [--offset N] [--limit N] [path]"
+            if args[i] == "--offset":
+                offset = int(args[i + 1])
+            else:
+                limit = int(args[i + 1])
+            i += 2
+        else:
+            paths.append(args[i])
+            i += 1
+    
+    pattern = None
+    if not paths:
         # ls без аргументов - показываем текущую директорию
         path = vfs.current_path
     else:
         # ls с путем - показываем указанную директорию
-        path = args[0]
+        path = paths[0]
+        # Шаблон в последнем компоненте пути: ls *.log, ls /var/log/sys*
+        parent_path, name = vfs._split_path(path)
+        if any(c in name for c in "*?["):
+            path, pattern = parent_path, name
+    
+    if piped:
+        return vfs.iter_directory(path, pattern=pattern, offset=offset, limit=limit)
     
     # Получаем содержимое директории
-    result = vfs.list_directory(path)
+    result = vfs.list_directory(path, pattern=pattern, offset=offset, limit=limit)
     
     if isinstance(result, str) and result.startswith("Error:"):
         return result  # Возвращаем ошибку
     
     # Форматируем вывод
     if not result:
+        if pattern is not None:
+            return f"Error: No matches for '{paths[0]}'"
         return "Directory is empty"
     
     return "  ".join(result)
@@ -73,7 +244,27 @@ def execute_uptime(args, vfs, emulator_state):
     uptime = emulator_state.get_uptime()
     return f"Emulator uptime: {uptime}"
 
+def _format_du_size(vfs, node, size_bytes):
+    """
+    Размер для вывода du; при сжатии тел - и хранимый размер
+    """
+    formatted_size = vfs.format_size(size_bytes)
+    if vfs.blobs.compression is None:
+        return formatted_size
+    return f"{formatted_size} ({vfs.format_size(vfs.stored_size(node))} stored)"
+
 def execute_du(args, vfs):
+    """
+    Реализация команды du - размер файла или директории.
+    du -d N выводит также размеры вложенных директорий до глубины N
+    """
+    max_depth = None
+    if args and args[0] == "-d":
+        if len(args) < 2 or not args[1].isdigit():
+            return "Error: du -d requires a non-negative depth\nUsage: du [-d N] [path]"
+        max_depth = int(args[1])
+        args = args[2:]
+    
     if not args:
         path = vfs.current_path
     else:
@@ -84,14 +275,16 @@ def execute_du(args, vfs):
     if not node:
         return f"Error: Path '{path}' not found"
     
-    # Вычисляем размер
-    size_bytes = vfs.calculate_directory_size(path)
-    formatted_size = vfs.format_size(size_bytes)
+    if max_depth is None or node.type == 'file':
+        # Вычисляем размер
+        size_bytes = vfs.calculate_directory_size(path)
+        return f"{_format_du_size(vfs, node, size_bytes)}\t{path}"
     
-    if node.type == 'file':
-        return f"{formatted_size}\t{path}"
-    else:
-        return f"{formatted_size}\t{path}"
+    lines = []
+    for subdir, size_bytes in vfs.directory_size_report(node, max_depth):
+        display_path = path if subdir is node else subdir.path
+        lines.append(f"{_format_du_size(vfs, subdir, size_bytes)}\t{display_path}")
+    return "\n".join(lines)
     
 def execute_echo(args, vfs):
 
@@ -103,19 +296,38 @@ def execute_echo(args, vfs):
 
     return output
 
+def execute_export(args, vfs):
+    """
+    Реализация команды export - переменная окружения текущей сессии
+    """
+    if not args:
+        return "\n".join(f"{name}={value}" for name, value in sorted(vfs.session.env.items()))
+    
+    for arg in args:
+        name, separator, value = arg.partition('=')
+        if not separator or not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', name):
+            return f"Error: Invalid assignment '{arg}'\nUsage: export NAME=value"
+        vfs.session.env[name] = value
+    return ""
+
 def execute_chmod(args, vfs):
     """
-    Реализация команды chmod - изменение прав доступа
+    Реализация команды chmod - изменение прав доступа.
+    chmod [-R] mode path; mode - '755', 'rwxr-xr-x' или символьный 'u+x,go-w'
     """
+    recursive = False
+    if args and args[0] == "-R":
+        recursive = True
+        args = args[1:]
+    
     if len(args) < 2:
-        return "Error: chmod requires permissions and path arguments\nUsage: chmod permissions path"
+        return "Error: chmod requires permissions and path arguments\nUsage: chmod [-R] permissions path"
     
     permissions = args[0]
     path = args[1]
     
-    # Валидация формата прав (упрощенная)
     if not is_valid_permissions(permissions):
-        return f"Error: Invalid permissions format '{permissions}'. Use format like '755' or 'rwxr-xr-x'"
+        return f"Error: Invalid permissions format '{permissions}'. Use format like '755', 'rwxr-xr-x' or 'u+x,go-w'"
     
     # Находим узел
     node = vfs.get_node(path)
@@ -123,25 +335,19 @@ def execute_chmod(args, vfs):
         return f"Error: Path '{path}' not found"
     
     # Меняем права
-    result = vfs.change_permissions(path, permissions)
+    result = vfs.change_permissions(path, permissions, recursive=recursive)
     if result.startswith("Error:"):
         return result
     
+    if recursive:
+        return f"Permissions changed to {permissions} for {path} recursively"
     return f"Permissions changed to {permissions} for {path}"
 
 def is_valid_permissions(permissions):
     """
     Проверяет корректность формата прав доступа
     """
-    # Проверяем числовой формат (755)
-    if permissions.isdigit() and len(permissions) == 3:
-        return all(0 <= int(digit) <= 7 for digit in permissions)
-    
-    # Проверяем символьный формат (rwxr-xr-x)
-    if len(permissions) == 9 and all(c in 'rwx-' for c in permissions):
-        return True
-    
-    return False
+    return parse_mode(permissions) is not None
 
 def execute_cp(args, vfs):
     """
@@ -169,14 +375,240 @@ def execute_vfs_load(args, vfs):
     """
     Реализация команды vfs-load - загрузка новой VFS
     """
+    # --lazy - отображать CSV в память и декодировать содержимое по требованию
+    lazy = "--lazy" in args
+    args = [arg for arg in args if arg != "--lazy"]
+    
     if len(args) < 1:
-        return "Error: vfs-load requires a path argument\nUsage: vfs-load path/to/vfs.csv"
+        return "Error: vfs-load requires a path argument\nUsage: vfs-load [--lazy] path/to/vfs.csv|snapshot"
     
     csv_path = args[0]
     
-    # Загружаем новую VFS
+    # Загружаем новую VFS (формат - CSV или снимок - определяется автоматически)
     try:
-        vfs.load_from_csv(csv_path)
+        if not vfs.load(csv_path, lazy=lazy):
+            # Причина уже выведена загрузчиком
+            return f"Error: Failed to load VFS from {csv_path}"
         return f"VFS loaded successfully from {csv_path}"
     except Exception as e:
-        return f"Error loading VFS: {e}"
\ No newline at end of file
+        return f"Error loading VFS: {e}"
+
+def execute_vfs_reload(args, vfs):
+    """
+    Реализация команды vfs-reload - инкрементальное перечитывание исходного CSV
+    """
+    # --watch / --no-watch - включить или выключить проверку mtime перед каждой командой
+    if args == ["--watch"] or args == ["--no-watch"]:
+        if vfs.source_path is None:
+            return "Error: No CSV image loaded"
+        vfs.watch = args[0] == "--watch"
+        return f"Watching {vfs.source_path} for changes" if vfs.watch else "Watch mode disabled"
+    if args:
+        return "Error: Invalid arguments\nUsage: vfs-reload [--watch|--no-watch]"
+    
+    return vfs.reload()
+
+def execute_vfs_save(args, vfs):
+    """
+    Реализация команды vfs-save - сохранение VFS в бинарный снимок
+    """
+    if len(args) < 1:
+        return "Error: vfs-save requires a path argument\nUsage: vfs-save path/to/image.vfssnap"
+    
+    snapshot_path = args[0]
+    
+    result = vfs.save_snapshot(snapshot_path)
+    if result.startswith("Error:"):
+        return result
+    
+    return f"VFS saved to {snapshot_path}"
+
+def execute_vfs_export(args, vfs):
+    """
+    Реализация команды vfs-export - потоковая выгрузка VFS в CSV или tar.
+    vfs-export path [--format csv|tar] [--gzip]
+    """
+    from exporter import EXPORT_FORMATS, export_vfs
+    
+    usage = "Usage: vfs-export path [--format csv|tar] [--gzip]"
+    export_format = None
+    compress = None
+    paths = []
+    i = 0
+    while i < len(args):
+        if args[i] == "--format":
+            if i + 1 >= len(args) or args[i + 1] not in EXPORT_FORMATS:
+                return f"Error: --format requires csv or tar\n{usage}"
+            export_format = args[i + 1]
+            i += 2
+            continue
+        if args[i] == "--gzip":
+            compress = True
+        else:
+            paths.append(args[i])
+        i += 1
+    
+    if len(paths) != 1:
+        return f"Error: vfs-export requires a path argument\n{usage}"
+    return export_vfs(vfs, paths[0], export_format, compress)
+
+def execute_vfs_stats(args, vfs):
+    """
+    Реализация команды vfs-stats - реальная память образа и самые большие поддеревья.
+    vfs-stats [--top N]
+    """
+    from vfs_stats import DEFAULT_TOP, collect_stats, format_stats
+    
+    top = DEFAULT_TOP
+    if args:
+        if len(args) != 2 or args[0] != "--top" or not args[1].isdigit():
+            return "Error: Invalid arguments\nUsage: vfs-stats [--top N]"
+        top = int(args[1])
+    if vfs.root is None:
+        return "Error: VFS is not loaded"
+    return format_stats(vfs, collect_stats(vfs, top))
+
+def execute_vfs_compact(args, vfs):
+    """
+    Реализация команды vfs-compact - перенос журнала изменений в базовый образ
+    """
+    from journal import compact
+    
+    if args:
+        return "Error: vfs-compact takes no arguments\nUsage: vfs-compact"
+    return compact(vfs)
+
+def execute_vfs_dedup(args, vfs):
+    """
+    Реализация команды vfs-dedup - статистика дедупликации содержимого файлов
+    """
+    if args:
+        return "Error: vfs-dedup takes no arguments\nUsage: vfs-dedup"
+    return vfs.blobs.report()
+
+def execute_mount(args, vfs):
+    """
+    Реализация команды mount - подключение образа в директорию поверх ее содержимого.
+    mount [--lazy] образ путь; без аргументов - список подключенных образов
+    """
+    lazy = "--lazy" in args
+    args = [arg for arg in args if arg != "--lazy"]
+    
+    if not args and not lazy:
+        if not vfs.mounts:
+            return "No images mounted"
+        return "\n".join(mount.describe() for mount in vfs.mounts)
+    if len(args) != 2:
+        return "Error: mount requires an image and a path\nUsage: mount [--lazy] image.csv /path"
+    
+    result = vfs.mount(args[0], args[1], lazy=lazy)
+    if result.startswith("Error"):
+        return result
+    return f"Mounted {args[0]} on {args[1]}"
+
+def execute_vfs_diff(args, vfs):
+    """
+    Реализация команды vfs-diff - сравнение двух образов по хэшам поддеревьев.
+    vfs-diff a.csv b.csv
+    """
+    from vfs_diff import diff_images
+    
+    if len(args) != 2:
+        return "Error: vfs-diff requires two image paths\nUsage: vfs-diff a.csv b.csv"
+    return diff_images(args[0], args[1])
+
+def execute_find(args, vfs):
+    """
+    Реализация команды find - поиск по имени через индекс имен.
+    find [path] -name pattern
+    """
+    if "-name" not in args or args.index("-name") + 1 >= len(args):
+        return "Error: find requires -name pattern\nUsage: find [path] -name pattern"
+    
+    name_position = args.index("-name")
+    pattern = args[name_position + 1]
+    paths = args[:name_position]
+    path = paths[0] if paths else vfs.current_path
+    
+    result = vfs.find(path, pattern)
+    if isinstance(result, str):
+        return result  # Возвращаем ошибку
+    
+    return "\n".join(result)
+
+def execute_grep(args, vfs, stdin=None):
+    """
+    Реализация команды grep - поиск по регулярному выражению в содержимом файлов.
+    grep [-i] pattern [path]; в конвейере без пути фильтрует строки входа
+    """
+    flags = 0
+    if args and args[0] == "-i":
+        flags = re.IGNORECASE
+        args = args[1:]
+    
+    if not args:
+        return "Error: grep requires a pattern\nUsage: grep [-i] pattern [path]"
+    
+    pattern = args[0]
+    path = args[1] if len(args) > 1 else vfs.current_path
+    
+    try:
+        regex = re.compile(pattern, flags)
+    except re.error as e:
+        return f"Error: Invalid pattern '{pattern}': {e}"
+    
+    if stdin is not None and len(args) == 1:
+        return (line for line in stdin if regex.search(line))
+    
+    node = vfs.get_node(path)
+    if not node:
+        return f"Error: Path '{path}' not found"
+    
+    # Обход без материализации копий и хранилища, тела читаются по ходу
+    # поиска без кэширования в узлах (vfs.read_content)
+    files = ((file_path, content) for file_path, file_node in iter_tree(node)
+             if file_node.type == 'file' for content in (read_content(file_node),) if content)
+    
+    return "\n".join(grep_files(pattern, flags, files))
+
+def execute_sha256sum(args, vfs, stdin=None):
+    """
+    Реализация команды sha256sum - контрольные суммы файлов. sha256sum [путь ...];
+    для директории выводится хэш всего поддерева (права, имена и содержимое),
+    в конвейере без пути - хэш входа
+    """
+    from vfs import compute_digest
+    
+    if not args:
+        if stdin is None:
+            return "Error: sha256sum requires a path or piped input\nUsage: sha256sum path [path ...]"
+        digest = hashlib.sha256()
+        for line in stdin:
+            digest.update(line.encode('utf-8') + b'\n')
+        return f"{digest.hexdigest()}  -"
+    
+    nodes = []
+    for path in args:
+        node = vfs.get_node(path)
+        if not node:
+            return f"Error: Path '{path}' not found"
+        nodes.append((path, node))
+    return "\n".join(f"{compute_digest(node).hex()}  {path}" for path, node in nodes)
+
+def execute_diff(args, vfs):
+    """
+    Реализация команды diff - сравнение двух файлов или поддеревьев по хэшам.
+    diff path1 path2; одинаковые поддеревья пропускаются без обхода
+    """
+    from vfs_diff import diff_trees
+    
+    if len(args) != 2:
+        return "Error: diff requires two paths\nUsage: diff path1 path2"
+    
+    nodes = []
+    for path in args:
+        node = vfs.get_node(path)
+        if not node:
+            return f"Error: Path '{path}' not found"
+        nodes.append(node)
+    return diff_trees(nodes[0], nodes[1], args[0], args[1])
\ No newline at end of file
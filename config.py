@@ -1,13 +1,58 @@
 import argparse
 
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_size(text):
+    """
+    Размер с необязательным суффиксом: '500000', '512K', '256M', '2G'
+    """
+    value = text.strip().upper().removesuffix('B')
+    multiplier = SIZE_UNITS.get(value[-1:], 1)
+    if value[-1:] in SIZE_UNITS:
+        value = value[:-1]
+    if not value.isdigit():
+        raise argparse.ArgumentTypeError(f"invalid size '{text}' (use e.g. 512M or 2G)")
+    return int(value) * multiplier
+
+def parse_mount(text):
+    """
+    Подключение образа: 'users.csv:/home' -> ('users.csv', '/home')
+    """
+    image_path, _, mount_path = text.rpartition(':')
+    if not image_path or not mount_path.startswith('/'):
+        raise argparse.ArgumentTypeError(f"invalid mount '{text}' (use IMAGE:/path)")
+    return image_path, mount_path
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Emulator CLI')
     
     # Добавляем аргументы
     parser.add_argument('--vfs-path', 
-                       help='Path to VFS CSV file')
+                       help='Path to VFS CSV file or binary snapshot')
     parser.add_argument('--start-script',
                        help='Path to startup script file')
+    parser.add_argument('--lazy-load', action='store_true',
+                       help='Memory-map the VFS CSV and decode file contents on first access')
+    parser.add_argument('--node-store', choices=['objects', 'columnar'], default='objects',
+                       help='Node storage backend: Python objects or compact columnar arrays')
+    parser.add_argument('--load-workers', type=int, default=1, metavar='N',
+                       help='Parse the VFS CSV in N worker processes (non-lazy object store only)')
+    parser.add_argument('--watch-vfs', action='store_true',
+                       help='Poll the VFS CSV mtime and apply changes incrementally before each command')
+    parser.add_argument('--journal', action='store_true',
+                       help='Append chmod/cp to <image>.journal and replay it on load')
+    parser.add_argument('--memory-quota', type=parse_size, metavar='SIZE',
+                       help='Fail loads, cp and writes that would grow the image past SIZE (e.g. 512M)')
+    parser.add_argument('--compress-content', nargs='?', const='zlib', choices=['zlib', 'lzma'],
+                       help='Keep file bodies above the threshold compressed in memory (default: zlib)')
+    parser.add_argument('--compress-threshold', type=parse_size, default='1K', metavar='SIZE',
+                       help='Smallest file body to compress with --compress-content (default: 1K)')
+    parser.add_argument('--mount', type=parse_mount, action='append', default=[], metavar='IMAGE:PATH',
+                       help='Overlay another VFS image at PATH; it is parsed on first access (repeatable)')
+    parser.add_argument('--serve', metavar='ADDRESS',
+                       help='Serve concurrent sessions over TCP (host:port) or a Unix socket (unix:/path)')
+    parser.add_argument('--profile', nargs='?', const='emulator.prof', metavar='PATH',
+                       help='Run the startup script under cProfile and dump stats to PATH (default: emulator.prof)')
     
     # Парсим аргументы
     args = parser.parse_args()
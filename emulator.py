@@ -1,9 +1,22 @@
-from parser import parse_command
+from parser import parse_pipeline
 from config import parse_arguments
-from script_runner import execute_script_file
+from script_runner import compile_script_file
 from vfs import VirtualFileSystem
-from commands import execute_ls, execute_cd, execute_pwd, execute_whoami, execute_uptime, execute_du, execute_echo, execute_chmod, execute_cp, execute_vfs_load
+from metrics import CommandMetrics
+from commands import iter_lines, execute_cat, execute_head, execute_tail, execute_wc, execute_sort, execute_ls, execute_cd, execute_pwd, execute_whoami, execute_uptime, execute_du, execute_echo, execute_export, execute_chmod, execute_cp, execute_vfs_load, execute_vfs_reload, execute_vfs_save, execute_vfs_export, execute_vfs_compact, execute_vfs_dedup, execute_vfs_stats, execute_vfs_diff, execute_mount, execute_find, execute_grep, execute_sha256sum, execute_diff
+from jobs import JobTable, install_job_stdout
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import atexit
+import contextlib
+import io
+import signal
 import time
+import cProfile
+import pstats
+
+# Строка, завершающая ответ сервера на одну команду
+END_OF_OUTPUT = '\x04'
 
 class EmulatorState:
     """
@@ -11,6 +24,10 @@ class EmulatorState:
     """
     def __init__(self):
         self.start_time = time.time()
+        self.metrics = CommandMetrics()  # счетчики и задержки команд
+        # Для текущей команды конвейера: вход (итератор строк) и идет ли вывод дальше
+        self.stdin = None
+        self.piped = False
     
     def get_uptime(self):
         """
@@ -37,90 +54,430 @@ def display_startup_info(vfs_path, start_script):
     print(f"Start script: {start_script if start_script else '(not specified)'}")
     print("=== Starting emulator ===")
 
-def execute_command(command, args, vfs, emulator_state): 
+# Таблица команд: имя -> обработчик(args, vfs, emulator_state)
+COMMANDS = {
+    "exit": None,  # обрабатывается в execute_command
+    "ls": lambda args, vfs, state: execute_ls(args, vfs, state.piped),
+    "cd": lambda args, vfs, state: execute_cd(args, vfs),
+    "pwd": lambda args, vfs, state: execute_pwd(args, vfs),
+    "whoami": lambda args, vfs, state: execute_whoami(args, vfs),
+    "uptime": lambda args, vfs, state: execute_uptime(args, vfs, state),
+    "du": lambda args, vfs, state: execute_du(args, vfs),
+    "echo": lambda args, vfs, state: execute_echo(args, vfs),
+    "export": lambda args, vfs, state: execute_export(args, vfs),
+    "chmod": lambda args, vfs, state: execute_chmod(args, vfs),
+    "cp": lambda args, vfs, state: execute_cp(args, vfs),
+    "vfs-load": lambda args, vfs, state: execute_vfs_load(args, vfs),
+    "vfs-reload": lambda args, vfs, state: execute_vfs_reload(args, vfs),
+    "vfs-save": lambda args, vfs, state: execute_vfs_save(args, vfs),
+    "vfs-export": lambda args, vfs, state: execute_vfs_export(args, vfs),
+    "vfs-compact": lambda args, vfs, state: execute_vfs_compact(args, vfs),
+    "vfs-dedup": lambda args, vfs, state: execute_vfs_dedup(args, vfs),
+    "vfs-stats": lambda args, vfs, state: execute_vfs_stats(args, vfs),
+    "vfs-diff": lambda args, vfs, state: execute_vfs_diff(args, vfs),
+    "mount": lambda args, vfs, state: execute_mount(args, vfs),
+    "find": lambda args, vfs, state: execute_find(args, vfs),
+    "grep": lambda args, vfs, state: execute_grep(args, vfs, state.stdin),
+    "cat": lambda args, vfs, state: execute_cat(args, vfs, state.stdin),
+    "head": lambda args, vfs, state: execute_head(args, vfs, state.stdin),
+    "tail": lambda args, vfs, state: execute_tail(args, vfs, state.stdin),
+    "wc": lambda args, vfs, state: execute_wc(args, vfs, state.stdin),
+    "sort": lambda args, vfs, state: execute_sort(args, vfs, state.stdin),
+    "sha256sum": lambda args, vfs, state: execute_sha256sum(args, vfs, state.stdin),
+    "diff": lambda args, vfs, state: execute_diff(args, vfs),
+    "stats": lambda args, vfs, state: execute_stats(args, state),
+    "time": None,  # обрабатывается в execute_command
+}
+
+# Команды, недоступные удаленным сессиям сервера: они читают и пишут
+# произвольные файлы хоста или заменяют образ, общий для всех сессий
+HOST_COMMANDS = ("vfs-load", "vfs-reload", "vfs-save", "vfs-export", "vfs-compact", "vfs-diff", "mount")
+SESSION_COMMANDS = {name: handler for name, handler in COMMANDS.items() if name not in HOST_COMMANDS}
+
+def execute_stats(args, emulator_state):
+    """
+    Реализация команды stats - число вызовов и задержки команд (p50/p95/p99)
+    """
+    if args and args[0] == "--reset":
+        emulator_state.metrics.reset()
+        return "Command statistics reset"
+    return emulator_state.metrics.report()
+
+def execute_time(args, vfs, emulator_state, commands=COMMANDS):
+    """
+    Реализация встроенной команды time - время выполнения одной команды
+    """
+    if not args:
+        return "continue", "Error: time requires a command\nUsage: time command [args]"
+    
+    start = time.perf_counter()
+    result_type, output = execute_command(args[0], args[1:], vfs, emulator_state, commands)
+    if output is not None and not isinstance(output, str):
+        # Потоковый вывод читается до конца внутри замера
+        output = "\n".join(output)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    timing = f"real {elapsed_ms:.3f} ms"
+    return result_type, f"{output}\n{timing}" if output else timing
+
+def execute_command(command, args, vfs, emulator_state, commands=COMMANDS): 
     if command == "exit":
         return "exit", None
-    elif command == "ls":
-        result = execute_ls(args, vfs)
-        return "continue", result
-    elif command == "cd":
-        result = execute_cd(args, vfs)
-        return "continue", result
-    elif command == "pwd":
-        result = execute_pwd(args, vfs)
-        return "continue", result
-    elif command == "whoami":
-        result = execute_whoami(args, vfs)
-        return "continue", result
-    elif command == "uptime":
-        result = execute_uptime(args, vfs, emulator_state)  
-        return "continue", result
-    elif command == "du":
-        result = execute_du(args, vfs)
-        return "continue", result
-    elif command == "echo":
-        result = execute_echo(args, vfs)
-        return "continue", result
-    elif command == "chmod":
-        result = execute_chmod(args, vfs)
-        return "continue", result
-    elif command == "cp":
-        result = execute_cp(args, vfs)
-        return "continue", result
-    elif command == "vfs-load":
-        result = execute_vfs_load(args, vfs)
-        return "continue", result
-    else:
+    if command == "time":
+        return execute_time(args, vfs, emulator_state, commands)
+    
+    handler = commands.get(command)
+    if handler is None:
+        if command in COMMANDS:
+            return "continue", f"Error: command '{command}' is not available in server sessions"
         return "continue", f"Error: command '{command}' not found"
-def main():
-    args = parse_arguments()
     
-    vfs = VirtualFileSystem()
-    emulator_state = EmulatorState() 
+    # Режим наблюдения: изменившийся образ перечитывается перед командой
+    reloaded = vfs.poll_reload()
+    if reloaded:
+        print(reloaded)
     
-    display_startup_info(args.vfs_path, args.start_script)
+    result = emulator_state.metrics.measure(command, handler, args, vfs, emulator_state)
+    return "continue", result
+
+def is_error(output):
+    return isinstance(output, str) and output.startswith("Error")
+
+def execute_pipeline(stages, redirect, vfs, emulator_state, commands=COMMANDS):
+    """
+    Выполняет конвейер cmd1 | cmd2 ... [> файл | >> файл]. Вывод команды
+    передается следующей как итератор строк, поэтому строки идут по одной.
+    commands - таблица доступных команд (у сессий сервера - SESSION_COMMANDS)
+    """
+    result_type, output = "continue", None
+    last = len(stages) - 1
+    try:
+        for index, (command, args) in enumerate(stages):
+            emulator_state.stdin = None if index == 0 else iter_lines(output)
+            emulator_state.piped = index < last or redirect is not None
+            result_type, output = execute_command(command, args, vfs, emulator_state, commands)
+            if result_type == "exit" or is_error(output):
+                return result_type, output
+    finally:
+        emulator_state.stdin = None
+        emulator_state.piped = False
     
-    # Если указан VFS путь - загружаем VFS
-    if args.vfs_path:
-        vfs.load_from_csv(args.vfs_path)
+    if redirect is not None:
+        operator, path = redirect
+        content = "".join(line + "\n" for line in iter_lines(output))
+        result = vfs.write_file(path, content, append=operator == ">>")
+        output = result if is_error(result) else None
+    return result_type, output
+
+def print_output(output):
+    """
+    Печатает вывод команды; потоковый вывод - по мере появления строк
+    """
+    if not output:
+        return
+    if isinstance(output, str):
+        print(output)
+    else:
+        for line in output:
+            print(line)
+
+def run_start_script(script_path, vfs, emulator_state):
+    """
+    Выполняет стартовый скрипт; возвращает True, если скрипт вызвал exit
+    """
+    print(f"\nExecuting startup script: {script_path}")
+    # Скрипт компилируется один раз (план кэшируется на диске),
+    # неизвестные команды сообщаются до начала выполнения
+    script_steps = compile_script_file(script_path, COMMANDS)
     
-    # Если указан стартовый скрипт - выполняем его
-    if args.start_script:
-        print(f"\nExecuting startup script: {args.start_script}")
-        script_commands = execute_script_file(args.start_script)
+    for step in script_steps:
+        print(f"[vfs] $ {step.source}")
         
-        for command_line in script_commands:
-            print(f"[vfs] $ {command_line}")
-            
-            command, args_list = parse_command(command_line)
-            if command is None:
-                continue
-                
-            result_type, output = execute_command(command, args_list, vfs, emulator_state)  # НОВОЕ - передаем состояние
-            
-            if output:
-                print(output)
+        stages, redirect = step.resolve(vfs.session.env)
             
+        result_type, output = execute_pipeline(stages, redirect, vfs, emulator_state)
+        print_output(output)
+        
+        if result_type == "exit":
+            return True
+    return False
+
+def run_session_command(command_line, session, vfs, emulator_state):
+    """
+    Выполняет строку команды от имени сессии сервера (в потоке образа,
+    см. serve). Доступны только команды SESSION_COMMANDS.
+    Все, что команда печатает (предупреждения, ошибки разбора), попадает
+    в ответ клиенту
+    """
+    vfs.session = session
+    captured = io.StringIO()
+    with contextlib.redirect_stdout(captured):
+        stages, redirect = parse_pipeline(command_line, session.env)
+        if not stages:
+            result_type, output = "continue", None
+        else:
+            result_type, output = execute_pipeline(stages, redirect, vfs, emulator_state, SESSION_COMMANDS)
+        print_output(output)
+    return result_type, captured.getvalue()
+
+async def handle_session(reader, writer, vfs, emulator_state, vfs_thread):
+    """
+    Одно подключение - одна сессия со своей текущей директорией и окружением.
+    Команды выполняются вне цикла событий, чтобы тяжелая команда (du /)
+    не останавливала прием подключений и ввод-вывод остальных клиентов.
+    Общий образ не рассчитан на одновременные изменения, поэтому команды
+    всех сессий идут по очереди в одном потоке образа vfs_thread
+    """
+    session = vfs.new_session()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command_line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+            result_type, output = await asyncio.get_running_loop().run_in_executor(
+                vfs_thread, run_session_command, command_line, session, vfs, emulator_state)
+            writer.write(f"{output}{END_OF_OUTPUT}\n".encode('utf-8'))
+            await writer.drain()
             if result_type == "exit":
-                print("Goodbye!")
-                return
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
 
-    print("\nEntering interactive mode...")
+async def serve(address, vfs, emulator_state):
+    """
+    Сервер сессий: address - 'host:port' или 'unix:/path/to.sock'
+    """
+    raise_open_files_limit()
+    # Единственный поток образа - он же очередь команд всех сессий
+    vfs_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='vfs')
+    handler = lambda reader, writer: handle_session(reader, writer, vfs, emulator_state, vfs_thread)
+    if address.startswith('unix:'):
+        server = await asyncio.start_unix_server(handler, path=address[len('unix:'):], backlog=4096)
+    else:
+        host, _, port = address.rpartition(':')
+        server = await asyncio.start_server(handler, host or '127.0.0.1', int(port), backlog=4096)
+    print(f"Serving on {address}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+def raise_open_files_limit():
+    """
+    Каждая сессия - открытый сокет: поднимаем мягкий лимит дескрипторов до жесткого
+    """
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard == resource.RLIM_INFINITY or soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def split_background(command_line):
+    """
+    Отделяет завершающий '&' (запуск в фоне): 'du / &' -> ('du /', True)
+    """
+    stripped = command_line.rstrip()
+    if stripped.endswith('&') and not stripped.endswith('\\&'):
+        return stripped[:-1].rstrip(), True
+    return command_line, False
+
+def report_job(job):
+    print(job.describe())
+    output = "".join(job.output).rstrip("\n")
+    if output:
+        print(output)
+
+def run_job_command(command, args, table):
+    """
+    Команды управления заданиями: jobs, kill %N. Возвращает текст вывода
+    """
+    if command == "jobs":
+        output = "\n".join(job.describe() for job in table.jobs.values())
+        table.pop_finished()  # о завершенных уже сообщено этим списком
+        return output
+    
+    if not args:
+        return "Error: kill requires a job\nUsage: kill %N"
+    output = []
+    for spec in args:
+        job = table.get(spec)
+        if job is None:
+            output.append(f"Error: No such job '{spec}'")
+        elif job.status == 'Running':
+            job.cancel()
+            output.append(f"[{job.number}]  Cancelling {job.command_line}")
+        else:
+            output.append(f"[{job.number}]  {job.status} {job.command_line}")
+    return "\n".join(output)
+
+async def wait_jobs(args, table):
+    """
+    wait [%N ...] - ждет завершения заданий (без аргументов - всех) и печатает их вывод
+    """
+    targets = []
+    for spec in args:
+        job = table.get(spec)
+        if job is None:
+            print(f"Error: No such job '{spec}'")
+            return
+        targets.append(job)
+    if not args:
+        targets = list(table.jobs.values())
+    
+    running = [job.task for job in targets if job.status == 'Running']
+    if running:
+        await asyncio.wait(running)
+    for job in targets:
+        if not job.reported:
+            job.reported = True
+            table.jobs.pop(job.number, None)
+            report_job(job)
+
+async def interactive_loop(vfs, emulator_state):
+    """
+    Интерактивный режим на asyncio: команды выполняются в рабочих потоках
+    (см. jobs.py), 'cmd &' запускает команду в фоне, jobs/wait/kill управляют
+    заданиями, Ctrl-C отменяет текущую команду или ожидание
+    """
+    table = JobTable()
+    install_job_stdout()
+    loop = asyncio.get_running_loop()
+    foreground = None  # текущее задание или ожидание wait
+    
+    def interrupt():
+        # Задание (Job) отменяется на ближайшем checkpoint(), ожидание wait - сразу
+        if foreground is None:
+            print()
+        else:
+            foreground.cancel()
+    
+    with contextlib.suppress(NotImplementedError, RuntimeError):
+        loop.add_signal_handler(signal.SIGINT, interrupt)
+    
     while True:
-        command_line = input("[vfs] $ ")
-        command, args_list = parse_command(command_line)
+        for job in table.pop_finished():
+            report_job(job)
+        
+        try:
+            command_line = await asyncio.to_thread(input, "[vfs] $ ")
+        except EOFError:
+            command_line = "exit"
+        command_line, background = split_background(command_line)
+        stages, redirect = parse_pipeline(command_line, vfs.session.env)
+        
+        if not stages:
+            continue
+        
+        command, args = stages[0]
+        if command == "exit":
+            running = table.running()
+            for job in running:
+                job.cancel()
+            if running:
+                await asyncio.wait([job.task for job in running])
+                print(f"Cancelled {len(running)} running job(s)")
+            print("Goodbye!")
+            break
         
-        if command is None:
+        if command in ("jobs", "kill", "wait") and len(stages) == 1 and redirect is None:
+            if command == "wait":
+                foreground = asyncio.ensure_future(wait_jobs(args, table))
+                try:
+                    await foreground
+                except asyncio.CancelledError:
+                    print("wait: interrupted")
+                finally:
+                    foreground = None
+            else:
+                print_output(run_job_command(command, args, table))
             continue
         
-        result_type, output = execute_command(command, args_list, vfs, emulator_state)  # НОВОЕ - передаем состояние
+        def run(stages=stages, redirect=redirect):
+            result_type, output = execute_pipeline(stages, redirect, vfs, emulator_state)
+            print_output(output)
+            return result_type
         
-        if output:
-            print(output)
-            
-        if result_type == "exit":
+        job = table.start(command_line, run, background)
+        if background:
+            print(f"[{job.number}] {command_line}")
+            continue
+        
+        foreground = job
+        try:
+            await asyncio.wait([job.task])
+        finally:
+            foreground = None
+        if job.status == 'Cancelled':
+            print("Interrupted")
+        elif job.output:
+            print("".join(job.output).rstrip("\n"))
+        if job.result_type == "exit":
             print("Goodbye!")
             break
 
+def dump_profile(profiler, profile_path):
+    """
+    Сохраняет результаты cProfile и печатает самые затратные функции
+    """
+    profiler.dump_stats(profile_path)
+    print(f"\n=== Profile saved to {profile_path} ===")
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+
+def main():
+    args = parse_arguments()
+    
+    vfs = VirtualFileSystem(node_store=args.node_store)
+    vfs.load_workers = max(args.load_workers, 1)
+    vfs.watch = args.watch_vfs
+    vfs.journaling = args.journal
+    vfs.memory_quota = args.memory_quota
+    vfs.content_compression = args.compress_content
+    vfs.compress_threshold = args.compress_threshold
+    # Незасинхронизированные записи журнала сбрасываются при любом завершении
+    atexit.register(vfs.close_journal)
+    emulator_state = EmulatorState() 
+    
+    display_startup_info(args.vfs_path, args.start_script)
+    
+    # Если указан VFS путь - загружаем VFS
+    if args.vfs_path:
+        vfs.load(args.vfs_path, lazy=args.lazy_load)
+    
+    # Образы --mount подключаются сразу, а разбираются при первом обращении
+    for image_path, mount_path in args.mount:
+        result = vfs.mount(image_path, mount_path, lazy=args.lazy_load)
+        if result.startswith("Error"):
+            print(result)
+    
+    # Если указан стартовый скрипт - выполняем его
+    if args.start_script:
+        if args.profile:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                exited = run_start_script(args.start_script, vfs, emulator_state)
+            finally:
+                profiler.disable()
+                dump_profile(profiler, args.profile)
+        else:
+            exited = run_start_script(args.start_script, vfs, emulator_state)
+        
+        if exited:
+            print("Goodbye!")
+            return
+    
+    if args.serve:
+        try:
+            asyncio.run(serve(args.serve, vfs, emulator_state))
+        except KeyboardInterrupt:
+            print("Server stopped")
+        return
+
+    print("\nEntering interactive mode...")
+    asyncio.run(interactive_loop(vfs, emulator_state))
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
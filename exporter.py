@@ -0,0 +1,198 @@
+"""
+Потоковая выгрузка VFS в CSV-образ или tar-архив.
+
+Дерево обходится без создания объектов: копии (cp), еще разделяющие
+детей с источником, и директории колоночного хранилища читаются прямо
+из источника, а содержимое лениво загруженных файлов декодируется на
+время записи и не кэшируется в узлах. Поэтому память не растет с
+размером образа - в ней только стек обхода и текущая запись.
+
+Сжатие gzip выполняется в отдельном потоке: zlib отпускает GIL, и обход
+дерева идет параллельно со сжатием. Очередь между потоками ограничена,
+так что сжатие не может отстать на неограниченный объем данных.
+"""
+import base64
+import csv
+import gzip
+import os
+import queue
+import tarfile
+import threading
+import time
+
+from vfs import _record_digest, iter_tree, read_content
+
+CSV_FIELDS = ['type', 'path', 'name', 'content', 'encoding', 'permissions']
+EXPORT_FORMATS = ('csv', 'tar')
+# Размер куска, передаваемого потоку сжатия, и сколько кусков может ждать в очереди
+GZIP_CHUNK = 256 * 1024
+GZIP_QUEUE = 8
+GZIP_LEVEL = 6
+
+
+def csv_content(node):
+    """
+    Значение поля content в CSV: содержимое в base64 кодируется обратно
+    """
+    content = read_content(node)
+    if node.encoding == 'base64' and content:
+        content = base64.b64encode(content.encode('utf-8')).decode('ascii')
+    return content
+
+
+class ThreadedGzipWriter:
+    """
+    Файловый объект для записи: данные копятся кусками по GZIP_CHUNK
+    и сжимаются в gzip фоновым потоком
+    """
+    def __init__(self, path, name):
+        # name - имя итогового файла для заголовка gzip (пишется во временный)
+        self._file = open(path, 'wb')
+        self._gzip = gzip.GzipFile(os.path.basename(name), 'wb', GZIP_LEVEL, self._file, mtime=0)
+        self._queue = queue.Queue(maxsize=GZIP_QUEUE)
+        self._buffer = bytearray()
+        self._error = None
+        self._thread = threading.Thread(target=self._compress, name='vfs-export-gzip', daemon=True)
+        self._thread.start()
+
+    def _compress(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            if self._error is None:
+                try:
+                    self._gzip.write(chunk)
+                except OSError as e:
+                    self._error = e
+
+    def write(self, data):
+        if self._error is not None:
+            raise self._error
+        self._buffer += data
+        if len(self._buffer) >= GZIP_CHUNK:
+            self._queue.put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def close(self):
+        if self._buffer:
+            self._queue.put(bytes(self._buffer))
+            self._buffer.clear()
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            self._gzip.close()
+        finally:
+            self._file.close()
+        if self._error is not None:
+            raise self._error
+
+
+class _TextToBytes:
+    """
+    Текстовая обертка для csv.writer поверх байтового потока
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        return self.stream.write(text.encode('utf-8'))
+
+
+def write_csv_stream(root, stream, tree=None, digests=None):
+    """
+    Пишет дерево в формате CSV-образа, возвращает число узлов.
+    tree - пары (путь, узел) вместо обхода iter_tree(root);
+    в digests (если передан) записываются хэши записей {путь: хэш} для vfs-reload
+    """
+    writer = csv.writer(_TextToBytes(stream), lineterminator='\n')
+    writer.writerow(CSV_FIELDS)
+    count = 0
+    for path, node in (iter_tree(root) if tree is None else tree):
+        content = csv_content(node) if node.type == 'file' else ''
+        writer.writerow([node.type, path, node.name, content, node.encoding, node.permissions])
+        if digests is not None:
+            digests[path] = _record_digest(node.type, node.name, content, node.encoding, node.permissions)
+        count += 1
+    return count
+
+
+def write_tar_stream(root, stream, user):
+    """
+    Пишет дерево в tar, возвращает число узлов. Заголовки пишутся напрямую
+    (TarFile хранит список всех добавленных членов и рос бы с образом).
+    Файлы base64 записываются уже декодированными
+    """
+    count = 1
+    written = 0
+    mtime = int(time.time())
+    iterator = iter_tree(root)
+    next(iterator)  # корень архива - сам каталог выгрузки
+    for path, node in iterator:
+        count += 1
+        info = tarfile.TarInfo(path[1:])
+        info.mode = node.mode
+        info.mtime = mtime
+        info.uname = info.gname = user
+        if node.type == 'directory':
+            info.type = tarfile.DIRTYPE
+            data = b''
+        else:
+            data = read_content(node).encode('utf-8')
+            info.size = len(data)
+        header = info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        padding = -len(data) % tarfile.BLOCKSIZE
+        stream.write(header)
+        stream.write(data)
+        stream.write(b'\0' * padding)
+        written += len(header) + len(data) + padding
+    
+    # Конец архива - два нулевых блока, затем добивка до размера записи
+    end = 2 * tarfile.BLOCKSIZE
+    end += -(written + end) % tarfile.RECORDSIZE
+    stream.write(b'\0' * end)
+    return count
+
+
+def export_vfs(vfs, path, export_format=None, compress=None):
+    """
+    Выгружает VFS в файл path. Формат и сжатие по умолчанию определяются
+    по расширению: .tar, .tar.gz, .tgz - tar, иначе CSV; .gz/.tgz - gzip.
+    Файл пишется во временный и переименовывается, поэтому прерванная
+    выгрузка не оставляет полузаписанный образ
+    """
+    if vfs.root is None:
+        return "Error: VFS is not loaded"
+
+    lower = path.lower()
+    if compress is None:
+        compress = lower.endswith(('.gz', '.tgz'))
+    if export_format is None:
+        export_format = 'tar' if lower.endswith(('.tar', '.tar.gz', '.tgz')) else 'csv'
+    if export_format not in EXPORT_FORMATS:
+        return f"Error: Unknown export format '{export_format}' (use csv or tar)"
+
+    tmp_path = path + '.tmp'
+    try:
+        stream = ThreadedGzipWriter(tmp_path, path) if compress else open(tmp_path, 'wb', buffering=GZIP_CHUNK)
+        try:
+            if export_format == 'tar':
+                count = write_tar_stream(vfs.root, stream, vfs.current_user)
+            else:
+                count = write_csv_stream(vfs.root, stream)
+        finally:
+            stream.close()
+        os.replace(tmp_path, path)
+    except BaseException as e:
+        # Прерванная выгрузка (ошибка записи или отмена задания) не оставляет файлов
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        if not isinstance(e, OSError):
+            raise
+        return f"Error: Cannot export VFS to '{path}': {e}"
+
+    suffix = ", gzip" if compress else ""
+    return f"Exported {count} nodes to {path} ({export_format}{suffix})"
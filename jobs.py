@@ -0,0 +1,162 @@
+"""
+Фоновые задания интерактивного режима: `cmd &`, jobs, wait %N, kill %N.
+
+Команда выполняется в рабочем потоке (asyncio.to_thread), а цикл событий
+остается свободным: приглашение ввода и команды управления заданиями
+отвечают сразу. Команды над VFS выполняются по одной под общей
+блокировкой образа - дерево не рассчитано на одновременные изменения, -
+поэтому следующая команда ждет окончания тяжелой, но ее можно отменить.
+
+Потоки нельзя прервать извне, поэтому отмена кооперативная: kill %N
+(и Ctrl-C для текущей команды) ставит флаг, а обходы дерева вызывают
+checkpoint(), который в отмененном задании выбрасывает JobCancelled.
+"""
+import asyncio
+import contextvars
+import sys
+import threading
+
+# Задание, в потоке которого выполняется код (None - вне заданий)
+_current_job = contextvars.ContextVar('vfs_job', default=None)
+# Куда пишет print() в фоновом задании (None - в терминал)
+_job_output = contextvars.ContextVar('vfs_job_output', default=None)
+
+# Как часто (в секундах) задание в очереди на блокировку проверяет отмену
+LOCK_POLL_INTERVAL = 0.1
+
+
+class JobCancelled(Exception):
+    """
+    Задание отменено командой kill или Ctrl-C
+    """
+
+
+def checkpoint():
+    """
+    Точка отмены: вызывается в циклах обхода дерева
+    """
+    job = _current_job.get()
+    if job is not None and job.cancelled:
+        raise JobCancelled()
+
+
+class JobStdout:
+    """
+    Замена sys.stdout: вывод фонового задания копится в его буфере,
+    остальной вывод идет в исходный поток
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = _job_output.get()
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Job:
+    def __init__(self, number, command_line, background):
+        self.number = number
+        self.command_line = command_line
+        self.background = background
+        self.status = 'Running'    # Running, Done, Failed, Cancelled
+        self.cancelled = False
+        self.output = []           # вывод фонового задания (куски текста)
+        self.result_type = 'continue'
+        self.task = None
+        self.reported = False      # сообщение о завершении уже напечатано
+
+    def cancel(self):
+        self.cancelled = True
+
+    def describe(self):
+        suffix = " &" if self.background else ""
+        return f"[{self.number}]  {self.status:<10}{self.command_line}{suffix}"
+
+
+class JobTable:
+    """
+    Задания сессии и блокировка образа, под которой выполняются команды
+    """
+    def __init__(self):
+        self.jobs = {}
+        self.vfs_lock = threading.Lock()
+        self._next_number = 1
+
+    def start(self, command_line, run, background):
+        """
+        Запускает run() в рабочем потоке как задание и возвращает его.
+        run выполняется под блокировкой образа, сам печатает вывод команды
+        и возвращает тип результата ("continue" или "exit").
+        Номера получают только фоновые задания
+        """
+        job = Job(self._next_number if background else 0, command_line, background)
+        if background:
+            self._next_number += 1
+            self.jobs[job.number] = job
+        job.task = asyncio.ensure_future(asyncio.to_thread(self._run, job, run))
+        job.task.add_done_callback(lambda _: self._finish(job))
+        return job
+
+    def _run(self, job, run):
+        _current_job.set(job)
+        if job.background:
+            _job_output.set(job.output)
+        # Задание в очереди за блокировкой тоже можно отменить
+        while not self.vfs_lock.acquire(timeout=LOCK_POLL_INTERVAL):
+            checkpoint()
+        try:
+            checkpoint()
+            job.result_type = run()
+        finally:
+            self.vfs_lock.release()
+
+    def _finish(self, job):
+        error = None if job.task.cancelled() else job.task.exception()
+        if job.task.cancelled() or isinstance(error, JobCancelled):
+            job.status = 'Cancelled'
+        elif error is not None:
+            job.status = 'Failed'
+            job.output.append(f"Error: {error!r}\n")
+        else:
+            job.status = 'Done'
+
+    def get(self, spec):
+        """
+        Задание по '%N' или 'N'; None - если такого нет
+        """
+        number = spec[1:] if spec.startswith('%') else spec
+        if not number.isdigit():
+            return None
+        return self.jobs.get(int(number))
+
+    def running(self):
+        return [job for job in self.jobs.values() if job.status == 'Running']
+
+    def pop_finished(self):
+        """
+        Завершенные фоновые задания, о которых еще не сообщалось; они
+        убираются из таблицы, как в shell после уведомления
+        """
+        finished = [job for job in self.jobs.values()
+                    if job.background and job.status != 'Running' and not job.reported]
+        for job in finished:
+            job.reported = True
+            del self.jobs[job.number]
+        return finished
+
+
+def install_job_stdout():
+    """
+    Подменяет sys.stdout, чтобы print() в фоновых заданиях попадал в их вывод
+    """
+    if not isinstance(sys.stdout, JobStdout):
+        sys.stdout = JobStdout(sys.stdout)
@@ -0,0 +1,188 @@
+"""
+Журнал изменений VFS (write-ahead log).
+
+chmod, cp, запись в файл (> и >>) и mount дописывают в конец файла <образ>.journal по одной JSON-строке,
+поэтому стоимость записи зависит от размера изменения, а не образа.
+fsync выполняется пачками: раз в JOURNAL_BATCH записей или не реже
+FSYNC_INTERVAL секунд, а также при выходе и загрузке другого образа.
+
+При загрузке образа журнал проигрывается поверх него. vfs-compact
+записывает текущее дерево новым базовым образом и очищает журнал:
+    1. дерево пишется во временный файл <образ>.compact.tmp (с fsync)
+    2. журнал переименовывается в <образ>.journal.compacting
+    3. временный файл заменяет базовый образ
+    4. <образ>.journal.compacting удаляется
+Если процесс упал посередине, recover() по наличию временного файла
+определяет, попал ли журнал в базовый образ.
+"""
+import json
+import os
+import time
+
+from exporter import write_csv_stream
+
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_BATCH = 64
+FSYNC_INTERVAL = 0.05
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.pending = 0  # записи, еще не сброшенные на диск
+        self.last_sync = time.monotonic()
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        os.write(self.fd, line.encode('utf-8'))
+        self.pending += 1
+        if self.pending >= JOURNAL_BATCH or time.monotonic() - self.last_sync >= FSYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        if self.pending:
+            os.fsync(self.fd)
+            self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        os.close(self.fd)
+
+
+def _compact_paths(image_path):
+    return image_path + '.compact.tmp', image_path + JOURNAL_SUFFIX + '.compacting'
+
+
+def recover(image_path):
+    """
+    Завершает прерванное сжатие журнала
+    """
+    journal_path = image_path + JOURNAL_SUFFIX
+    tmp_path, compacting_path = _compact_paths(image_path)
+    if os.path.exists(compacting_path):
+        if os.path.exists(tmp_path):
+            # Базовый образ не заменен - журнал еще нужен
+            os.replace(compacting_path, journal_path)
+        else:
+            os.remove(compacting_path)
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+
+def replay(vfs, journal_path):
+    """
+    Применяет записи журнала к загруженному дереву. Недописанная последняя
+    строка (сбой во время записи) отбрасывается. Возвращает число записей
+    """
+    applied = 0
+    good_size = 0
+    with open(journal_path, 'rb') as file:
+        for line_number, raw in enumerate(file, start=1):
+            try:
+                if not raw.endswith(b'\n'):
+                    raise ValueError("incomplete record")
+                record = json.loads(raw)
+                op = record['op']
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Warning: journal line {line_number}: {e}; ignoring the rest of the journal")
+                break
+            good_size += len(raw)
+            
+            if op == 'chmod':
+                result = vfs.change_permissions(record['path'], record['permissions'],
+                                                recursive=record.get('recursive', False))
+            elif op == 'cp':
+                result = vfs.copy_node(record['source'], record['dest'])
+            elif op == 'write':
+                result = vfs.write_file(record['path'], record['content'], record['append'])
+            elif op == 'mount':
+                result = vfs.mount(record['image'], record['path'], record.get('lazy', False))
+            else:
+                result = f"Error: unknown operation '{op}'"
+            if result.startswith("Error"):
+                print(f"Warning: journal line {line_number}: {result}")
+            else:
+                applied += 1
+    
+    # Хвост после поврежденной строки обрезается, чтобы новые записи шли за целыми
+    if os.path.getsize(journal_path) != good_size:
+        with open(journal_path, 'r+b') as file:
+            file.truncate(good_size)
+    return applied
+
+
+def open_journal(vfs, image_path):
+    """
+    Проигрывает журнал образа и подключает его для новых изменений
+    """
+    recover(image_path)
+    journal_path = image_path + JOURNAL_SUFFIX
+    if os.path.exists(journal_path):
+        applied = replay(vfs, journal_path)
+        if applied:
+            print(f"Replayed {applied} journal records from {journal_path}")
+    vfs.journal = Journal(journal_path)
+    vfs.journal_image = image_path
+
+
+def write_csv(vfs, csv_path):
+    """
+    Записывает дерево в CSV в формате образа (exporter.write_csv_stream).
+    Возвращает {путь: узел} записанного дерева и хэши записей {путь: хэш}
+    для vfs-reload
+    """
+    nodes = {}
+    digests = {}
+    
+    def tree():
+        # vfs-reload обновляет узлы дерева по путям - их нужны сами узлы,
+        # поэтому обход с материализацией, а не iter_tree
+        for node in vfs.walk(vfs.root):
+            nodes[node.path] = node
+            yield node.path, node
+    
+    with open(csv_path, 'wb') as file:
+        write_csv_stream(vfs.root, file, tree(), digests)
+        file.flush()
+        os.fsync(file.fileno())
+    return nodes, digests
+
+
+def compact(vfs):
+    """
+    Записывает текущее дерево новым базовым образом и очищает журнал
+    """
+    from snapshot import is_snapshot, write_snapshot
+    
+    if vfs.journal is None:
+        return "Error: Journaling is not enabled (start the emulator with --journal)"
+    
+    image_path = vfs.journal_image
+    journal_path = vfs.journal.path
+    tmp_path, compacting_path = _compact_paths(image_path)
+    rebased = None
+    try:
+        if is_snapshot(image_path):
+            write_snapshot(vfs.root, tmp_path)
+        else:
+            rebased, digests = write_csv(vfs, tmp_path)
+        
+        vfs.journal.close()
+        os.replace(journal_path, compacting_path)
+        os.replace(tmp_path, image_path)
+        os.remove(compacting_path)
+    except OSError as e:
+        recover(image_path)
+        vfs.journal = Journal(journal_path)
+        return f"Error: Cannot compact journal: {e}"
+    
+    vfs.journal = Journal(journal_path)
+    if rebased is not None and vfs.store is None:
+        # Дерево совпадает с новым базовым образом - vfs-reload сравнивает с ним
+        vfs.nodes = rebased
+        vfs._source_digests = digests
+        vfs.source_path = image_path
+        vfs.source_mtime = os.stat(image_path).st_mtime_ns
+    return f"Journal compacted into {image_path}"
@@ -0,0 +1,111 @@
+"""
+Счетчики вызовов и гистограммы задержек команд эмулятора.
+
+Гистограмма логарифмическая: на каждую степень двойки (в наносекундах)
+приходится 4 корзины, поэтому перцентили считаются с точностью ~25%
+при постоянной памяти и O(1) на запись.
+"""
+from time import perf_counter_ns
+
+SUB_BUCKETS = 4
+
+
+def _bucket(ns):
+    if ns < SUB_BUCKETS:
+        return ns
+    bits = ns.bit_length()
+    # Два бита после старшего определяют корзину внутри степени двойки
+    return bits * SUB_BUCKETS + ((ns >> (bits - 3)) & 0b11)
+
+
+def _bucket_upper_bound(index):
+    """
+    Верхняя граница корзины в наносекундах
+    """
+    if index < SUB_BUCKETS:
+        return index
+    bits, sub = divmod(index, SUB_BUCKETS)
+    return (5 + sub) << (bits - 3)
+
+
+def format_duration(ns):
+    if ns >= 1_000_000_000:
+        return f"{ns / 1_000_000_000:.2f} s"
+    if ns >= 1_000_000:
+        return f"{ns / 1_000_000:.2f} ms"
+    if ns >= 1_000:
+        return f"{ns / 1_000:.1f} us"
+    return f"{ns} ns"
+
+
+class CommandMetrics:
+    def __init__(self):
+        self.counts = {}      # {команда: число вызовов}
+        self.total_ns = {}    # {команда: суммарное время}
+        self.histograms = {}  # {команда: {корзина: число вызовов}}
+
+    def record(self, command, elapsed_ns):
+        histogram = self.histograms.get(command)
+        if histogram is None:
+            histogram = self.histograms[command] = {}
+            self.counts[command] = 0
+            self.total_ns[command] = 0
+        self.counts[command] += 1
+        self.total_ns[command] += elapsed_ns
+        bucket = _bucket(elapsed_ns)
+        histogram[bucket] = histogram.get(bucket, 0) + 1
+
+    def measure(self, command, handler, *args):
+        """
+        Вызывает обработчик команды и записывает его время. Для потокового
+        вывода (итератора строк) время записывается, когда вывод дочитан
+        """
+        start = perf_counter_ns()
+        try:
+            result = handler(*args)
+        except BaseException:
+            self.record(command, perf_counter_ns() - start)
+            raise
+        if result is None or isinstance(result, str):
+            self.record(command, perf_counter_ns() - start)
+            return result
+        return self._measure_stream(command, result, start)
+
+    def _measure_stream(self, command, lines, start):
+        try:
+            yield from lines
+        finally:
+            self.record(command, perf_counter_ns() - start)
+
+    def percentile(self, command, fraction):
+        histogram = self.histograms.get(command)
+        if not histogram:
+            return 0
+        target = fraction * self.counts[command]
+        seen = 0
+        for bucket in sorted(histogram):
+            seen += histogram[bucket]
+            if seen >= target:
+                return _bucket_upper_bound(bucket)
+        return _bucket_upper_bound(max(histogram))
+
+    def reset(self):
+        self.counts.clear()
+        self.total_ns.clear()
+        self.histograms.clear()
+
+    def report(self):
+        if not self.counts:
+            return "No commands recorded yet"
+        
+        lines = [f"{'command':<12}{'calls':>8}{'mean':>12}{'p50':>12}{'p95':>12}{'p99':>12}"]
+        for command in sorted(self.counts, key=lambda name: -self.total_ns[name]):
+            calls = self.counts[command]
+            lines.append(
+                f"{command:<12}{calls:>8}"
+                f"{format_duration(self.total_ns[command] // calls):>12}"
+                f"{format_duration(self.percentile(command, 0.50)):>12}"
+                f"{format_duration(self.percentile(command, 0.95)):>12}"
+                f"{format_duration(self.percentile(command, 0.99)):>12}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,167 @@
+"""
+Подключение образов поверх дерева VFS (mount) с объединением слоев (overlay).
+
+mount образ путь ставит в точку подключения директорию-копию (как при cp),
+источник которой - ImageMount. Дети точки подключения собираются из слоев:
+корня подключенного образа (верхний слой) и прежнего содержимого директории
+(нижний). При совпадении имен верхний слой закрывает нижний, а директории,
+которые есть в обоих слоях, объединяются рекурсивно (UnionDirectory).
+Сами слои не меняются: chmod, cp и запись идут в копии узлов, созданные
+при обращении, как и для любой копии-при-записи.
+
+Образ разбирается только при первом обращении к детям точки подключения
+(ls, путь внутри нее, find, du, экспорт) - запуск стоит только тех образов,
+которые сессия реально использует. Образ загружается в отдельный
+VirtualFileSystem с тем же хранилищем узлов, что и основной.
+"""
+import contextlib
+import io
+
+from vfs import PERMISSION_STRINGS, VFSNode, VirtualFileSystem, _source_children
+
+
+class UnionDirectory:
+    """
+    Источник копии-при-записи для директории из нескольких слоев (верхний первым).
+    Интерфейс - как у node_store.StoreNodeView: достаточно для _materialize
+    и обходов без материализации
+    """
+    _cow_source = None
+    _content_source = None
+    _content = ''
+    type = 'directory'
+    encoding = 'text'
+    content = ''
+    # Число узлов не кэшируется: до загрузки образа известен только нижний слой
+    node_count = None
+
+    def __init__(self, layers, name, mode):
+        self.layers = layers
+        self.name = name
+        self.mode = mode
+        self._merged = None   # {имя: узел слоя или UnionDirectory}
+        self._names = None    # отсортированные имена
+        self._cow_dependents = []
+        self.total_size = None
+        self.total_files = None
+        self.digest = None
+        self.stored_size = None
+
+    @property
+    def permissions(self):
+        return PERMISSION_STRINGS[self.mode]
+
+    def _merge(self):
+        if self._merged is None:
+            merged = {}
+            for layer in reversed(self.layers):
+                for child in _source_children(layer):
+                    below = merged.get(child.name)
+                    if below is not None and child.type == 'directory' and below.type == 'directory':
+                        child = UnionDirectory([child, below], child.name, child.mode)
+                    merged[child.name] = child
+            self._merged = merged
+            self._names = sorted(merged)
+        return self._merged
+
+    @property
+    def children(self):
+        return self._merge()
+
+    @property
+    def child_names(self):
+        self._merge()
+        return self._names
+
+    def iter_children(self, load=True):
+        merged = self._merge()
+        for name in self._names:
+            yield merged[name]
+
+    def cow_copy(self, name, path):
+        node = VFSNode('directory', path, name, '', 'text', self.mode)
+        node.total_size = self.total_size
+        node.total_files = self.total_files
+        node.digest = self.digest
+        node.stored_size = self.stored_size
+        node._cow_source = self
+        self._cow_dependents.append(node)
+        return node
+
+
+class ImageMount(UnionDirectory):
+    """
+    Точка подключения: верхний слой - корень образа image_path,
+    загружается при первом обращении к детям
+    """
+    def __init__(self, vfs, image_path, path, lazy, lower, name):
+        layers = []
+        if lower is not None:
+            # Нижний слой отделяется от источников на один уровень: если он
+            # копия (cp), изменения источника не должны стать видны в точке
+            lower.children
+            layers.append(lower)
+        super().__init__(layers, name, lower.mode if lower is not None else 0o755)
+        self.vfs = vfs
+        self.image_path = image_path
+        self.path = path
+        self.lazy = lazy
+        self.image = None   # VirtualFileSystem образа после загрузки
+        self.error = None
+
+    @property
+    def pending(self):
+        return self.image is None and self.error is None
+
+    def load(self):
+        """
+        Загружает образ, если он еще не загружен. Возвращает его VirtualFileSystem
+        или None, если загрузить не удалось (точка остается с нижним слоем)
+        """
+        if self.pending:
+            self._load()
+        return self.image
+
+    def _load(self):
+        vfs = self.vfs
+        image = VirtualFileSystem(node_store=vfs.node_store)
+        image.load_workers = vfs.load_workers
+        # Одинаковые тела в образе и в основном дереве (и в других образах)
+        # хранятся один раз
+        image.shared_blobs = vfs.blobs
+        if vfs.memory_quota is not None:
+            image.memory_quota = max(vfs.memory_quota - vfs.image_cost(), 0)
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            loaded = image.load(self.image_path, lazy=self.lazy)
+
+        if not loaded:
+            # Тела недозагруженного образа уже учтены в общем хранилище
+            for node in image.nodes.values():
+                if node.type == 'file' and node._blobs is not None:
+                    node._blobs.release(node._content)
+            errors = [line for line in output.getvalue().splitlines() if line.startswith("Error")]
+            self.error = errors[-1] if errors else f"Error: Cannot load '{self.image_path}'"
+            print(f"Warning: mount of {self.image_path} on {self.path} failed: {self.error}")
+            return
+        self.image = image
+        self.layers = [image.root] + self.layers
+        vfs._add_image_cost(image.image_cost() if vfs.memory_quota is not None else 0)
+
+    def _merge(self):
+        if self.pending:
+            self._load()
+        return super()._merge()
+
+    def iter_children(self, load=True):
+        if not load and self.pending:
+            return _source_children(self.layers[0], load_mounts=False) if self.layers else iter(())
+        return super().iter_children()
+
+    def describe(self):
+        if self.image is not None:
+            state = "loaded"
+        elif self.error is not None:
+            state = f"failed: {self.error}"
+        else:
+            state = "not loaded"
+        return f"{self.image_path} on {self.path} ({state})"
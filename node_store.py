@@ -0,0 +1,505 @@
+"""
+Колоночное хранилище узлов VFS для образов с миллионами записей.
+
+Вместо объекта VFSNode на каждый узел все атрибуты хранятся в типизированных
+массивах (array), по одному элементу на узел: тип, индекс родителя, биты прав,
+смещение и длина имени, границы содержимого в отображенном в память файле.
+Дети каждой директории лежат подряд в child_order, отсортированные по имени.
+
+Хранилище доступно только для чтения. VirtualFileSystem получает корень как
+копию-при-записи представления StoreNodeView, поэтому объекты VFSNode
+создаются только для тех директорий, которые реально посещаются, а все
+изменения (chmod, cp) происходят уже в созданных объектах.
+
+Замер памяти на узел по сравнению с VFSNode:
+    python node_store.py path/to/vfs.csv
+"""
+import copy
+import mmap
+import os
+import sys
+from array import array
+
+from vfs import (PERMISSION_STRINGS, VFSNode, VirtualFileSystem, _decode_content,
+                 _decode_csv_field, _iter_csv_records, permissions_to_bits)
+
+TYPE_DIRECTORY = 0
+TYPE_FILE = 1
+
+# Флаги узла
+FLAG_QUOTED = 1    # поле content в CSV заключено в кавычки
+FLAG_BASE64 = 2    # содержимое закодировано в base64
+FLAG_DECODED = 4   # содержимое уже декодировано (снимок)
+
+DIGEST_SIZE = 32   # байт в хэше SHA-256
+
+class ColumnarNodeStore:
+    def __init__(self):
+        self.types = array('B')
+        self.flags = array('B')
+        self.parents = array('i')
+        self.permissions = array('H')
+        self.name_offsets = array('Q')
+        self.name_lengths = array('I')
+        self.content_starts = array('Q')
+        self.content_ends = array('Q')
+        self.names = bytearray()  # имена подряд в UTF-8 (или mmap снимка)
+        self.buf = None           # отображенный в память исходный файл
+
+        # Индекс детей: child_order[child_starts[i]:child_starts[i] + child_counts[i]]
+        self.child_starts = array('I')
+        self.child_counts = array('I')
+        self.child_order = array('I')
+
+        # Агрегаты размеров считаются по требованию (-1 - не посчитано)
+        self.total_sizes = None
+        self.total_file_counts = None
+        # Хэши поддеревьев (vfs.compute_digest): по 32 байта на узел
+        # и признак "посчитан"; создаются при первом хэшировании
+        self.digests = None
+        self.digest_ready = None
+        # Число узлов в поддереве каждого узла (квота памяти при cp)
+        self.subtree_counts = None
+
+        self.root_index = -1
+
+    def __len__(self):
+        return len(self.types)
+
+    @classmethod
+    def from_csv(cls, csv_path):
+        """
+        Строит хранилище из CSV, не создавая объектов узлов
+        """
+        store = cls()
+
+        with open(csv_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return store
+            buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        store.buf = buf
+
+        records = _iter_csv_records(buf)
+        header = next(records, None)
+        if header is None:
+            return store
+        columns = {_decode_csv_field(buf, *field): index for index, field in enumerate(header)}
+
+        def field_value(fields, name):
+            index = columns.get(name)
+            if index is None or index >= len(fields):
+                return ''
+            return _decode_csv_field(buf, *fields[index])
+
+        # Пути нужны только на время связывания с родителями
+        index_by_path = {}
+        paths = []
+        content_index = columns['content']
+        for fields in records:
+            # Пропускаем пустые строки
+            if len(fields) == 1 and fields[0][0] == fields[0][1]:
+                continue
+
+            path = field_value(fields, 'path')
+            flags = FLAG_BASE64 if field_value(fields, 'encoding') == 'base64' else 0
+            start = end = 0
+            if content_index < len(fields):
+                start, end, quoted = fields[content_index]
+                if quoted:
+                    flags |= FLAG_QUOTED
+
+            index_by_path[path] = len(paths)
+            paths.append(path)
+            store._append(
+                TYPE_DIRECTORY if field_value(fields, 'type') == 'directory' else TYPE_FILE,
+                permissions_to_bits(field_value(fields, 'permissions')),
+                field_value(fields, 'name').encode('utf-8'),
+                start, end, flags
+            )
+
+        for index, path in enumerate(paths):
+            if path == '/':
+                store.root_index = index
+                continue
+            parent_path = '/'.join(path.split('/')[:-1]) or '/'
+            parent = index_by_path.get(parent_path, -1)
+            if parent >= 0 and store.types[parent] == TYPE_DIRECTORY:
+                store.parents[index] = parent
+
+        store._index_children()
+        return store
+
+    @classmethod
+    def from_snapshot(cls, snapshot_path):
+        """
+        Открывает бинарный снимок: столбцы, имена и содержимое остаются в mmap,
+        узлы не разбираются по одному (см. snapshot.py)
+        """
+        from snapshot import HEADER, MAGIC, VERSION, map_columns
+
+        store = cls()
+        with open(snapshot_path, 'rb') as file:
+            buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, node_count, columns_offset = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError(f"'{snapshot_path}' is not a VFS snapshot")
+        if version != VERSION:
+            raise ValueError(f"Unsupported snapshot version {version} (re-create it with vfs-save)")
+
+        store.buf = buf
+        store.names = buf
+        for name, column in map_columns(buf, node_count, columns_offset).items():
+            setattr(store, name, column)
+        store.root_index = 0 if node_count else -1
+        return store
+
+    def _append(self, node_type, permission_bits, name, content_start, content_end, flags):
+        self.types.append(node_type)
+        self.flags.append(flags)
+        self.parents.append(-1)
+        self.permissions.append(permission_bits)
+        self.name_offsets.append(len(self.names))
+        self.name_lengths.append(len(name))
+        self.names.extend(name)
+        self.content_starts.append(content_start)
+        self.content_ends.append(content_end)
+
+    def _index_children(self):
+        """
+        Группирует детей по родителю и сортирует по имени внутри группы
+        """
+        count = len(self.types)
+        parents = self.parents
+        children = [i for i in range(count) if parents[i] >= 0]
+        # Порядок байтов UTF-8 совпадает с порядком сортировки строк
+        children.sort(key=lambda i: (parents[i], self.name_bytes(i)))
+
+        self.child_order = array('I', children)
+        self.child_starts = array('I', bytes(4 * count))
+        self.child_counts = array('I', bytes(4 * count))
+        for position, child in enumerate(children):
+            parent = parents[child]
+            if self.child_counts[parent] == 0:
+                self.child_starts[parent] = position
+            self.child_counts[parent] += 1
+
+    def name_bytes(self, index):
+        offset = self.name_offsets[index]
+        return self.names[offset:offset + self.name_lengths[index]]
+
+    def name_of(self, index):
+        return self.name_bytes(index).decode('utf-8')
+
+    def child_indices(self, index):
+        start = self.child_starts[index]
+        return self.child_order[start:start + self.child_counts[index]]
+
+    def path_of(self, index, memo=None):
+        """
+        Восстанавливает путь узла по цепочке родителей. memo - {индекс: путь}
+        для серии вызовов: пути общих предков восстанавливаются один раз
+        """
+        if memo is None:
+            names = []
+            while index != self.root_index and index >= 0:
+                names.append(self.name_of(index))
+                index = self.parents[index]
+            return '/' + '/'.join(reversed(names))
+        
+        chain = []
+        while index not in memo and index != self.root_index and index >= 0:
+            chain.append(index)
+            index = self.parents[index]
+        prefix = memo.get(index, '')
+        for index in reversed(chain):
+            prefix = memo[index] = prefix + '/' + self.name_of(index)
+        return prefix or '/'
+
+    def name_index(self):
+        """
+        Индекс имен для find: {имя: [индексы узлов]} (только узлы, входящие в дерево)
+        """
+        index = {}
+        for child in self.child_order:
+            name = self.name_of(child)
+            entries = index.get(name)
+            if entries is None:
+                index[name] = [child]
+            else:
+                entries.append(child)
+        return index
+
+    def subtree_count(self, index):
+        """
+        Число узлов в поддереве узла. Массив для всех узлов строится один раз:
+        обход в ширину от корня, затем сложение в родителей в обратном порядке
+        """
+        if self.subtree_counts is None:
+            order = array('I', [self.root_index])
+            position = 0
+            while position < len(order):
+                order.extend(self.child_indices(order[position]))
+                position += 1
+            counts = array('I', [1]) * len(self)
+            parents = self.parents
+            for child in reversed(order[1:]):
+                counts[parents[child]] += counts[child]
+            self.subtree_counts = counts
+        return self.subtree_counts[index]
+
+    def view(self, index):
+        return StoreNodeView(self, index)
+
+    def root_node(self):
+        """
+        Корневой VFSNode, дети которого создаются из хранилища по требованию
+        """
+        return self.view(self.root_index).cow_copy(self.name_of(self.root_index), '/')
+
+    def memory_usage(self):
+        """
+        Байты, занятые массивами хранилища (без отображенного в память файла)
+        """
+        columns = (self.types, self.flags, self.parents, self.permissions,
+                   self.name_offsets, self.name_lengths, self.content_starts,
+                   self.content_ends, self.child_starts, self.child_counts, self.child_order)
+        # Столбцы снимка отображены из файла (memoryview) и не считаются
+        total = sum(column.itemsize * len(column) for column in columns
+                    if not isinstance(column, memoryview))
+        if not isinstance(self.names, mmap.mmap):
+            total += len(self.names)
+        return total
+
+
+class StoreNodeView:
+    """
+    Легкое представление узла хранилища с тем же интерфейсом, что у VFSNode,
+    достаточным для создания копии-при-записи. Создается на время обращения
+    """
+    __slots__ = ('store', 'index', '_cow_dependents')
+
+    _cow_source = None
+    _content = ''
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self._cow_dependents = []
+
+    @property
+    def type(self):
+        return 'directory' if self.store.types[self.index] == TYPE_DIRECTORY else 'file'
+
+    @property
+    def name(self):
+        return self.store.name_of(self.index)
+
+    @property
+    def mode(self):
+        return self.store.permissions[self.index]
+
+    @property
+    def permissions(self):
+        return PERMISSION_STRINGS[self.mode]
+
+    @property
+    def encoding(self):
+        return 'base64' if self.store.flags[self.index] & FLAG_BASE64 else 'text'
+
+    @property
+    def _content_source(self):
+        store = self.store
+        start = store.content_starts[self.index]
+        end = store.content_ends[self.index]
+        if start == end:
+            return None
+        flags = store.flags[self.index]
+        return (store.buf, start, end, bool(flags & FLAG_QUOTED), bool(flags & FLAG_DECODED))
+
+    @property
+    def content(self):
+        source = self._content_source
+        if source is None:
+            return ''
+        buf, start, end, quoted, decoded = source
+        raw = _decode_csv_field(buf, start, end, quoted)
+        return raw if decoded else _decode_content(raw, self.encoding, self.name)
+
+    @property
+    def content_length(self):
+        return len(self.content)
+
+    @property
+    def total_size(self):
+        sizes = self.store.total_sizes
+        if sizes is None or sizes[self.index] < 0:
+            return None
+        return sizes[self.index]
+
+    @total_size.setter
+    def total_size(self, value):
+        store = self.store
+        if store.total_sizes is None:
+            store.total_sizes = array('q', [-1]) * len(store)
+            store.total_file_counts = array('q', [-1]) * len(store)
+        store.total_sizes[self.index] = value
+
+    @property
+    def total_files(self):
+        counts = self.store.total_file_counts
+        if counts is None or counts[self.index] < 0:
+            return None
+        return counts[self.index]
+
+    @total_files.setter
+    def total_files(self, value):
+        self.store.total_file_counts[self.index] = value
+
+    @property
+    def stored_size(self):
+        # Тела из хранилища не сжимаются - хранимый размер совпадает с du
+        return self.total_size
+
+    @property
+    def node_count(self):
+        return self.store.subtree_count(self.index)
+
+    @property
+    def digest(self):
+        store = self.store
+        if store.digest_ready is None or not store.digest_ready[self.index]:
+            return None
+        offset = self.index * DIGEST_SIZE
+        return bytes(store.digests[offset:offset + DIGEST_SIZE])
+
+    @digest.setter
+    def digest(self, value):
+        store = self.store
+        if store.digests is None:
+            store.digests = bytearray(DIGEST_SIZE * len(store))
+            store.digest_ready = bytearray(len(store))
+        if value is None:
+            store.digest_ready[self.index] = 0
+            return
+        offset = self.index * DIGEST_SIZE
+        store.digests[offset:offset + DIGEST_SIZE] = value
+        store.digest_ready[self.index] = 1
+
+    @property
+    def child_names(self):
+        store = self.store
+        return [store.name_of(child) for child in store.child_indices(self.index)]
+
+    @property
+    def children(self):
+        store = self.store
+        return {store.name_of(child): StoreNodeView(store, child)
+                for child in store.child_indices(self.index)}
+
+    def iter_children(self):
+        store = self.store
+        for child in store.child_indices(self.index):
+            yield StoreNodeView(store, child)
+
+    def iter_child_names(self):
+        store = self.store
+        for child in store.child_indices(self.index):
+            yield store.name_of(child)
+
+    def cow_copy(self, name, path):
+        """
+        Создает VFSNode для этого узла; дети директории создаются при первом обращении
+        """
+        node = VFSNode(self.type, path, name, '', self.encoding, self.mode)
+        node._content_source = self._content_source
+        node.total_size = self.total_size
+        node.total_files = self.total_files
+        node.digest = self.digest
+        node.stored_size = self.stored_size
+        node.node_count = self.node_count
+        if node.type == 'directory':
+            node._cow_source = self
+            self._cow_dependents.append(node)
+        return node
+
+
+def change_store_permissions(nodes, keep, bits):
+    """
+    chmod -R для директорий, дети которых еще берутся из хранилища.
+    Хранилище разделяют и другие копии (cp), поэтому массив прав копируется
+    (копирование при записи на уровне хранилища), в копии меняются права
+    всех потомков, и узлы переключаются на хранилище с новым массивом.
+    Новые права берутся из таблицы на 512 значений, а не считаются для каждого узла
+    """
+    table = [(permissions & keep) | bits for permissions in range(512)]
+    by_store = {}
+    for node in nodes:
+        by_store.setdefault(id(node._cow_source.store), []).append(node)
+    
+    for group in by_store.values():
+        store = group[0]._cow_source.store
+        clone = copy.copy(store)
+        permissions = array('H', store.permissions)
+        clone.permissions = permissions
+        # Права входят в хэши поддеревьев - у копии они считаются заново
+        clone.digests = clone.digest_ready = None
+        
+        tops = [node._cow_source.index for node in group]
+        if store.root_index in tops:
+            # Все поддерево хранилища - пересчитываем массив целиком
+            permissions = clone.permissions = array('H', map(table.__getitem__, permissions))
+        else:
+            types = store.types
+            child_starts = store.child_starts
+            child_counts = store.child_counts
+            child_order = store.child_order
+            pending = tops
+            while pending:
+                index = pending.pop()
+                start = child_starts[index]
+                for child in child_order[start:start + child_counts[index]]:
+                    permissions[child] = table[permissions[child]]
+                    if types[child] == TYPE_DIRECTORY:
+                        pending.append(child)
+        
+        for node in group:
+            node._cow_source = StoreNodeView(clone, node._cow_source.index)
+            node._cow_source._cow_dependents.append(node)
+
+
+def measure_memory(csv_path):
+    """
+    Сравнивает память на узел: объекты VFSNode против колоночного хранилища
+    """
+    import tracemalloc
+
+    def materialize_all(vfs):
+        stack = [vfs.root]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children.values())
+
+    results = {}
+    for node_store in ('objects', 'columnar'):
+        tracemalloc.start()
+        vfs = VirtualFileSystem(node_store=node_store)
+        vfs.load_from_csv(csv_path, lazy=True)
+        if node_store == 'objects':
+            materialize_all(vfs)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        count = len(vfs.store) if vfs.store is not None else len(vfs.nodes)
+        results[node_store] = current / max(count, 1)
+        print(f"{node_store}: {count} nodes, {results[node_store]:.1f} bytes/node")
+
+    if results['columnar']:
+        print(f"Reduction: {results['objects'] / results['columnar']:.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python node_store.py path/to/vfs.csv")
+        sys.exit(1)
+    measure_memory(sys.argv[1])
@@ -0,0 +1,162 @@
+"""
+Параллельная загрузка больших CSV-образов VFS.
+
+Файл делится на части по границам записей (перевод строки вне кавычек),
+части разбираются и декодируются (base64) в пуле процессов, а результат
+сливается в дерево за один проход. Каждая строка получает номер строки в
+исходном файле, поэтому некорректные записи сообщаются с номером строки.
+"""
+import base64
+import csv
+import io
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from vfs import _record_digest
+
+# Файлы меньше этого размера разбираются в текущем процессе
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+SCAN_BLOCK = 1024 * 1024
+NODE_TYPES = ('file', 'directory')
+
+
+def _scan(buf, start, end):
+    """
+    Число кавычек и переводов строки в диапазоне (поблочно, без копии всего файла)
+    """
+    quotes = newlines = 0
+    for block_start in range(start, end, SCAN_BLOCK):
+        block = buf[block_start:min(block_start + SCAN_BLOCK, end)]
+        quotes += block.count(b'"')
+        newlines += block.count(b'\n')
+    return quotes, newlines
+
+
+def split_records(buf, parts):
+    """
+    Делит буфер на части по границам записей.
+    Возвращает (конец заголовка, [(начало, конец, номер первой строки)])
+    """
+    size = len(buf)
+    header_end = buf.find(b'\n') + 1 or size
+    chunk_size = max((size - header_end) // parts, 1)
+    
+    chunks = []
+    start = header_end
+    line_number = 2  # строка 1 - заголовок
+    quotes_parity = 0
+    position = start
+    while start < size:
+        target = min(start + chunk_size, size)
+        quotes, _ = _scan(buf, position, target)
+        quotes_parity = (quotes_parity + quotes) % 2
+        position = target
+        
+        # Ищем перевод строки, стоящий вне кавычек
+        end = size
+        while position < size:
+            newline = buf.find(b'\n', position)
+            if newline == -1:
+                break
+            quotes, _ = _scan(buf, position, newline)
+            quotes_parity = (quotes_parity + quotes) % 2
+            position = newline + 1
+            if quotes_parity == 0:
+                end = position
+                break
+        
+        chunks.append((start, end, line_number))
+        _, newlines = _scan(buf, start, end)
+        line_number += newlines
+        start = position = end
+    return header_end, chunks
+
+
+def _decode(content, encoding):
+    if encoding == 'base64' and content:
+        # Декодируем из Base64 в байты, затем в строку
+        return base64.b64decode(content).decode('utf-8')
+    return content
+
+
+def parse_chunk(csv_path, start, end, first_line, fieldnames, decode=True):
+    """
+    Разбирает часть файла. Возвращает (строки, ошибки):
+    строка - (тип, путь, имя, содержимое, кодировка, права, путь родителя, номер строки, хэш),
+    ошибка - (номер строки, сообщение). При decode=False base64 не декодируется
+    """
+    with open(csv_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            text = buf[start:end].decode('utf-8')
+    
+    columns = {name: index for index, name in enumerate(fieldnames)}
+    encoding_index = columns.get('encoding')
+    rows = []
+    errors = []
+    reader = csv.reader(io.StringIO(text, newline=''))
+    row_start = 0
+    for fields in reader:
+        line_number = first_line + row_start
+        row_start = reader.line_num
+        if not fields:
+            continue
+        if len(fields) != len(fieldnames):
+            errors.append((line_number, f"expected {len(fieldnames)} fields, got {len(fields)}"))
+            continue
+        
+        node_type = fields[columns['type']]
+        path = fields[columns['path']]
+        if node_type not in NODE_TYPES:
+            errors.append((line_number, f"unknown node type '{node_type}'"))
+            continue
+        if not path.startswith('/'):
+            errors.append((line_number, f"path '{path}' is not absolute"))
+            continue
+        
+        name = fields[columns['name']]
+        permissions = fields[columns['permissions']]
+        encoding = fields[encoding_index] if encoding_index is not None else 'text'
+        content = fields[columns['content']]
+        digest = _record_digest(node_type, name, content, encoding, permissions)
+        if decode:
+            try:
+                content = _decode(content, encoding)
+            except Exception as e:
+                errors.append((line_number, f"failed to decode Base64 for {path}: {e}"))
+                content = "[Base64 decoding error]"
+        
+        parent_path = '/'.join(path.split('/')[:-1]) or '/'
+        rows.append((node_type, path, name, content, encoding,
+                     permissions, parent_path, line_number, digest))
+    return rows, errors
+
+
+def iter_chunks(csv_path, workers, decode=True):
+    """
+    Разбирает файл по частям (при workers > 1 - в пуле процессов) и
+    возвращает результаты частей в порядке следования в файле
+    """
+    workers = min(workers, os.cpu_count() or 1)
+    with open(csv_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            header_end, chunks = split_records(buf, workers * 4 if size >= PARALLEL_MIN_BYTES else 1)
+            header = buf[:header_end].decode('utf-8')
+    
+    fieldnames = next(csv.reader([header.strip('\r\n')]), [])
+    if not chunks:
+        return
+    
+    if workers <= 1 or len(chunks) == 1:
+        for start, end, first_line in chunks:
+            yield parse_chunk(csv_path, start, end, first_line, fieldnames, decode)
+        return
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(parse_chunk, csv_path, start, end, first_line, fieldnames, decode)
+                   for start, end, first_line in chunks]
+        for future in futures:
+            yield future.result()
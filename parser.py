@@ -1,29 +1,169 @@
 import os
+import re
 
-def expand_environment_variables(text):
-    words = text.split()
-    expanded_words = []
+# $NAME или ${NAME}
+_VARIABLE_RE = re.compile(r'\$(?:(\w+)|\{(\w+)\})')
+
+class Operator(str):
+    """
+    Оператор конвейера вне кавычек: '|', '>' или '>>'
+    """
+
+def tokenize(command_line):
+    """
+    Разбивает строку на слова с учетом кавычек:
+    '...' - текст как есть, "..." - с подстановкой переменных, \\ экранирует символ.
+    Слово без кавычек - строка, иначе список частей [текст, подставлять_переменные]
+    """
+    # Быстрый путь для строк без кавычек, экранирования и операторов
+    if not any(char in command_line for char in '\'"\\|>'):
+        return command_line.split()
+    
+    words = []
+    parts = []
+    buf = []
+    in_word = False
+    i = 0
+    n = len(command_line)
     
-    for word in words:
-        if word.startswith('$'):
-            var_name = word[1:]
-            var_value = os.getenv(var_name)
-            if var_value:
-                expanded_words.append(var_value)
+    def flush_part(expand):
+        if buf:
+            parts.append([''.join(buf), expand])
+            buf.clear()
+    
+    while i < n:
+        char = command_line[i]
+        if char.isspace():
+            flush_part(True)
+            if in_word:
+                words.append(parts)
+                parts = []
+                in_word = False
+        elif char == "'":
+            flush_part(True)
+            end = command_line.find("'", i + 1)
+            if end == -1:
+                raise ValueError("unterminated single quote")
+            parts.append([command_line[i + 1:end], False])
+            in_word = True
+            i = end
+        elif char == '"':
+            flush_part(True)
+            in_word = True
+            i += 1
+            while i < n and command_line[i] != '"':
+                if command_line[i] == '\\' and i + 1 < n and command_line[i + 1] in '"\\$':
+                    flush_part(True)
+                    parts.append([command_line[i + 1], False])
+                    i += 2
+                    continue
+                buf.append(command_line[i])
+                i += 1
+            if i >= n:
+                raise ValueError("unterminated double quote")
+            flush_part(True)
+        elif char in '|>':
+            flush_part(True)
+            if in_word:
+                words.append(parts)
+                parts = []
+                in_word = False
+            if command_line.startswith('>>', i):
+                words.append(Operator('>>'))
+                i += 1
             else:
-                expanded_words.append(word)
+                words.append(Operator(char))
+        elif char == '\\' and i + 1 < n:
+            flush_part(True)
+            parts.append([command_line[i + 1], False])
+            in_word = True
+            i += 1
         else:
-            expanded_words.append(word)
+            buf.append(char)
+            in_word = True
+        i += 1
+    
+    flush_part(True)
+    if in_word:
+        words.append(parts)
     
-    return ' '.join(expanded_words)
+    # Слово из одной части с подстановкой хранится просто строкой
+    return [word if isinstance(word, Operator) or len(word) != 1 or not word[0][1] else word[0][0]
+            for word in words]
+
+def split_pipeline(words):
+    """
+    Делит слова строки на команды конвейера и перенаправление вывода.
+    Возвращает ([слова команды, ...], (оператор, слово-путь) или None)
+    """
+    stages = [[]]
+    redirect = None
+    i = 0
+    while i < len(words):
+        word = words[i]
+        if redirect is not None:
+            raise ValueError("redirection must end the command")
+        if not isinstance(word, Operator):
+            stages[-1].append(word)
+        elif not stages[-1]:
+            raise ValueError(f"syntax error near '{word}'")
+        elif word == '|':
+            stages.append([])
+        else:
+            if i + 1 >= len(words) or isinstance(words[i + 1], Operator):
+                raise ValueError(f"syntax error near '{word}'")
+            redirect = (str(word), words[i + 1])
+            i += 1
+        i += 1
+    if not stages[-1] and len(stages) > 1:
+        raise ValueError("syntax error near '|'")
+    return stages, redirect
+
+def _substitute(match, env):
+    var_name = match.group(1) or match.group(2)
+    var_value = env.get(var_name)
+    # Неизвестные переменные остаются как есть
+    return var_value if var_value else match.group(0)
+
+def expand_word(parts, env=None):
+    """
+    Собирает слово из частей, подставляя переменные окружения
+    (env - окружение сессии, по умолчанию окружение процесса)
+    """
+    if env is None:
+        env = os.environ
+    substitute = lambda match: _substitute(match, env)
+    if isinstance(parts, str):
+        return _VARIABLE_RE.sub(substitute, parts) if '$' in parts else parts
+    return ''.join(_VARIABLE_RE.sub(substitute, text) if expand else text
+                   for text, expand in parts)
+
+def is_literal(parts):
+    """
+    Слово без переменных - его значение известно заранее
+    """
+    if isinstance(parts, str):
+        return '$' not in parts
+    return all(not expand or '$' not in text for text, expand in parts)
 
-def parse_command(command_line):
-    expanded_line = expand_environment_variables(command_line)
-    parts = expanded_line.split()
+def parse_pipeline(command_line, env=None):
+    """
+    Разбирает строку в конвейер: ([(команда, аргументы), ...], (оператор, путь) или None).
+    Пустая строка или ошибка разбора - ([], None)
+    """
+    try:
+        stages, redirect = split_pipeline(tokenize(command_line))
+    except ValueError as e:
+        print(f"Error: {e}")
+        return [], None
     
-    if not parts:
-        return None, []
+    if not stages[0]:
+        return [], None
     
-    command = parts[0]
-    args = parts[1:]
-    return command, args
\ No newline at end of file
+    commands = []
+    for words in stages:
+        parts = [expand_word(word, env) for word in words]
+        commands.append((parts[0], parts[1:]))
+    if redirect is not None:
+        redirect = (redirect[0], expand_word(redirect[1], env))
+    return commands, redirect
@@ -1,24 +1,145 @@
-def execute_script_file(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-        
-        commands = []
-        for line in lines:
-            # Убираем пробелы в начале и конце строки
-            clean_line = line.strip()
-            
-            # Пропускаем пустые строки и комментарии
-            if not clean_line or clean_line.startswith('#'):
-                continue
-                
-            commands.append(clean_line)
+import hashlib
+import json
+import os
+
+from parser import expand_word, is_literal, split_pipeline, tokenize
+
+# Версия формата скомпилированного плана - увеличивается при его изменении
+PLAN_VERSION = 2
+CACHE_DIR_NAME = '.script_cache'
+
+class ScriptStep:
+    """
+    Одна скомпилированная строка скрипта: конвейер команд и перенаправление вывода
+    """
+    __slots__ = ('line_number', 'source', 'stages', 'redirect')
+    
+    def __init__(self, line_number, source, stages, redirect):
+        self.line_number = line_number
+        self.source = source      # исходная строка (для вывода)
+        self.stages = stages      # [[команда, слова-аргументы], ...]; команда - имя или слово с переменными
+        self.redirect = redirect  # [оператор, слово-путь] или None
+    
+    def resolve(self, env=None):
+        """
+        Подставляет переменные окружения - их значения известны только при запуске
+        """
+        stages = []
+        for command, args in self.stages:
+            # Имя команды подставлено при компиляции, если в нем нет переменных;
+            # слово без кавычек ('$CMD') остается строкой, но тоже не литерал
+            command = command if is_literal(command) else expand_word(command, env)
+            stages.append((command, [expand_word(word, env) for word in args]))
+        redirect = None
+        if self.redirect is not None:
+            redirect = (self.redirect[0], expand_word(self.redirect[1], env))
+        return stages, redirect
+
+def compile_script(lines, known_commands):
+    """
+    Токенизирует строки скрипта и проверяет имена команд.
+    Возвращает (шаги, ошибки компиляции)
+    """
+    steps = []
+    errors = []
+    for line_number, line in enumerate(lines, start=1):
+        clean_line = line.strip()
+        if not clean_line or clean_line.startswith('#'):
+            continue
         
-        return commands
+        try:
+            stages, redirect = split_pipeline(tokenize(clean_line))
+        except ValueError as e:
+            errors.append(f"Error: line {line_number}: {e}")
+            continue
+        if not stages[0]:
+            continue
         
+        compiled = []
+        for words in stages:
+            command = words[0]
+            if is_literal(command):
+                command = expand_word(command)
+                if command not in known_commands:
+                    errors.append(f"Error: line {line_number}: command '{command}' not found")
+                    break
+            compiled.append([command, words[1:]])
+        else:
+            if redirect is not None:
+                redirect = list(redirect)
+            steps.append(ScriptStep(line_number, clean_line, compiled, redirect))
+    
+    return steps, errors
+
+def _cache_path(file_path):
+    directory, name = os.path.split(os.path.abspath(file_path))
+    return os.path.join(directory, CACHE_DIR_NAME, name + '.json')
+
+def _registry_signature(known_commands):
+    # План зависит от набора команд: новая команда может стать известной
+    return hashlib.sha256('\n'.join(sorted(known_commands)).encode('utf-8')).hexdigest()
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _write_cache(cache_path, cache):
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(cache, file, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # Без кэша скрипт просто компилируется при каждом запуске
+
+def compile_script_file(file_path, known_commands):
+    """
+    Компилирует скрипт в список ScriptStep. План кэшируется на диске
+    (рядом со скриптом, в .script_cache) по mtime и хэшу содержимого.
+    Ошибки компиляции (неизвестные команды, незакрытые кавычки) печатаются сразу
+    """
+    try:
+        mtime = os.stat(file_path).st_mtime_ns
     except FileNotFoundError:
         print(f"Error: Script file '{file_path}' not found")
         return []
-    except Exception as e:
+    except OSError as e:
         print(f"Error reading script: {e}")
-        return []
\ No newline at end of file
+        return []
+    
+    cache_path = _cache_path(file_path)
+    signature = _registry_signature(known_commands)
+    cache = _read_cache(cache_path)
+    if cache and (cache.get('version') != PLAN_VERSION or cache.get('registry') != signature):
+        cache = None
+    
+    if cache is None or cache.get('mtime') != mtime:
+        try:
+            with open(file_path, 'rb') as file:
+                data = file.read()
+            text = data.decode('utf-8')
+        except Exception as e:
+            print(f"Error reading script: {e}")
+            return []
+        
+        digest = hashlib.sha256(data).hexdigest()
+        if cache is None or cache.get('hash') != digest:
+            steps, errors = compile_script(text.splitlines(), known_commands)
+            cache = {
+                'version': PLAN_VERSION,
+                'registry': signature,
+                'hash': digest,
+                'errors': errors,
+                'steps': [[step.line_number, step.source, step.stages, step.redirect] for step in steps],
+            }
+        # Файл мог быть перезаписан без изменений - обновляем только mtime
+        cache['mtime'] = mtime
+        _write_cache(cache_path, cache)
+    
+    for error in cache['errors']:
+        print(error)
+    return [ScriptStep(*step) for step in cache['steps']]
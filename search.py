@@ -0,0 +1,93 @@
+"""
+Поиск по содержимому файлов VFS (команда grep).
+
+Небольшие поддеревья сканируются в текущем процессе, большие делятся на
+части и обрабатываются пулом процессов. Файлы читаются по ходу обхода:
+в памяти одновременно только части, ожидающие пула, а не все содержимое
+поддерева. Регулярное выражение компилируется один раз на процесс (через
+кэш модуля re).
+"""
+import itertools
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# С какого объема работы имеет смысл запускать пул процессов
+PARALLEL_MIN_FILES = 2000
+PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+# Размер части: файлов или символов содержимого
+CHUNK_FILES = 500
+CHUNK_BYTES = 1024 * 1024
+# Сколько частей на процесс может ждать в очереди пула
+PENDING_PER_WORKER = 2
+
+
+def grep_chunk(pattern, flags, files):
+    """
+    Ищет совпадения в списке (путь, содержимое); возвращает строки 'путь:номер:строка'
+    """
+    regex = re.compile(pattern, flags)
+    matches = []
+    for path, content in files:
+        if not regex.search(content):
+            continue
+        for line_number, line in enumerate(content.splitlines(), start=1):
+            if regex.search(line):
+                matches.append(f"{path}:{line_number}:{line}")
+    return matches
+
+
+def _chunks(files):
+    chunk = []
+    size = 0
+    for path, content in files:
+        chunk.append((path, content))
+        size += len(content)
+        if len(chunk) >= CHUNK_FILES or size >= CHUNK_BYTES:
+            yield chunk
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk
+
+
+def _pool_context():
+    # grep выполняется и в потоке фонового задания: fork из потока небезопасен
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def grep_files(pattern, flags, files, workers=None):
+    """
+    Ищет совпадения в файлах (итератор пар путь, содержимое), при большом
+    объеме - параллельно. Порядок результатов совпадает с порядком files
+    """
+    files = iter(files)
+    head = []
+    head_bytes = 0
+    for path, content in files:
+        head.append((path, content))
+        head_bytes += len(content)
+        if len(head) >= PARALLEL_MIN_FILES or head_bytes >= PARALLEL_MIN_BYTES:
+            break
+    else:
+        return grep_chunk(pattern, flags, head)
+    
+    workers = workers or os.cpu_count() or 1
+    matches = []
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+        try:
+            for chunk in _chunks(itertools.chain(head, files)):
+                if len(pending) >= workers * PENDING_PER_WORKER:
+                    matches.extend(pending.popleft().result())
+                pending.append(pool.submit(grep_chunk, pattern, flags, chunk))
+            while pending:
+                matches.extend(pending.popleft().result())
+        except BaseException:
+            # Отмена задания (jobs.checkpoint в обходе): ожидающие части не выполняются
+            pool.shutdown(cancel_futures=True)
+            raise
+    return matches
@@ -0,0 +1,221 @@
+"""
+Бинарный формат снимка VFS.
+
+Снимок - это колоночное хранилище (node_store.py), записанное на диск:
+    заголовок      - магическая строка, версия, число узлов, смещение столбцов
+    область данных - содержимое файлов подряд
+    таблица имен   - имена узлов в UTF-8 подряд (одинаковые имена - один раз)
+    столбцы        - массивы хранилища по одному элементу на узел: тип, флаги,
+                     права, индекс родителя, имя (смещение, длина), содержимое
+                     (начало, конец) и индекс детей; каждый выровнен по 8 байтам
+
+Полные пути не хранятся - узел знает только имя и индекс родителя.
+Узлы записываются в ширину, дети каждой директории идут подряд по имени,
+поэтому индекс детей не нужно строить при открытии. Открытие снимка -
+это mmap файла и приведение столбцов к типам через memoryview, без
+разбора записей и без объектов на узел: время открытия почти не зависит
+от размера образа. Содержимое копируется из источника байтами: поле CSV
+лениво загруженного образа не декодируется при сохранении (base64
+остается закодированным и декодируется при чтении, как в CSV).
+"""
+import os
+import struct
+import sys
+from array import array
+from collections import deque
+
+from blob_store import CompressedBody
+from node_store import FLAG_BASE64, FLAG_DECODED, TYPE_DIRECTORY, TYPE_FILE
+from vfs import VirtualFileSystem, _source_children
+
+MAGIC = b'VFSSNAP\x01'
+VERSION = 2
+
+# magic, version, node_count, columns_offset
+HEADER = struct.Struct('<8sIIQ')
+
+# Столбцы хранилища в порядке записи: (атрибут ColumnarNodeStore, тип array).
+# Смещения имен и содержимого - от начала файла
+COLUMNS = (
+    ('types', 'B'),
+    ('flags', 'B'),
+    ('permissions', 'H'),
+    ('parents', 'i'),
+    ('name_offsets', 'Q'),
+    ('name_lengths', 'I'),
+    ('content_starts', 'Q'),
+    ('content_ends', 'Q'),
+    ('child_starts', 'I'),
+    ('child_counts', 'I'),
+    ('child_order', 'I'),
+)
+ALIGNMENT = 8
+
+
+def is_snapshot(path):
+    """
+    Проверяет по магической строке, является ли файл снимком VFS
+    """
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def _raw_body(node):
+    """
+    (байты содержимого, флаги) файла. Поле лениво загруженного CSV или
+    снимка копируется как есть (снимаются только CSV-кавычки)
+    """
+    flags = FLAG_BASE64 if node.encoding == 'base64' else 0
+    source = node._content_source
+    if source is not None:
+        buf, start, end, quoted, decoded = source
+        raw = buf[start:end]
+        if quoted:
+            raw = raw.replace(b'""', b'"')
+        return raw, flags | (FLAG_DECODED if decoded else 0)
+    content = node._content
+    if isinstance(content, CompressedBody):
+        content = content.decompress()
+    return (content or '').encode('utf-8'), flags | FLAG_DECODED
+
+
+def write_snapshot(root, snapshot_path):
+    """
+    Записывает дерево с корнем root в файл снимка, возвращает число узлов.
+    Дерево обходится без материализации копий (cp) и хранилища, содержимое
+    пишется в файл по ходу обхода
+    """
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    names = bytearray()
+    name_offsets = {}
+
+    # Пишем во временный файл и подменяем, чтобы не оставить битый снимок
+    tmp_path = snapshot_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as file:
+            file.write(bytes(HEADER.size))  # заголовок пишется после столбцов
+            position = HEADER.size
+            count = 0
+            next_index = 1
+            queue = deque([(root, -1)])
+            while queue:
+                node, parent_index = queue.popleft()
+                if node.type == 'directory':
+                    data, flags = b'', 0
+                    children = list(_source_children(node))
+                else:
+                    data, flags = _raw_body(node)
+                    children = []
+                file.write(data)
+
+                name = node.name.encode('utf-8')
+                # Одинаковые имена (index.html, .profile) хранятся один раз
+                name_offset = name_offsets.get(name)
+                if name_offset is None:
+                    name_offset = name_offsets[name] = len(names)
+                    names.extend(name)
+
+                columns['types'].append(TYPE_DIRECTORY if node.type == 'directory' else TYPE_FILE)
+                columns['flags'].append(flags)
+                columns['permissions'].append(node.mode)
+                columns['parents'].append(parent_index)
+                columns['name_offsets'].append(name_offset)
+                columns['name_lengths'].append(len(name))
+                columns['content_starts'].append(position)
+                columns['content_ends'].append(position + len(data))
+                columns['child_starts'].append(next_index)
+                columns['child_counts'].append(len(children))
+                columns['child_order'].append(count)
+                position += len(data)
+                next_index += len(children)
+                queue.extend((child, count) for child in children)
+                count += 1
+
+            names_offset = position
+            columns['name_offsets'] = array('Q', (names_offset + offset for offset in columns['name_offsets']))
+            file.write(names)
+            position += len(names)
+            file.write(bytes(_padding(position)))
+            columns_offset = position + _padding(position)
+
+            for name, _ in COLUMNS:
+                column = columns[name]
+                if sys.byteorder != 'little':
+                    column.byteswap()
+                data = column.tobytes()
+                file.write(data)
+                file.write(bytes(_padding(len(data))))
+
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, VERSION, count, columns_offset))
+        os.replace(tmp_path, snapshot_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return count
+
+
+def map_columns(buf, node_count, columns_offset):
+    """
+    Столбцы снимка {атрибут: столбец} без копирования: memoryview поверх
+    mmap. На машинах с обратным порядком байтов столбцы копируются в array
+    """
+    columns = {}
+    offset = columns_offset
+    view = memoryview(buf)
+    for name, typecode in COLUMNS:
+        size = array(typecode).itemsize * node_count
+        data = view[offset:offset + size]
+        if sys.byteorder == 'little':
+            column = data.cast(typecode)
+        else:
+            column = array(typecode, data.tobytes())
+            column.byteswap()
+        columns[name] = column
+        offset += size + _padding(size)
+    return columns
+
+
+def convert_csv(csv_path, snapshot_path=None):
+    """
+    Конвертирует CSV-образ VFS в снимок рядом с исходным файлом
+    """
+    if snapshot_path is None:
+        snapshot_path = os.path.splitext(csv_path)[0] + '.vfssnap'
+
+    # Колоночное хранилище: узлы не создаются, содержимое не декодируется
+    vfs = VirtualFileSystem(node_store='columnar')
+    vfs.load_from_csv(csv_path)
+    if not vfs.root:
+        print(f"Skipping {csv_path}: no root directory")
+        return None
+
+    count = write_snapshot(vfs.root, snapshot_path)
+    print(f"{csv_path} -> {snapshot_path} ({count} nodes)")
+    return snapshot_path
+
+
+def main():
+    # Использование: python snapshot.py vfs_variants/*.csv
+    if len(sys.argv) < 2:
+        print("Usage: python snapshot.py file.csv [file.csv ...]")
+        return 1
+
+    for csv_path in sys.argv[1:]:
+        convert_csv(csv_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
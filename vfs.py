@@ -1,13 +1,192 @@
+import base64
+import bisect
+import hashlib
+import mmap
+import os
+import re
+import sys
+import time
+import weakref
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from itertools import islice
+
+from blob_store import COMPRESS_THRESHOLD, BlobStore, CompressedBody
+from jobs import checkpoint
+
+# Сколько разрешенных путей хранить в кэше resolve
+RESOLVE_CACHE_SIZE = 4096
+# Как часто (в секундах) режим наблюдения проверяет mtime образа
+WATCH_INTERVAL = 1.0
+
+# Одно поле CSV-записи: либо в кавычках (с экранированием ""), либо без них,
+# за которым идет разделитель полей или конец строки. Тело в кавычках
+# проходится кусками без кавычек [^"]*, а не посимвольно
+_CSV_FIELD_RE = re.compile(rb'(?:"([^"]*(?:""[^"]*)*)"|([^,"\r\n]*))(,|\r?\n|\Z)')
+
+# Права хранятся 9 битами (0o755); все 512 вариантов в символьном виде
+# создаются один раз и используются только для вывода
+PERMISSION_STRINGS = tuple(
+    ''.join(char if bits & (1 << (8 - i)) else '-' for i, char in enumerate('rwxrwxrwx'))
+    for bits in range(512)
+)
+_PERMISSION_BITS = {permissions: bits for bits, permissions in enumerate(PERMISSION_STRINGS)}
+
+# Одно предложение символьного режима chmod: u+x, go-w, a=rx, u+x-w
+_MODE_CLAUSE_RE = re.compile(r'([ugoa]*)((?:[-+=][rwx]*)+)')
+_MODE_ACTION_RE = re.compile(r'([-+=])([rwx]*)')
+_WHO_MASKS = {'u': 0o700, 'g': 0o070, 'o': 0o007, 'a': 0o777}
+_PERM_BITS = {'r': 0o444, 'w': 0o222, 'x': 0o111}
+
+
+def _iter_csv_records(buf):
+    """
+    Разбирает CSV прямо в буфере (bytes или mmap) и для каждой записи
+    возвращает список полей в виде (начало, конец, в_кавычках) - без копирования данных
+    """
+    pos = 0
+    size = len(buf)
+    fields = []
+    while pos < size:
+        match = _CSV_FIELD_RE.match(buf, pos)
+        if match is None:
+            raise ValueError(f"Malformed CSV near byte {pos}")
+        if match.start(1) != -1:
+            fields.append((match.start(1), match.end(1), True))
+        else:
+            fields.append((match.start(2), match.end(2), False))
+        pos = match.end()
+        separator = match.group(3)
+        if separator != b',':
+            yield fields
+            fields = []
+        elif pos >= size:
+            # Запись заканчивается запятой в самом конце файла - последнее поле пустое
+            fields.append((pos, pos, False))
+    if fields:
+        yield fields
+
+
+def _decode_csv_field(buf, start, end, quoted):
+    """
+    Достает значение поля из буфера и снимает CSV-экранирование кавычек
+    """
+    raw = buf[start:end]
+    if quoted:
+        raw = raw.replace(b'""', b'"')
+    return raw.decode('utf-8')
+
+
+def _record_digest(node_type, name, content, encoding, permissions):
+    """
+    Хэш записи CSV (содержимое - до декодирования base64).
+    По нему vfs-reload находит измененные строки
+    """
+    if not isinstance(content, (bytes, memoryview)):
+        content = (content or '').encode('utf-8')
+    digest = hashlib.blake2b(content, digest_size=8)
+    digest.update(f"\0{node_type}\0{name}\0{encoding}\0{permissions}".encode('utf-8'))
+    return digest.digest()
+
+
+def permissions_to_bits(permissions):
+    """
+    Переводит права вида 'rwxr-xr-x' в 9 бит
+    """
+    bits = _PERMISSION_BITS.get(permissions)
+    if bits is None:
+        bits = 0
+        for char in permissions[:9].ljust(9, '-'):
+            bits = (bits << 1) | (char != '-')
+    return bits
+
+
+def parse_mode(mode):
+    """
+    Разбирает режим chmod: '755', 'rwxr-xr-x' или символьный 'u+x,go-w'.
+    Возвращает (сохраняемые биты, устанавливаемые биты) - новые права
+    узла равны (права & сохраняемые) | устанавливаемые; None - режим некорректен
+    """
+    if len(mode) == 3 and all(digit in '01234567' for digit in mode):
+        return 0, int(mode, 8)
+    if len(mode) == 9 and all(char in 'rwx-' for char in mode):
+        return 0, permissions_to_bits(mode)
+    
+    # Предложения применяются по очереди, но сводятся к одной паре масок
+    cleared, added = 0, 0
+    for clause in mode.split(','):
+        match = _MODE_CLAUSE_RE.fullmatch(clause)
+        if match is None:
+            return None
+        who_mask = 0
+        for who in match.group(1) or 'a':
+            who_mask |= _WHO_MASKS[who]
+        for operator, perms in _MODE_ACTION_RE.findall(match.group(2)):
+            bits = 0
+            for perm in perms:
+                bits |= _PERM_BITS[perm]
+            bits &= who_mask
+            if operator == '+':
+                added |= bits
+            elif operator == '-':
+                cleared |= bits
+                added &= ~bits
+            else:
+                cleared |= who_mask
+                added = (added & ~who_mask) | bits
+    return ~cleared & 0o777, added
+
+
+def _decode_content(content, encoding, path):
+    """
+    Декодирует содержимое файла в соответствии с его кодировкой
+    """
+    if encoding == 'base64' and content:
+        try:
+            # Декодируем из Base64 в байты, затем в строку
+            decoded_bytes = base64.b64decode(content)
+            content = decoded_bytes.decode('utf-8')
+        except Exception as e:
+            print(f"Warning: Failed to decode Base64 for {path}: {e}")
+            content = "[Base64 decoding error]"
+    return content
+
+
 class VFSNode:
-    def __init__(self, node_type, path, name, content, encoding, permissions):
-        self.type = node_type      # 'file' или 'directory'
+    def __init__(self, node_type, path, name, content, encoding, permissions, blobs=None):
+        # Тип, имя и кодировка интернируются: у узлов с одинаковым именем
+        # (index.html, .profile) одна строка на все, а не по строке из CSV
+        self.type = sys.intern(node_type)  # 'file' или 'directory'
         self.path = path          # полный путь: '/home/user'
-        self.name = name          # имя: 'user'
-        self.content = content    # содержимое файла (уже декодированное)
-        self.encoding = encoding  # 'text' или 'base64' (НОВОЕ!)
-        self.permissions = permissions  # 'rwxr-xr-x'
-        self.children = []        # список дочерних узлов (для папок)
+        self.name = sys.intern(name)  # имя: 'user'
+        # Хранилище тел файлов (blob_store.py): одинаковое содержимое - одна строка
+        self._blobs = blobs if node_type == 'file' else None
+        self._content = self._blobs.acquire(content) if self._blobs is not None else content  # содержимое файла (уже декодированное)
+        self._content_source = None  # (буфер, начало, конец, в_кавычках, декодировано) для ленивой загрузки
+        self.encoding = sys.intern(encoding)  # 'text' или 'base64' (НОВОЕ!)
+        self.mode = 0               # права битами: 0o755
+        self.permissions = permissions  # 'rwxr-xr-x' или биты
+        self._children = {}       # дочерние узлы {имя: узел} (для папок)
+        self._child_names = []    # отсортированные имена детей
         self.parent = None        # ссылка на родительский узел
+        # Копирование при записи: директория-копия ссылается на исходный узел
+        # и создает своих детей только при первом обращении к ним
+        self._cow_source = None
+        self._cow_dependents = []  # копии, еще ссылающиеся на детей этого узла
+        # Агрегаты поддерева (размер и число файлов); None - еще не посчитаны.
+        # Если агрегаты директории посчитаны, то посчитаны и у всех ее потомков
+        self.total_size = None
+        self.total_files = None
+        # Хэш поддерева (см. compute_digest); None - не посчитан или сброшен
+        # изменением. Как и с агрегатами: если хэш директории посчитан,
+        # то посчитаны и хэши всех ее потомков
+        self.digest = None
+        # Размер поддерева как в du, но сжатые тела - по сжатому размеру
+        # (см. VirtualFileSystem._compute_stored); сбрасывается вместе с хэшем
+        self.stored_size = None
+        # Число узлов поддерева для квоты памяти (см. VirtualFileSystem._count_nodes);
+        # сбрасывается вместе с хэшем
+        self.node_count = None
     
     def __str__(self):
         if self.type == 'directory':
@@ -16,133 +195,1143 @@ class VFSNode:
             encoding_info = f" [{self.encoding}]" if self.encoding != 'text' else ""
             return f"{self.name}{encoding_info}"
 
-class VirtualFileSystem:
-    def __init__(self):
-        self.root = None          # корневая папка
+    @property
+    def children(self):
+        if self._cow_source is not None:
+            self._materialize()
+        return self._children
+
+    @property
+    def child_names(self):
+        if self._cow_source is not None:
+            self._materialize()
+        return self._child_names
+
+    def source_child_names(self):
+        """
+        Отсортированные имена детей без материализации копии-при-записи:
+        список источника, а для директории колоночного хранилища - итератор,
+        декодирующий имена по одному
+        """
+        source = self
+        while isinstance(source, VFSNode) and source._cow_source is not None:
+            source = source._cow_source
+        if isinstance(source, VFSNode):
+            return source._child_names
+        if hasattr(source, 'iter_child_names'):
+            return source.iter_child_names()
+        return source.child_names
+
+    def cow_copy(self, name, path):
+        """
+        Создает копию узла без копирования поддерева: дети и содержимое
+        остаются общими с исходным узлом, пока одна из сторон не изменится
+        """
+        copy = VFSNode(self.type, path, name, self._content, self.encoding, self.mode, self._blobs)
+        copy._content_source = self._content_source
+        copy.total_size = self.total_size
+        copy.total_files = self.total_files
+        copy.digest = self.digest
+        copy.stored_size = self.stored_size
+        copy.node_count = self.node_count
+        if self.type == 'directory':
+            copy._cow_source = self
+            self._cow_dependents.append(copy)
+        return copy
+
+    def _materialize(self):
+        """
+        Отделяет копию от источника на один уровень: создает копии детей,
+        которые в свою очередь ссылаются на детей источника
+        """
+        source = self._cow_source
+        self._cow_source = None
+        source._cow_dependents.remove(self)
+        
+        base_path = self.path.rstrip('/')
+        for name in source.child_names:
+            child = source.children[name].cow_copy(name, base_path + '/' + name)
+            child.parent = self
+            self._children[name] = child
+        self._child_names = list(source.child_names)
+
+    def get_child(self, name):
+        """
+        Возвращает дочерний узел с указанным именем или None
+        """
+        return self.children.get(name)
+
+    def add_child(self, node, keep_sorted=True):
+        """
+        Добавляет дочерний узел. При массовом добавлении можно передать
+        keep_sorted=False и затем один раз вызвать sort_children()
+        """
+        if node.name not in self.children:
+            if keep_sorted:
+                bisect.insort(self.child_names, node.name)
+            else:
+                self.child_names.append(node.name)
+        self.children[node.name] = node
+        node.parent = self
+
+    def remove_child(self, name):
+        """
+        Удаляет дочерний узел с указанным именем и возвращает его
+        """
+        node = self.children.pop(name)
+        del self.child_names[bisect.bisect_left(self.child_names, name)]
+        node.parent = None
+        return node
+
+    def sort_children(self):
+        self.child_names.sort()
+
+    def iter_children(self):
+        """
+        Дочерние узлы в порядке сортировки имен
+        """
+        children = self.children
+        for name in self.child_names:
+            yield children[name]
+
+    @property
+    def permissions(self):
+        # Символьный вид прав - только для вывода и сохранения образа
+        return PERMISSION_STRINGS[self.mode]
+
+    @permissions.setter
+    def permissions(self, value):
+        self.mode = value & 0o777 if isinstance(value, int) else permissions_to_bits(value)
+
+    @property
+    def content(self):
+        # При ленивой загрузке содержимое декодируется при первом обращении
+        # и дальше берется из кэша
+        if self._content_source is not None:
+            buf, start, end, quoted, decoded = self._content_source
+            raw = _decode_csv_field(buf, start, end, quoted)
+            # Содержимое из снимка уже декодировано, из CSV - еще нет
+            content = raw if decoded else _decode_content(raw, self.encoding, self.path)
+            self._content = self._blobs.acquire(content) if self._blobs is not None else content
+            self._content_source = None
+            return content
+        if isinstance(self._content, CompressedBody):
+            return self._blobs.read(self._content)
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        if self._blobs is not None:
+            self._blobs.release(self._content)
+            value = self._blobs.acquire(value)
+        self._content = value
+        self._content_source = None
+
+    @property
+    def content_length(self):
+        """
+        Длина содержимого в символах; сжатое тело не распаковывается
+        """
+        if self._content_source is not None:
+            return len(self.content)
+        return len(self._content) if self._content else 0
+
+# Байты на объект VFSNode без содержимого: экземпляр, его __dict__, словарь
+# и список детей, заголовки строк пути и имени. Для оценки памяти и квот
+NODE_OVERHEAD = sum(sys.getsizeof(part) for part in (
+    VFSNode('file', '/', '', '', 'text', 0),
+    VFSNode('file', '/', '', '', 'text', 0).__dict__,
+    {}, [], '', ''))
+
+
+def iter_tree(root, load_mounts=True):
+    """
+    Обходит дерево в прямом порядке, дети - по имени (как VirtualFileSystem.walk),
+    но без материализации: дети копий-при-записи и директорий колоночного
+    хранилища берутся прямо из источника. Возвращает (путь, узел); для таких
+    детей узел - это узел источника с теми же детьми, содержимым и правами.
+    load_mounts=False - еще не загруженные образы (mount) не загружаются,
+    от точки подключения обходится только прежнее содержимое
+    """
+    yield root.path, root
+    if root.type != 'directory':
+        return
+    stack = [(root.path.rstrip('/'), _source_children(root, load_mounts))]
+    while stack:
+        prefix, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            continue
+        checkpoint()
+        path = f"{prefix}/{child.name}"
+        yield path, child
+        if child.type == 'directory':
+            stack.append((path, _source_children(child, load_mounts)))
+
+
+def _source_children(node, load_mounts=True):
+    """
+    Дети директории без материализации копий-при-записи
+    """
+    while isinstance(node, VFSNode) and node._cow_source is not None:
+        node = node._cow_source
+    if not load_mounts and getattr(node, 'pending', False):
+        # Образ еще не загружен (mounts.ImageMount) - только нижний слой
+        return node.iter_children(load=False)
+    return node.iter_children()
+
+
+def read_content(node):
+    """
+    Содержимое файла без кэширования в узле (для лениво загруженных узлов)
+    и в кэше распакованных тел: обход всего дерева не вытесняет из него
+    часто читаемые файлы
+    """
+    if node.type != 'file':
+        return ''
+    source = node._content_source
+    if source is None:
+        content = node._content
+        return content.decompress() if isinstance(content, CompressedBody) else node.content
+    buf, start, end, quoted, decoded = source
+    raw = _decode_csv_field(buf, start, end, quoted)
+    return raw if decoded else _decode_content(raw, node.encoding, node.name)
+
+
+def compute_digest(node):
+    """
+    Хэш SHA-256 поддерева узла (дерево Меркла). Хэш файла - хэш его содержимого
+    (совпадает с sha256sum), хэш директории - хэш списка детей по порядку
+    имен: права, тип, имя и хэш каждого ребенка (как tree-объект git).
+    Собственные имя и права узла входят в хэш родителя, а не в его хэш,
+    поэтому одинаковые поддеревья в разных местах имеют одинаковый хэш.
+    Досчитываются только узлы без хэша (без рекурсии); копии (cp) берут
+    хэш источника, не создавая своих детей
+    """
+    stack = [(node, False)]
+    while stack:
+        current, children_ready = stack.pop()
+        checkpoint()
+        if current.digest is not None:
+            continue
+        
+        source = current._cow_source
+        if source is not None:
+            if source.digest is None:
+                stack.append((current, False))
+                stack.append((source, False))
+            else:
+                current.digest = source.digest
+        elif current.type == 'file':
+            current.digest = hashlib.sha256(read_content(current).encode('utf-8')).digest()
+        elif children_ready:
+            current.digest = _directory_digest(current.iter_children())
+        else:
+            stack.append((current, True))
+            for child in current.iter_children():
+                if child.digest is None:
+                    stack.append((child, False))
+    return node.digest
+
+
+def _directory_digest(children):
+    digest = hashlib.sha256()
+    for child in children:
+        digest.update(f"{child.mode:o} {child.type} {child.name}\0".encode('utf-8'))
+        digest.update(child.digest)
+    return digest.digest()
+
+
+def _count_records(buf, block=1 << 20):
+    """
+    Число записей CSV в буфере (mmap) - блоками, без копии всего файла.
+    Считаются только переводы строк вне кавычек: содержимое файлов может
+    содержать свои переводы строк. Части блока между кавычками чередуются
+    (внутри и вне поля), экранированная кавычка "" дает пустую часть
+    """
+    records = 0
+    quoted = False
+    for start in range(0, len(buf), block):
+        parts = buf[start:start + block].split(b'"')
+        outside = parts[1::2] if quoted else parts[::2]
+        records += sum(part.count(b'\n') for part in outside)
+        if len(parts) % 2 == 0:
+            quoted = not quoted
+    if len(buf) and buf[-1:] != b'\n':
+        records += 1
+    return records
+
+
+def _raw_content_size(node):
+    """
+    Размер содержимого файла без декодирования (для ленивых узлов - размер
+    поля CSV, для сжатых тел - размер сжатых байтов)
+    """
+    source = node._content_source
+    if source is not None:
+        return source[2] - source[1]
+    if node.type != 'file':
+        return 0
+    content = node._content
+    return len(content.data) if isinstance(content, CompressedBody) else len(content or '')
+
+
+class Session:
+    """
+    Состояние одного пользователя: текущая директория, имя пользователя и
+    переменные окружения. Сессии сервера работают с одним загруженным образом
+    """
+    def __init__(self, user="user", env=None):
         self.current_path = "/"   # текущий путь
         self.current_directory = None
+        self.current_user = user
+        self.env = dict(os.environ) if env is None else env
+
+
+def minimal_env(user):
+    """
+    Окружение сессии сервера: окружение процесса (в нем могут быть секреты
+    сервера) клиентам не копируется, только базовые переменные
+    """
+    return {'USER': user, 'HOME': f"/home/{user}", 'PWD': "/", 'PATH': "/usr/local/bin:/usr/bin:/bin"}
+
+
+class VirtualFileSystem:
+    def __init__(self, node_store='objects'):
+        self.root = None          # корневая папка
+        # Активная сессия: команды работают с ее текущей директорией и пользователем
+        self.session = Session()
+        self._sessions = weakref.WeakSet([self.session])
         self.nodes = {}           # словарь {путь: узел}
-        self.current_user = "user"
+        # 'objects' - узлы VFSNode, 'columnar' - колоночное хранилище (node_store.py)
+        self.node_store = node_store
+        self.store = None
+        # Сжатие тел файлов (None, 'zlib' или 'lzma') и порог в символах;
+        # применяются при загрузке образа
+        self.content_compression = None
+        self.compress_threshold = COMPRESS_THRESHOLD
+        self.blobs = BlobStore()  # тела файлов со счетчиками ссылок
+        # Хранилище тел, общее с другим VFS (образы mount получают хранилище
+        # родителя); None - при каждой загрузке создается свое
+        self.shared_blobs = None
+        # Число процессов для разбора CSV при обычной (не ленивой) загрузке
+        self.load_workers = 1
+        # Исходный CSV и хэши его записей {путь: хэш} - для vfs-reload.
+        # Хэши считаются при загрузке по байтам записей, а не по узлам:
+        # перезагрузка применяет только изменения CSV, правки в дереве остаются
+        self.source_path = None
+        self.source_mtime = None
+        self._source_digests = {}
+        self.watch = False        # проверять mtime образа перед каждой командой
+        self._last_poll = 0.0
+        # Журнал изменений (journal.py): включается флагом --journal
+        self.journaling = False
+        self.journal = None
+        self.journal_image = None
+        # LRU-кэш resolve: (текущий путь, путь) -> узел; сбрасывается при изменении дерева
+        self._resolve_cache = OrderedDict()
+        # Индекс имен для find: {имя: [узел или индекс в колоночном хранилище]}.
+        # Для колоночного хранилища здесь только узлы, добавленные после загрузки,
+        # а индекс самого хранилища строится при первом find
+        self._name_index = {}
+        self._store_name_index = None
+        # Выполненные cp по пути источника: {источник: [(номер cp, назначение)]}.
+        # Потомки копий в индекс не добавляются, их пути получаются заменой префикса
+        self._copy_aliases = {}
+        self._copy_count = 0
+        # Квота памяти образа в байтах (--memory-quota) и оценка его стоимости:
+        # узлы * NODE_OVERHEAD + содержимое, как если бы все узлы были созданы
+        self.memory_quota = None
+        self._image_cost = None
+        # Подключенные образы (mounts.ImageMount) в порядке подключения
+        self.mounts = []
+
+    @property
+    def current_path(self):
+        return self.session.current_path
+
+    @current_path.setter
+    def current_path(self, value):
+        self.session.current_path = value
+
+    @property
+    def current_directory(self):
+        return self.session.current_directory
+
+    @current_directory.setter
+    def current_directory(self, value):
+        self.session.current_directory = value
+
+    @property
+    def current_user(self):
+        return self.session.current_user
+
+    @current_user.setter
+    def current_user(self, value):
+        self.session.current_user = value
+
+    def new_session(self, user="user", env=None):
+        """
+        Создает сессию, начинающуюся в корне. Сделать ее активной - vfs.session = ...
+        Без env сессия получает минимальное окружение (minimal_env), а не
+        копию окружения процесса, как у локальной сессии
+        """
+        session = Session(user, minimal_env(user) if env is None else env)
+        session.current_directory = self.root
+        self._sessions.add(session)
+        return session
+
+    def load(self, path, lazy=False):
+        """
+        Загружает VFS, определяя формат файла автоматически: бинарный снимок или CSV.
+        Возвращает True, если образ загружен (ошибка уже выведена загрузчиком)
+        """
+        from snapshot import is_snapshot
+        
+        self.close_journal()
+        if is_snapshot(path):
+            loaded = self.load_from_snapshot(path)
+        else:
+            loaded = self.load_from_csv(path, lazy=lazy)
+        
+        if loaded and self.journaling:
+            from journal import open_journal
+            open_journal(self, path)
+        return loaded
+
+    def close_journal(self):
+        """
+        Сбрасывает журнал на диск и отключает его
+        """
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+            self.journal_image = None
+
+    def load_from_snapshot(self, snapshot_path):
+        """
+        Загружает VFS из бинарного снимка (см. snapshot.py). Снимок в любом
+        режиме открывается как колоночное хранилище: узлы VFSNode создаются
+        только для посещаемых директорий, поэтому открытие не зависит от
+        числа узлов. Возвращает True, если снимок загружен
+        """
+        from node_store import ColumnarNodeStore
+        
+        try:
+            print(f"Loading VFS from: {snapshot_path}")
+            self._reset_image()
+            self.store = ColumnarNodeStore.from_snapshot(snapshot_path)
+            
+            if self._activate_root():
+                print("VFS loaded successfully!")
+                return True
+            print("Error: Root directory not found in snapshot")
+        
+        except FileNotFoundError:
+            print(f"Error: VFS file '{snapshot_path}' not found")
+        except Exception as e:
+            print(f"Error loading VFS: {e}")
+        return False
+
+    def save_snapshot(self, snapshot_path):
+        """
+        Сохраняет текущее дерево VFS в бинарный снимок
+        """
+        from snapshot import write_snapshot
+        
+        if not self.root:
+            return "Error: VFS is not loaded"
+        
+        try:
+            write_snapshot(self.root, snapshot_path)
+        except OSError as e:
+            return f"Error: Cannot write snapshot '{snapshot_path}': {e}"
+        
+        return "Success"
 
-    def load_from_csv(self, csv_path):
+    def load_from_csv(self, csv_path, lazy=False):
+        """
+        Загружает VFS из csv-файла. При lazy=True файл отображается в память,
+        а содержимое файлов декодируется только при первом обращении.
+        При load_workers > 1 файл разбирается частями в пуле процессов.
+        Возвращает True, если образ загружен; ошибка (в том числе превышение
+        квоты памяти) выводится, а текущий образ при отказе по квоте остается
+        """
         try:
             import csv
-            import base64  
             
             print(f"Loading VFS from: {csv_path}")
-            self.nodes = {}
+            # Квота проверяется до разбора: текущий образ остается загруженным
+            error = self._check_image_quota(csv_path)
+            if error:
+                print(error)
+                return False
+            self._reset_image()
+            links = None
+            # mtime берется до разбора, чтобы правка во время загрузки не потерялась
+            mtime = os.stat(csv_path).st_mtime_ns
             
-            with open(csv_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                
-                # Сначала создаем все узлы
-                for row in reader:
-                    # Обрабатываем кодировку
-                    content = row['content']
-                    encoding = row.get('encoding', 'text')  # по умолчанию 'text'
-                    
-                    if encoding == 'base64' and content:
-                        try:
-                            # Декодируем из Base64 в байты, затем в строку
-                            decoded_bytes = base64.b64decode(content)
-                            content = decoded_bytes.decode('utf-8')
-                        except Exception as e:
-                            print(f"Warning: Failed to decode Base64 for {row['path']}: {e}")
-                            content = "[Base64 decoding error]"
+            if self.node_store == 'columnar':
+                # Колоночное хранилище всегда ссылается на содержимое через mmap
+                from node_store import ColumnarNodeStore
+                self.store = ColumnarNodeStore.from_csv(csv_path)
+                lazy = True
+            elif lazy:
+                self._load_csv_lazy(csv_path)
+            elif self.load_workers > 1:
+                links = self._load_csv_parallel(csv_path)
+            else:
+                # newline='' - переводы строк внутри полей в кавычках сохраняются как есть
+                with open(csv_path, 'r', encoding='utf-8', newline='') as file:
+                    reader = csv.DictReader(file)
                     
-                    node = VFSNode(
-                        node_type=row['type'],
-                        path=row['path'],
-                        name=row['name'],
-                        content=content,
-                        encoding=encoding,
-                        permissions=row['permissions']
-                    )
-                    self.nodes[node.path] = node
-                
-                self._build_tree()
-                
-                # Устанавливаем корень и текущую директорию
-                self.root = self.nodes.get('/')
-                if self.root:
-                    self.current_directory = self.root
-                    print("VFS loaded successfully!")
-                else:
-                    print("Error: Root directory not found in CSV")
+                    # Сначала создаем все узлы
+                    for row in reader:
+                        # Обрабатываем кодировку
+                        encoding = row.get('encoding', 'text')  # по умолчанию 'text'
+                        self._source_digests[row['path']] = _record_digest(
+                            row['type'], row['name'], row['content'], encoding, row['permissions'])
+                        content = _decode_content(row['content'], encoding, row['path'])
+                        
+                        node = VFSNode(
+                            node_type=row['type'],
+                            path=row['path'],
+                            name=row['name'],
+                            content=content,
+                            encoding=encoding,
+                            permissions=row['permissions'],
+                            blobs=self.blobs
+                        )
+                        self.nodes[node.path] = node
+            
+            self._build_tree(links)
+            
+            if self._activate_root():
+                # При ленивой загрузке агрегаты досчитываются при первом du,
+                # чтобы не декодировать содержимое всех файлов заранее
+                if not lazy:
+                    self._compute_totals(self.root)
+                if self.store is None:
+                    self.source_path = csv_path
+                    self.source_mtime = mtime
+                print("VFS loaded successfully!")
+                return True
+            print("Error: Root directory not found in CSV")
                     
         except FileNotFoundError:
             print(f"Error: VFS file '{csv_path}' not found")
         except Exception as e:
             print(f"Error loading VFS: {e}")
+        return False
+
+    def _reset_image(self):
+        """
+        Сбрасывает загруженный образ перед загрузкой нового
+        """
+        self.nodes = {}
+        self.store = None
+        if self.shared_blobs is not None:
+            self.blobs = self.shared_blobs
+        else:
+            self.blobs = BlobStore(self.content_compression, self.compress_threshold)
+        self.root = None
+        for session in self._sessions:
+            session.current_path = "/"
+            session.current_directory = None
+        self._resolve_cache.clear()
+        self._name_index = {}
+        self._store_name_index = None
+        self._copy_aliases = {}
+        self._copy_count = 0
+        self.source_path = None
+        self.source_mtime = None
+        self._source_digests = {}
+        self._image_cost = None
+        self.mounts = []
+
+    def _activate_root(self):
+        """
+        Устанавливает корень и текущую директорию после загрузки узлов
+        """
+        if self.store is not None:
+            self.root = self.store.root_node() if self.store.root_index >= 0 else None
+        else:
+            self.root = self.nodes.get('/')
+        if not self.root:
+            return False
+        for session in self._sessions:
+            session.current_path = "/"
+            session.current_directory = self.root
+        return True
+
+    def _load_csv_parallel(self, csv_path):
+        """
+        Параллельная загрузка (см. parallel_loader.py): части файла разбираются
+        в пуле процессов. Возвращает пары (узел, путь родителя) для _build_tree
+        """
+        from parallel_loader import iter_chunks
+        
+        links = []
+        errors = []
+        for rows, chunk_errors in iter_chunks(csv_path, self.load_workers):
+            errors.extend(chunk_errors)
+            for node_type, path, name, content, encoding, permissions, parent_path, _, digest in rows:
+                node = VFSNode(node_type, path, name, content, encoding, permissions, self.blobs)
+                self.nodes[path] = node
+                self._source_digests[path] = digest
+                if path != '/':
+                    links.append((node, parent_path))
+        
+        for line_number, message in errors:
+            print(f"Warning: line {line_number}: {message}")
+        return links
+
+    def _load_csv_lazy(self, csv_path):
+        """
+        Ленивая загрузка: CSV отображается в память через mmap, для каждого
+        файла запоминается только смещение и длина поля content
+        """
+        with open(csv_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        view = memoryview(buf)
+        records = _iter_csv_records(buf)
+        header = next(records, None)
+        if header is None:
+            return
+        columns = {_decode_csv_field(buf, *field): index for index, field in enumerate(header)}
+        content_index = columns['content']
+        encoding_index = columns.get('encoding')
+        
+        def field_value(fields, name):
+            index = columns[name]
+            return _decode_csv_field(buf, *fields[index]) if index < len(fields) else ''
+        
+        for fields in records:
+            # Пропускаем пустые строки
+            if len(fields) == 1 and fields[0][0] == fields[0][1]:
+                continue
+            
+            encoding = 'text'
+            if encoding_index is not None and encoding_index < len(fields):
+                encoding = _decode_csv_field(buf, *fields[encoding_index])
+            
+            node = VFSNode(
+                node_type=field_value(fields, 'type'),
+                path=field_value(fields, 'path'),
+                name=field_value(fields, 'name'),
+                content='',
+                encoding=encoding,
+                permissions=field_value(fields, 'permissions'),
+                blobs=self.blobs
+            )
+            raw_content = b''
+            if content_index < len(fields):
+                start, end, quoted = fields[content_index]
+                if start != end:
+                    node._content_source = (buf, start, end, quoted, False)
+                    # Хэшируется само отображение, без копии поля
+                    raw_content = view[start:end] if not quoted else buf[start:end].replace(b'""', b'"')
+            self.nodes[node.path] = node
+            self._source_digests[node.path] = _record_digest(
+                node.type, node.name, raw_content, encoding, node.permissions)
     
-    def _build_tree(self):
+    def reload(self):
         """
-        Строит древовидную структуру из узлов
+        Инкрементально перечитывает исходный CSV: сравнивает записи с загруженными
+        по пути и хэшу и применяет только добавления, изменения и удаления.
+        Текущая директория сохраняется, если она все еще существует
         """
-        for path, node in self.nodes.items():
-            if path == '/':  # корневой узел не имеет родителя
+        if self.store is not None:
+            return "Error: vfs-reload is not supported by the columnar node store"
+        if self.source_path is None:
+            return "Error: No CSV image loaded"
+        
+        from parallel_loader import iter_chunks
+        
+        csv_path = self.source_path
+        try:
+            mtime = os.stat(csv_path).st_mtime_ns
+            rows = {}
+            for chunk_rows, errors in iter_chunks(csv_path, self.load_workers, decode=False):
+                for line_number, message in errors:
+                    print(f"Warning: line {line_number}: {message}")
+                for row in chunk_rows:
+                    rows[row[1]] = row
+        except FileNotFoundError:
+            return f"Error: VFS file '{csv_path}' not found"
+        except Exception as e:
+            return f"Error reloading VFS: {e}"
+        
+        root_row = rows.get('/')
+        if root_row is None or root_row[0] != 'directory':
+            return "Error: Root directory not found in CSV"
+        
+        old_digests = self._source_digests
+        nodes = self.nodes
+        added = updated = removed = 0
+        self._image_cost = None
+        
+        # Удаления, а также смена типа или имени - узел убирается и создается заново
+        for path in sorted(old_digests.keys() - rows.keys(), key=len):
+            node = nodes.get(path)
+            if node is not None and self._is_attached(node):
+                self._detach_node(node)
+                removed += 1
+        for path, row in rows.items():
+            node = nodes.get(path)
+            if (node is not None and path != '/' and (node.type, node.name) != (row[0], row[2])
+                    and self._is_attached(node)):
+                self._detach_node(node)
+                removed += 1
+        
+        # Изменения на месте и добавления (родители раньше детей)
+        memo = {}
+        for path in sorted(rows):
+            node_type, _, name, content, encoding, permissions, parent_path, _, digest = rows[path]
+            node = nodes.get(path)
+            if node is not None and self._is_attached(node, memo):
+                if old_digests.get(path) != digest:
+                    self._update_node(node, _decode_content(content, encoding, path), encoding, permissions)
+                    updated += 1
+                elif node._content_source is not None:
+                    # Ленивое содержимое ссылается на старое отображение файла,
+                    # которое могло быть перезаписано на месте - берем его из нового
+                    node.content = _decode_content(content, encoding, path)
                 continue
             
-            # Находим родительскую директорию
-            parent_path = '/'.join(path.split('/')[:-1]) or '/'
+            # Узлы без родителя в дереве не создаются - как и при полной загрузке
+            parent = nodes.get(parent_path)
+            if parent is None or parent.type != 'directory' or not self._is_attached(parent, memo):
+                continue
+            node = VFSNode(node_type, path, name, _decode_content(content, encoding, path),
+                           encoding, permissions, self.blobs)
+            nodes[path] = node
+            self._before_mutate(parent)
+            parent.add_child(node)
+            self._invalidate_derived(parent)
+            memo[node] = True
+            self._index_name(name, node)
+            if parent.total_size is not None:
+                self._compute_totals(node, cancellable=False)
+                self._add_to_totals(parent, node.total_size, node.total_files)
+            added += 1
+        
+        for path in old_digests.keys() - rows.keys():
+            nodes.pop(path, None)
+        self._source_digests = {path: row[8] for path, row in rows.items()}
+        self.source_mtime = mtime
+        self._invalidate_resolve_cache()
+        
+        self._relocate_sessions()
+        return f"Reloaded {csv_path}: {added} added, {updated} updated, {removed} removed"
+
+    def _relocate_sessions(self):
+        """
+        После замены узлов дерева сессии остаются в текущей директории
+        (уже новом узле) или в ближайшем сохранившемся предке
+        """
+        for session in self._sessions:
+            path = session.current_path
+            node = self._walk_path(self.root, path)
+            while node is None or node.type != 'directory':
+                path = self._split_path(path)[0]
+                node = self._walk_path(self.root, path)
+            session.current_path = node.path
+            session.current_directory = node
+
+    def mount(self, image_path, path, lazy=False):
+        """
+        Подключает образ (CSV или снимок) в директорию path поверх ее
+        содержимого (overlay, см. mounts.py); если path нет, она создается.
+        Образ разбирается только при первом обращении к путям под path.
+        Повторное подключение того же образа в ту же точку ничего не меняет
+        """
+        from mounts import ImageMount
+        
+        if self.root is None:
+            return "Error: VFS is not loaded"
+        if not os.path.isfile(image_path):
+            return f"Error: VFS file '{image_path}' not found"
+        image_path = os.path.abspath(image_path)
+        
+        lower = self.get_node(path)
+        if lower is not None:
+            if lower.type != 'directory':
+                return f"Error: Mount point '{path}' is not a directory"
+            parent, name, mount_path = lower.parent, lower.name, lower.path
+        else:
+            parent_path, name = self._split_path(path)
+            parent = self.get_node(parent_path)
+            if not parent or parent.type != 'directory':
+                return f"Error: Directory '{parent_path}' not found"
+            if name in ('', '.', '..'):
+                return f"Error: Invalid mount point '{path}'"
+            mount_path = parent.path.rstrip('/') + '/' + name
+        
+        mounted = [mount for mount in self.mounts if mount.path == mount_path]
+        if mounted and mounted[-1].image_path == image_path:
+            return "Success"
+        
+        source = ImageMount(self, image_path, mount_path, lazy, lower, name)
+        node = source.cow_copy(name, mount_path)
+        if parent is None:
+            self.root = node
+        else:
+            self._before_mutate(parent)
+            parent.add_child(node)
+            if lower is None:
+                self._index_name(name, node)
+            # Агрегаты и хэш точки подключения неизвестны до загрузки образа
+            self._invalidate_totals(parent)
+            self._invalidate_derived(parent)
+        if lower is not None:
+            # Прежнее содержимое остается только нижним слоем
+            lower.parent = None
+        self.mounts.append(source)
+        self._invalidate_resolve_cache()
+        self._relocate_sessions()
+        
+        if self.journal is not None:
+            self.journal.append({'op': 'mount', 'image': image_path, 'path': mount_path, 'lazy': lazy})
+        return "Success"
+
+    def poll_reload(self):
+        """
+        Режим наблюдения: не чаще раза в WATCH_INTERVAL проверяет mtime
+        исходного CSV и перечитывает его, если файл изменился
+        """
+        now = time.monotonic()
+        if not self.watch or self.source_path is None or now - self._last_poll < WATCH_INTERVAL:
+            return None
+        self._last_poll = now
+        try:
+            mtime = os.stat(self.source_path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime == self.source_mtime:
+            return None
+        return self.reload()
+
+    def _is_attached(self, node, memo=None):
+        """
+        Достижим ли узел от корня по ссылкам на родителей. memo - {узел: результат}
+        """
+        chain = []
+        attached = True
+        while node is not self.root:
+            if memo is not None and node in memo:
+                attached = memo[node]
+                break
+            if node.parent is None:
+                attached = False
+                break
+            chain.append(node)
+            node = node.parent
+        if memo is not None:
+            for node in chain:
+                memo[node] = attached
+        return attached
+
+    def _detach_node(self, node):
+        """
+        Отцепляет узел от родителя: обновляет агрегаты предков, индекс имен
+        и счетчики ссылок на содержимое
+        """
+        parent = node.parent
+        self._before_mutate(parent)
+        parent.remove_child(node.name)
+        if parent.total_size is not None:
+            self._add_to_totals(parent, -node.total_size, -node.total_files)
+        self._invalidate_derived(parent)
+        
+        # Узлы поддерева больше не ссылаются на тела в хранилище
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.type == 'file' and current._blobs is not None:
+                current._blobs.release(current._content)
+            stack.extend(current._children.values())
+        
+        # Пока поддерево видно в копиях, find находит его содержимое в копиях
+        # через записи индекса источника - их оставляем (лишние отсеет find)
+        path = node.path
+        for source in self._copy_aliases:
+            if source == path or source.startswith(path + '/') or path.startswith(source.rstrip('/') + '/'):
+                return
+        
+        # Из индекса убираются узлы поддерева (копии внутри него не материализуются)
+        removed = set()
+        names = set()
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            removed.add(id(current))
+            names.add(current.name)
+            stack.extend(current._children.values())
+        for name in names:
+            entries = [entry for entry in self._name_index.get(name, ()) if id(entry) not in removed]
+            if entries:
+                self._name_index[name] = entries
+            else:
+                self._name_index.pop(name, None)
+
+    def _update_node(self, node, content, encoding, permissions):
+        """
+        Меняет содержимое и атрибуты узла на месте, пересчитывая агрегаты предков
+        """
+        self._before_mutate(node)
+        self._invalidate_derived(node)
+        node.encoding = sys.intern(encoding)
+        node.permissions = permissions
+        if node.type == 'file':
+            old_size = node.total_size
+            node.content = content
+            if old_size is not None:
+                self._add_to_totals(node, len(content) + 100 - old_size, 0)
+
+    def _build_tree(self, links=None):
+        """
+        Строит древовидную структуру из узлов. links - готовые пары
+        (узел, путь родителя), если пути родителей уже посчитаны
+        """
+        if links is None:
+            links = self._parent_links()
+        
+        for node, parent_path in links:
             parent_node = self.nodes.get(parent_path)
             
             if parent_node and parent_node.type == 'directory':
-                parent_node.children.append(node)
-                node.parent = parent_node
+                parent_node.add_child(node, keep_sorted=False)
+                self._index_name(node.name, node)
+        
+        # Сортируем имена один раз после добавления всех детей
+        for node in self.nodes.values():
+            if node.child_names:
+                node.sort_children()
     
+    def _parent_links(self):
+        for path, node in self.nodes.items():
+            if path == '/':  # корневой узел не имеет родителя
+                continue
+            # Находим родительскую директорию
+            yield node, '/'.join(path.split('/')[:-1]) or '/'
+
+    def _index_name(self, name, entry):
+        entries = self._name_index.get(name)
+        if entries is None:
+            self._name_index[name] = [entry]
+        else:
+            entries.append(entry)
+
+    def _entry_path(self, entry, memo=None):
+        # Записи колоночного хранилища - индексы, путь восстанавливается по родителям
+        return self.store.path_of(entry, memo) if isinstance(entry, int) else entry.path
+
+    def find(self, path, pattern):
+        """
+        Пути узлов под path, имя которых подходит под glob-шаблон.
+        Дерево не обходится: кандидаты берутся из индекса имен и копий
+        """
+        node = self.get_node(path)
+        if not node:
+            return f"Error: Path '{path}' not found"
+        
+        candidates = self._index_candidates(self, pattern)
+        root_prefix = node.path.rstrip('/') + '/'
+        
+        # Подключенные образы под path или выше него, а также образы, из которых
+        # что-то копировалось (cp): кандидаты из их индексов имен с префиксом
+        # точки подключения (образ при этом загружается)
+        for mount in self.mounts:
+            mount_prefix = mount.path.rstrip('/')
+            if (mount.path == node.path or mount.path.startswith(root_prefix)
+                    or node.path.startswith(mount_prefix + '/')
+                    or any(source == mount.path or source.startswith(mount_prefix + '/')
+                           or mount.path.startswith(source.rstrip('/') + '/')
+                           for source in self._copy_aliases)):
+                image = mount.load()
+                if image is not None:
+                    candidates.update(mount_prefix + candidate
+                                      for candidate in self._index_candidates(image, pattern))
+        
+        if self._copy_aliases:
+            candidates = self._alias_candidates(candidates)
+        
+        # Кандидат из копии мог появиться в источнике уже после cp, а путь из
+        # индекса - быть удален или закрыт точкой подключения: проверяем, что
+        # он есть у родителя. Копии и хранилище при этом не материализуются
+        entries = {}
+        results = []
+        for candidate in candidates:
+            checkpoint()
+            if candidate != node.path and not candidate.startswith(root_prefix):
+                continue
+            parent_path, name = candidate.rsplit('/', 1)
+            if fnmatchcase(name, pattern) and name in self._source_entries(parent_path or '/', entries):
+                results.append(candidate)
+        
+        results.sort()
+        return results
+
+    def _source_entries(self, path, cache):
+        """
+        Дети директории path {имя: узел} без материализации копий-при-записи
+        и хранилища; cache - {путь директории: дети} на время одного find
+        """
+        missing = []
+        current = path
+        while current not in cache:
+            missing.append(current)
+            if current == '/':
+                break
+            current = current.rsplit('/', 1)[0] or '/'
+        
+        for current in reversed(missing):
+            if current == '/':
+                node = self.root
+            else:
+                parent_path, name = current.rsplit('/', 1)
+                node = cache[parent_path or '/'].get(name)
+            if node is not None and node.type == 'directory':
+                while isinstance(node, VFSNode) and node._cow_source is not None:
+                    node = node._cow_source
+                cache[current] = node.children
+            else:
+                cache[current] = {}
+        return cache[path]
+
+    def _alias_candidates(self, candidates):
+        """
+        Добавляет к кандидатам их пути в скопированных поддеревьях. Для каждого
+        пути проверяются только его предки по словарю копий, а не все cp.
+        Путь, появившийся после cp с номером N, переносится только более
+        поздними cp - так копии копий учитываются в порядке выполнения
+        """
+        # {путь: наименьший номер cp, после которого путь существует}
+        since = dict.fromkeys(candidates, 0)
+        pending = list(since)
+        while pending:
+            path = pending.pop()
+            number = since[path]
+            prefix = path
+            while prefix:
+                for copy_number, dest in self._copy_aliases.get(prefix, ()):
+                    copied = dest + path[len(prefix):]
+                    if copy_number > number and since.get(copied, copy_number + 1) > copy_number:
+                        since[copied] = copy_number
+                        pending.append(copied)
+                prefix = prefix[:prefix.rfind('/')]
+        return set(since)
+
+    def _name_indexes(self):
+        """
+        Индексы имен для find: индекс колоночного хранилища (строится здесь
+        при первом вызове) и индекс узлов, добавленных после загрузки
+        """
+        if self.store is None:
+            return (self._name_index,)
+        if self._store_name_index is None:
+            self._store_name_index = self.store.name_index()
+        return (self._store_name_index, self._name_index)
+
+    @staticmethod
+    def _index_candidates(vfs, pattern):
+        """
+        Пути из индекса имен vfs, имя которых подходит под шаблон
+        """
+        wildcard = any(char in pattern for char in '*?[')
+        candidates = set()
+        memo = {}
+        for index in vfs._name_indexes():
+            if wildcard:
+                names = [name for name in index if fnmatchcase(name, pattern)]
+            else:
+                names = [pattern] if pattern in index else []
+            candidates.update(vfs._entry_path(entry, memo) for name in names for entry in index[name])
+        return candidates
+
+    def walk(self, node):
+        """
+        Обходит поддерево в прямом порядке (без рекурсии), дети - по имени
+        """
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            checkpoint()
+            yield current
+            if current.type == 'directory':
+                stack.extend(reversed(list(current.iter_children())))
+
     def get_node(self, path):
-        # Если путь относительный - делаем абсолютным
-        if not path.startswith('/'):
-            path = self.current_path + '/' + path if self.current_path != '/' else '/' + path
-            path = path.replace('//', '/')
+        return self.resolve(path)
+
+    def resolve(self, path):
+        """
+        Разрешает абсолютный или относительный путь в узел, переходя по ссылкам
+        узлов от корня или текущей директории. Поддерживает '.', '..' и
+        повторяющиеся/завершающие слеши. Возвращает None, если путь не найден
+        """
+        key = (self.current_path, path)
+        cache = self._resolve_cache
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        
+        node = self._walk_path(self.root if path.startswith('/') else self.current_directory, path)
         
-        return self.nodes.get(path)
+        cache[key] = node
+        if len(cache) > RESOLVE_CACHE_SIZE:
+            cache.popitem(last=False)
+        return node
+
+    def _walk_path(self, node, path):
+        """
+        Проходит по компонентам пути от узла node (без кэша)
+        """
+        for part in path.split('/'):
+            if node is None:
+                break
+            if not part or part == '.':
+                continue
+            if part == '..':
+                # У корня родителя нет - '..' остается в корне
+                node = node.parent or node
+            elif node.type != 'directory':
+                node = None
+            else:
+                node = node.get_child(part)
+        return node
+
+    def _invalidate_resolve_cache(self):
+        """
+        Вызывается при любом изменении структуры дерева
+        """
+        self._resolve_cache.clear()
+
+    def _split_path(self, path):
+        """
+        Делит путь на путь к родительской директории и имя последнего компонента
+        """
+        path = path.rstrip('/') or path
+        if '/' not in path:
+            return '.', path
+        parent_path, name = path.rsplit('/', 1)
+        return parent_path or '/', name
     
     def is_directory(self, path):
         node = self.get_node(path)
         return node and node.type == 'directory'
     
-    def list_directory(self, path=None):
-        if path is None:
-            path = self.current_path
-        
-        node = self.get_node(path)
-        if not node:
-            return f"Error: Directory '{path}' not found"
-        if node.type != 'directory':
-            return f"Error: '{path}' is not a directory"
-        
-        return [child.name for child in node.children]
-    
     def change_directory(self, path):
         # Обработка cd ..
-        if path == "..":
-            if self.current_path == "/":
-                return "Error: Already at root directory"
-            
-            parent_path = '/'.join(self.current_path.split('/')[:-1]) or '/'
-            node = self.get_node(parent_path)
-            
-            if node and node.type == 'directory':
-                self.current_path = parent_path
-                self.current_directory = node
-                return f"Changed directory to {self.current_path}"
-            else:
-                return "Error: Parent directory not found"
-        
-        if path.startswith('/'):
-            target_path = path
-        else:
-            if self.current_path == '/':
-                target_path = '/' + path
-            else:
-                target_path = self.current_path + '/' + path
-        
-        # Нормализуем путь (убираем двойные слеши)
-        target_path = target_path.replace('//', '/')
+        if path == ".." and self.current_directory is self.root:
+            return "Error: Already at root directory"
         
-        node = self.get_node(target_path)
+        node = self.resolve(path)
         
         if not node:
             return f"Error: Directory '{path}' not found"
@@ -151,11 +1340,37 @@ class VirtualFileSystem:
             return f"Error: '{path}' is not a directory"
         
         # Меняем текущую директорию
-        self.current_path = target_path
+        self.current_path = node.path
         self.current_directory = node
         return f"Changed directory to {self.current_path}"
 
-    def list_directory(self, path=None):
+    def list_directory(self, path=None, pattern=None, offset=0, limit=None):
+        """
+        Возвращает отсортированные имена детей директории. pattern - glob-шаблон
+        имени, offset/limit - постраничный вывод
+        """
+        if path is None:
+            path = self.current_path
+        
+        node = self.get_node(path)
+        if not node:
+            return f"Error: Directory '{path}' not found"
+        
+        if node.type != 'directory':
+            return f"Error: '{path}' is not a directory"
+        
+        names = node.child_names
+        if pattern is not None:
+            names = self._match_child_names(node, pattern)
+        
+        end = None if limit is None else offset + limit
+        return names[offset:end]
+
+    def iter_directory(self, path=None, pattern=None, offset=0, limit=None):
+        """
+        Как list_directory, но имена выдаются лениво, без копирования списка
+        (для конвейеров: ls /huge | head -5). Ошибка возвращается строкой
+        """
         if path is None:
             path = self.current_path
         
@@ -166,8 +1381,44 @@ class VirtualFileSystem:
         if node.type != 'directory':
             return f"Error: '{path}' is not a directory"
         
-        # Возвращаем только имена дочерних элементов
-        return [child.name for child in node.children]
+        # Копия (cp) и директория хранилища не материализуются
+        names = node.source_child_names()
+        if pattern is not None:
+            names = self._iter_matching_names(names, pattern)
+        
+        end = None if limit is None else offset + limit
+        return islice(names, offset, end)
+
+    def _iter_matching_names(self, names, pattern):
+        """
+        Ленивый вариант _match_child_names: идет от начала диапазона префикса.
+        names - отсортированный список или итератор имен (его начало до
+        префикса пропускается)
+        """
+        prefix = re.split(r'[*?\[]', pattern, maxsplit=1)[0]
+        if isinstance(names, list):
+            names = islice(names, bisect.bisect_left(names, prefix), None)
+        for name in names:
+            if name < prefix:
+                continue
+            if not name.startswith(prefix):
+                break
+            if fnmatchcase(name, pattern):
+                yield name
+
+    def _match_child_names(self, node, pattern):
+        """
+        Имена детей, подходящие под glob-шаблон. Постоянный префикс шаблона
+        (до первого спецсимвола) ищется в отсортированном индексе бинарным поиском
+        """
+        names = node.child_names
+        prefix = re.split(r'[*?\[]', pattern, maxsplit=1)[0]
+        if prefix == pattern:
+            return [pattern] if pattern in node.children else []
+        
+        start = bisect.bisect_left(names, prefix)
+        end = bisect.bisect_left(names, prefix + '\U0010ffff') if prefix else len(names)
+        return [name for name in names[start:end] if fnmatchcase(name, pattern)]
     
     def calculate_directory_size(self, path=None):
         if path is None:
@@ -177,18 +1428,260 @@ class VirtualFileSystem:
         if not node:
             return 0
         
-        total_size = 0
-        
-        if node.type == 'file':
-            # Для файла считаем длину содержимого + служебная информация
-            content_size = len(node.content) if node.content else 0
-            return content_size + 100  # +100 байт на метаданные
+        self._compute_totals(node)
+        return node.total_size
+
+    def stored_size(self, node):
+        """
+        Размер поддерева как в du, но со сжатыми телами по сжатому размеру
+        """
+        self._compute_totals(node)
+        self._compute_stored(node)
+        return node.stored_size
+
+    def directory_size_report(self, node, max_depth):
+        """
+        Возвращает список (узел, размер) для директорий поддерева до глубины
+        max_depth в порядке вывода du: сначала вложенные, затем сама директория
+        """
+        self._compute_totals(node)
         
-        elif node.type == 'directory':
-            # Для директории рекурсивно считаем размер всех детей
-            for child in node.children:
-                total_size += self.calculate_directory_size(child.path)
-            return total_size + 50  # +50 байт на метаданные директории
+        report = []
+        stack = [(node, 0, False)]
+        while stack:
+            current, depth, visited = stack.pop()
+            checkpoint()
+            if visited or depth >= max_depth:
+                report.append((current, current.total_size))
+                continue
+            stack.append((current, depth, True))
+            for child in reversed(list(current.iter_children())):
+                if child.type == 'directory':
+                    stack.append((child, depth + 1, False))
+        return report
+
+    def _compute_totals(self, node, cancellable=True):
+        """
+        Досчитывает агрегаты размеров для поддерева узла (без рекурсии).
+        Поддеревья с уже посчитанными агрегатами не обходятся повторно.
+        cancellable=False - без точек отмены, для вызовов посреди изменения
+        дерева (отмена там оставила бы его измененным наполовину)
+        """
+        stack = [(node, False)]
+        while stack:
+            current, children_ready = stack.pop()
+            # Отмена здесь безопасна: агрегаты узла выставляются только
+            # после всех его детей, так что инвариант не нарушается
+            if cancellable:
+                checkpoint()
+            if current.total_size is not None:
+                continue
+            
+            source = current._cow_source
+            if source is not None:
+                # Копия еще не создала детей - агрегаты берутся у источника,
+                # чтобы не материализовать поддерево ради du
+                if source.total_size is None:
+                    stack.append((current, False))
+                    stack.append((source, False))
+                else:
+                    current.total_size = source.total_size
+                    current.total_files = source.total_files
+            elif current.type == 'file':
+                # Для файла считаем длину содержимого + служебная информация
+                content_size = current.content_length
+                current.total_size = content_size + 100  # +100 байт на метаданные
+                current.total_files = 1
+            elif children_ready:
+                total_size = 50  # +50 байт на метаданные директории
+                total_files = 0
+                for child in current.children.values():
+                    total_size += child.total_size
+                    total_files += child.total_files
+                current.total_size = total_size
+                current.total_files = total_files
+            else:
+                stack.append((current, True))
+                for child in current.children.values():
+                    if child.total_size is None:
+                        stack.append((child, False))
+
+    def _compute_stored(self, node):
+        """
+        Досчитывает хранимые размеры поддерева (после _compute_totals): как
+        total_size, но сжатое тело учитывается размером сжатых байтов.
+        Как и хэши, не поддерживается при изменениях, а сбрасывается вверх
+        по цепочке родителей и досчитывается только для сброшенных узлов
+        """
+        stack = [(node, False)]
+        while stack:
+            current, children_ready = stack.pop()
+            checkpoint()
+            if current.stored_size is not None:
+                continue
+            
+            source = current._cow_source
+            if source is not None:
+                if source.stored_size is None:
+                    stack.append((current, False))
+                    stack.append((source, False))
+                else:
+                    current.stored_size = source.stored_size
+            elif current.type == 'file':
+                body = current._content
+                current.stored_size = current.total_size
+                if isinstance(body, CompressedBody):
+                    current.stored_size += len(body.data) - body.length
+            elif children_ready:
+                current.stored_size = 50 + sum(child.stored_size for child in current.children.values())
+            else:
+                stack.append((current, True))
+                for child in current.children.values():
+                    if child.stored_size is None:
+                        stack.append((child, False))
+
+    def _add_to_totals(self, node, size_delta, files_delta):
+        """
+        Прибавляет изменение размера к агрегатам узла и всех его предков.
+        Если у предка агрегаты не посчитаны, то и выше их нет - останавливаемся
+        """
+        while node is not None and node.total_size is not None:
+            node.total_size += size_delta
+            node.total_files += files_delta
+            node = node.parent
+
+    def _invalidate_totals(self, node):
+        """
+        Сбрасывает агрегаты узла и его предков - они досчитаются при следующем du
+        """
+        while node is not None and node.total_size is not None:
+            node.total_size = None
+            node.total_files = None
+            node = node.parent
+
+    def _invalidate_derived(self, node):
+        """
+        Сбрасывает хэши и хранимые размеры узла и его предков после изменения.
+        Если у узла их нет, то нет и у предков - дальше не поднимаемся
+        """
+        while node is not None and (node.digest is not None or node.stored_size is not None
+                                    or node.node_count is not None):
+            node.digest = None
+            node.stored_size = None
+            node.node_count = None
+            node = node.parent
+
+    def image_cost(self):
+        """
+        Оценка памяти образа в байтах: узлы * NODE_OVERHEAD + содержимое файлов,
+        как если бы все узлы были созданы. Считается обходом один раз,
+        дальше поддерживается при cp, записи и загрузке подключенных образов
+        (еще не загруженные образы не учитываются)
+        """
+        if self._image_cost is None:
+            nodes, content = self._subtree_cost(self.root) if self.root else (0, 0)
+            self._image_cost = nodes * NODE_OVERHEAD + content
+        return self._image_cost
+
+    def _subtree_cost(self, node):
+        """
+        (число узлов, байты содержимого) поддерева - без материализации
+        """
+        nodes = content = 0
+        for _, current in iter_tree(node, load_mounts=False):
+            nodes += 1
+            content += _raw_content_size(current)
+        return nodes, content
+
+    def _count_nodes(self, node):
+        """
+        Число узлов поддерева без материализации и без загрузки образов (mount).
+        Как хэши, кэшируется в узлах (node_count) и сбрасывается вверх по цепочке
+        родителей при изменении, поэтому повторный cp того же поддерева его не
+        обходит. Поддеревья с еще не загруженными образами не кэшируются:
+        после загрузки образа число узлов в них изменится
+        """
+        uncached = {}  # id(узел): (число узлов, можно ли кэшировать)
+
+        def known(current):
+            if current.node_count is not None:
+                return current.node_count, True
+            return uncached.get(id(current))
+
+        stack = [(node, False)]
+        while stack:
+            current, children_ready = stack.pop()
+            checkpoint()
+            if known(current) is not None:
+                continue
+            
+            source = current._cow_source
+            if source is not None:
+                result = known(source)
+                if result is None:
+                    stack.append((current, False))
+                    stack.append((source, False))
+                    continue
+            elif current.type == 'file':
+                result = 1, True
+            elif children_ready:
+                count, cacheable = 1, not getattr(current, 'pending', False)
+                for child in _source_children(current, load_mounts=False):
+                    child_count, child_cacheable = known(child)
+                    count += child_count
+                    cacheable = cacheable and child_cacheable
+                result = count, cacheable
+            else:
+                stack.append((current, True))
+                for child in _source_children(current, load_mounts=False):
+                    if known(child) is None:
+                        stack.append((child, False))
+                continue
+            
+            if result[1] and isinstance(current, VFSNode):
+                current.node_count = result[0]
+            else:
+                uncached[id(current)] = result
+        return known(node)[0]
+
+    def _check_quota(self, extra, action):
+        """
+        Сообщение об ошибке, если после действия образ превысит квоту, иначе None
+        """
+        if self.memory_quota is None:
+            return None
+        used = self.image_cost()
+        if used + extra > self.memory_quota:
+            return (f"Error: Memory quota exceeded: {action} needs {self.format_size(extra)}, "
+                    f"image uses {self.format_size(used)} of {self.format_size(self.memory_quota)}")
+        return None
+
+    def _add_image_cost(self, extra):
+        # Без квоты оценка не поддерживается и будет пересчитана при запросе
+        if self.memory_quota is None:
+            self._image_cost = None
+        elif self._image_cost is not None:
+            self._image_cost += extra
+
+    def _check_image_quota(self, csv_path):
+        """
+        Оценка нового образа до загрузки: записи файла * NODE_OVERHEAD + размер
+        файла (содержимое, пути и имена). Записи считаются по переводам строк
+        вне кавычек в отображенном файле, без разбора CSV
+        """
+        if self.memory_quota is None:
+            return None
+        with open(csv_path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size == 0:
+                return None
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                rows = _count_records(buf)
+        needed = rows * NODE_OVERHEAD + size
+        if needed > self.memory_quota:
+            return (f"Error: Memory quota exceeded: image '{csv_path}' needs about "
+                    f"{self.format_size(needed)}, quota is {self.format_size(self.memory_quota)}")
+        return None
 
     def format_size(self, size_bytes):
         """
@@ -201,33 +1694,84 @@ class VirtualFileSystem:
         else:
             return f"{size_bytes} bytes"
         
-    def change_permissions(self, path, permissions):
+    def change_permissions(self, path, permissions, recursive=False):
+        """
+        Меняет права узла (recursive - и всего его поддерева). permissions -
+        режим chmod: '755', 'rwxr-xr-x' или символьный 'u+x,go-w'
+        """
         node = self.get_node(path)
         if not node:
             return f"Error: Path '{path}' not found"
         
-        # Конвертируем числовой формат в символьный если нужно
-        if permissions.isdigit():
-            permissions = self._numeric_to_symbolic(permissions)
+        mode = parse_mode(permissions)
+        if mode is None:
+            return f"Error: Invalid permissions format '{permissions}'"
+        keep, bits = mode
         
-        node.permissions = permissions
+        self._before_mutate(node)
+        self._invalidate_derived(node)
+        if recursive:
+            self._change_tree_permissions(node, keep, bits)
+        else:
+            node.mode = (node.mode & keep) | bits
+        if self.journal is not None:
+            record = {'op': 'chmod', 'path': node.path, 'permissions': permissions}
+            if recursive:
+                record['recursive'] = True
+            self.journal.append(record)
         return "Success"
 
-    def _numeric_to_symbolic(self, numeric_perms):
+    def _change_tree_permissions(self, top, keep, bits):
         """
-        Конвертирует числовой формат прав (755) в символьный (rwxr-xr-x)
+        Применяет маски прав ко всему поддереву. Директории колоночного
+        хранилища, которые еще не создавались как объекты, меняются пачкой
+        прямо в массиве прав хранилища (см. node_store.change_store_permissions).
+        
+        Изменение атомарно для отмены задания: сначала (с точками отмены)
+        собираются узлы поддерева, затем права меняются без точек отмены.
+        Отмена во время сбора оставляет права прежними - отделение копий
+        и материализация на содержимое дерева не влияют
         """
-        if len(numeric_perms) != 3:
-            return numeric_perms
+        nodes = []
+        store_nodes = []
+        stack = [top]
+        while stack:
+            node = stack.pop()
+            checkpoint()
+            nodes.append(node)
+            if node.type != 'directory':
+                continue
+            # Копии, еще разделяющие детей узла, отделяются до их изменения
+            for dependent in list(node._cow_dependents):
+                dependent._materialize()
+            source = node._cow_source
+            if getattr(source, 'store', None) is not None:
+                # Директория колоночного хранилища (node_store.StoreNodeView)
+                store_nodes.append(node)
+                continue
+            stack.extend(node.children.values())
         
-        symbolic = ""
-        for digit in numeric_perms:
-            num = int(digit)
-            symbolic += 'r' if num & 4 else '-'
-            symbolic += 'w' if num & 2 else '-'
-            symbolic += 'x' if num & 1 else '-'
+        for node in nodes:
+            node.mode = (node.mode & keep) | bits
+            node.digest = None
+        if store_nodes:
+            from node_store import change_store_permissions
+            change_store_permissions(store_nodes, keep, bits)
+
+    def _before_mutate(self, node):
+        """
+        Вызывается перед изменением узла. Копии, которые еще разделяют данные
+        с узлом или его предками, отделяются вдоль пути от корня до узла,
+        чтобы изменение не стало видно в них
+        """
+        path = []
+        while node is not None:
+            path.append(node)
+            node = node.parent
         
-        return symbolic
+        for ancestor in reversed(path):
+            for dependent in list(ancestor._cow_dependents):
+                dependent._materialize()
 
     def copy_node(self, source_path, dest_path):
         """
@@ -238,37 +1782,94 @@ class VirtualFileSystem:
             return f"Error: Source path '{source_path}' not found"
         
         # Проверяем что целевая директория существует
-        dest_parent_path = '/'.join(dest_path.split('/')[:-1]) or '/'
+        dest_parent_path, dest_name = self._split_path(dest_path)
         dest_parent = self.get_node(dest_parent_path)
         
         if not dest_parent or dest_parent.type != 'directory':
             return f"Error: Destination directory '{dest_parent_path}' not found or not a directory"
         
         # Проверяем что целевое имя не занято
-        if self.get_node(dest_path):
+        if dest_name in ('', '.', '..') or dest_parent.get_child(dest_name):
             return f"Error: Destination path '{dest_path}' already exists"
         
-        # Создаем копию узла
-        new_node = VFSNode(
-            node_type=source_node.type,
-            path=dest_path,
-            name=dest_path.split('/')[-1],
-            content=source_node.content,
-            encoding=source_node.encoding,
-            permissions=source_node.permissions
-        )
-        
-        # Добавляем в VFS
-        self.nodes[dest_path] = new_node
-        
-        # Добавляем в родительскую директорию
-        dest_parent.children.append(new_node)
-        new_node.parent = dest_parent
-        
-        # Рекурсивно копируем детей если это директория
-        if source_node.type == 'directory':
-            for child in source_node.children:
-                child_dest_path = dest_path + '/' + child.name
-                self.copy_node(child.path, child_dest_path)
+        # Нельзя копировать директорию внутрь нее самой
+        ancestor = dest_parent
+        while ancestor is not None:
+            if ancestor is source_node:
+                return f"Error: Cannot copy '{source_path}' into itself"
+            ancestor = ancestor.parent
+        
+        # Квота считает копию целиком: при записи в нее узлы создаются заново
+        copy_cost = 0
+        if self.memory_quota is not None:
+            copy_cost = self._count_nodes(source_node) * NODE_OVERHEAD
+            error = self._check_quota(copy_cost, f"cp of '{source_path}'")
+            if error:
+                return error
+        
+        # Агрегаты копии совпадают с агрегатами источника
+        if dest_parent.total_size is not None:
+            self._compute_totals(source_node)
+        
+        # Копия разделяет поддерево с источником (копирование при записи).
+        # Путь копии строится от реального пути родителя, а не от введенной строки
+        full_dest_path = dest_parent.path.rstrip('/') + '/' + dest_name
+        new_node = source_node.cow_copy(dest_name, full_dest_path)
+        
+        self._before_mutate(dest_parent)
+        dest_parent.add_child(new_node)
+        self._invalidate_derived(dest_parent)
+        self._invalidate_resolve_cache()
+        self._index_name(dest_name, new_node)
+        self._copy_count += 1
+        self._copy_aliases.setdefault(source_node.path, []).append((self._copy_count, full_dest_path))
+        self._add_image_cost(copy_cost)
+        
+        # Обновляем агрегаты размеров вверх по цепочке родителей
+        if dest_parent.total_size is not None:
+            self._add_to_totals(dest_parent, new_node.total_size, new_node.total_files)
+        
+        if self.journal is not None:
+            self.journal.append({'op': 'cp', 'source': source_node.path, 'dest': full_dest_path})
+        return "Success"
+
+    def write_file(self, path, content, append=False):
+        """
+        Записывает текст в файл, создавая его при необходимости (> и >> в командах)
+        """
+        parent_path, name = self._split_path(path)
+        parent = self.get_node(parent_path)
+        if not parent or parent.type != 'directory':
+            return f"Error: Directory '{parent_path}' not found"
+        
+        node = parent.get_child(name) if name not in ('', '.', '..') else parent
+        if node is not None and node.type == 'directory':
+            return f"Error: '{path}' is a directory"
+        
+        if node is None:
+            growth = NODE_OVERHEAD + len(content)
+        else:
+            growth = len(content) if append else len(content) - _raw_content_size(node)
+        error = self._check_quota(growth, f"writing '{path}'")
+        if error:
+            return error
+        self._add_image_cost(growth)
+        
+        if node is None:
+            node = VFSNode('file', parent.path.rstrip('/') + '/' + name, name, content, 'text', 'rw-r--r--',
+                           self.blobs)
+            self._before_mutate(parent)
+            parent.add_child(node)
+            self._invalidate_derived(parent)
+            self._invalidate_resolve_cache()
+            self._index_name(name, node)
+            if parent.total_size is not None:
+                self._compute_totals(node, cancellable=False)
+                self._add_to_totals(parent, node.total_size, node.total_files)
+        else:
+            text = node.content + content if append else content
+            self._update_node(node, text, node.encoding, node.permissions)
         
+        if self.journal is not None:
+            self.journal.append({'op': 'write', 'path': node.path, 'content': content, 'append': append})
         return "Success"
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Сравнение поддеревьев и образов VFS по хэшам Меркла (vfs.compute_digest).
+
+Одинаковые поддеревья имеют одинаковые хэши, поэтому сравнение спускается
+только в различающиеся ветви: совпавшая пара директорий пропускается за O(1),
+сколько бы узлов в ней ни было. Хэши считаются один раз (как агрегаты du)
+и сбрасываются вверх по цепочке родителей при chmod, cp и записи, так что
+повторное сравнение после правки снова обходит только измененные ветви.
+Дети копий (cp) и колоночного хранилища при сравнении не материализуются.
+
+Вывод - в стиле diff -rq.
+"""
+import contextlib
+import io
+
+from jobs import checkpoint
+from vfs import VirtualFileSystem, _source_children, compute_digest
+
+
+def _kind(node):
+    return 'directory' if node.type == 'directory' else 'regular file'
+
+
+def _join(path, name):
+    return f"{path.rstrip('/')}/{name}"
+
+
+def diff_trees(a, b, path_a, path_b):
+    """
+    Различия поддеревьев a и b - строки в стиле diff -rq.
+    path_a и path_b - подписи корней сравнения в выводе
+    """
+    compute_digest(a)
+    compute_digest(b)
+
+    # Элементы стека - пары узлов для сравнения или готовые строки вывода,
+    # чтобы вывод шел в порядке имен, как при рекурсивном обходе
+    stack = [(a, b, path_a, path_b)]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            yield item
+            continue
+        checkpoint()
+        a, b, path_a, path_b = item
+        if a.type != b.type:
+            yield f"File {path_a} is a {_kind(a)} while file {path_b} is a {_kind(b)}"
+            continue
+        if a.mode != b.mode:
+            yield f"Permissions of {path_a} and {path_b} differ: {a.permissions} vs {b.permissions}"
+        if a.digest == b.digest:
+            continue
+        if a.type == 'file':
+            yield f"Files {path_a} and {path_b} differ"
+            continue
+
+        children_a = {child.name: child for child in _source_children(a)}
+        children_b = {child.name: child for child in _source_children(b)}
+        pending = []
+        for name in sorted(children_a.keys() | children_b.keys()):
+            child_a = children_a.get(name)
+            child_b = children_b.get(name)
+            if child_b is None:
+                pending.append(f"Only in {path_a}: {name}")
+            elif child_a is None:
+                pending.append(f"Only in {path_b}: {name}")
+            elif (child_a.type, child_a.mode, child_a.digest) != (child_b.type, child_b.mode, child_b.digest):
+                pending.append((child_a, child_b, _join(path_a, name), _join(path_b, name)))
+        pending.reverse()
+        stack.extend(pending)
+
+
+def load_image(path):
+    """
+    Загружает образ для сравнения в колоночное хранилище: узлы не создаются,
+    хэши хранятся в массиве хранилища. Возвращает (vfs, None) или (None, ошибка)
+    """
+    vfs = VirtualFileSystem(node_store='columnar')
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        vfs.load(path)
+    if vfs.root is None:
+        messages = [line for line in output.getvalue().splitlines() if line.startswith("Error")]
+        return None, messages[-1] if messages else f"Error: Cannot load '{path}'"
+    return vfs, None
+
+
+def diff_images(path_a, path_b):
+    """
+    Различия двух образов (CSV или снимков); ошибка загрузки - строкой
+    """
+    vfs_a, error = load_image(path_a)
+    if error:
+        return error
+    vfs_b, error = load_image(path_b)
+    if error:
+        return error
+    return diff_trees(vfs_a.root, vfs_b.root, f"{path_a}:/", f"{path_b}:/")
@@ -0,0 +1,204 @@
+"""
+Учет памяти образа для команды vfs-stats.
+
+В отличие от du (условные len + 100 на файл и 50 на директорию) здесь
+считаются реальные величины: байты содержимого до и после декодирования
+base64, размер объектов узлов по sys.getsizeof, экономия от интернирования
+типов, имен и кодировок узлов (VFSNode), от хранения одинаковых тел одной
+строкой (blob_store.py) и от их сжатия, RSS процесса.
+Дерево обходится без материализации (vfs.iter_tree), содержимое лениво
+загруженных файлов декодируется на время подсчета и не кэшируется.
+Еще не загруженные образы (mount) не загружаются и не учитываются.
+"""
+import heapq
+import os
+import sys
+
+from mounts import UnionDirectory
+from blob_store import CompressedBody
+from vfs import NODE_OVERHEAD, VFSNode, iter_tree, read_content
+
+DEFAULT_TOP = 5
+
+
+def _content_sizes(node):
+    """
+    (байты в образе, байты после декодирования, байты в памяти) содержимого
+    файла. Сжатое тело не распаковывается - его размеры известны
+    """
+    source = node._content_source
+    body = node._content
+    if isinstance(body, CompressedBody):
+        decoded = body.nbytes
+        stored = len(body.data)
+    else:
+        content = read_content(node)
+        decoded = stored = len(content) if content.isascii() else len(content.encode('utf-8'))
+    if source is not None:
+        encoded = source[2] - source[1]
+    elif node.encoding == 'base64':
+        encoded = (decoded + 2) // 3 * 4
+    else:
+        encoded = decoded
+    return encoded, decoded, stored
+
+
+def _object_size(node):
+    # Имя интернировано и считается один раз на строку (см. collect_stats)
+    return (sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof(node._children)
+            + sys.getsizeof(node._child_names) + sys.getsizeof(node.path))
+
+
+def rss_bytes():
+    """
+    (текущий RSS, пиковый RSS) процесса в байтах; None - если недоступно
+    """
+    current = peak = None
+    try:
+        with open('/proc/self/statm', encoding='ascii') as file:
+            current = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # В Linux ru_maxrss в килобайтах, в macOS - в байтах
+        peak = peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    if current is not None and peak is not None:
+        peak = max(peak, current)
+    return current, peak
+
+
+def collect_stats(vfs, top=DEFAULT_TOP):
+    """
+    Обходит дерево один раз и возвращает словарь со статистикой
+    """
+    stats = {
+        'files': 0, 'directories': 0, 'objects': 0, 'shared': 0, 'store_nodes': 0,
+        'encoded': 0, 'decoded': 0, 'stored': 0, 'object_bytes': 0,
+        'string_fields': 0, 'string_field_bytes': 0, 'string_bytes': 0,
+    }
+    strings = set()  # id интернированных строк узлов, уже учтенных
+    largest = []  # куча (байты, узлы, путь) - top самых больших поддеревьев
+    stack = []    # открытые директории: [префикс, путь, байты, узлы]
+
+    def close_directory():
+        prefix, path, size, nodes = stack.pop()
+        if stack:
+            stack[-1][2] += size
+            stack[-1][3] += nodes
+            # Корень - это весь образ, в список не попадает
+            entry = (size, nodes, path)
+            if len(largest) < top:
+                heapq.heappush(largest, entry)
+            elif largest and entry > largest[0]:
+                heapq.heapreplace(largest, entry)
+
+    for path, node in iter_tree(vfs.root, load_mounts=False):
+        while stack and not path.startswith(stack[-1][0]):
+            close_directory()
+
+        if isinstance(node, VFSNode) and node.path == path:
+            stats['objects'] += 1
+            stats['object_bytes'] += _object_size(node)
+            for value in (node.type, node.name, node.encoding):
+                value_size = sys.getsizeof(value)
+                stats['string_fields'] += 1
+                stats['string_field_bytes'] += value_size
+                if id(value) not in strings:
+                    strings.add(id(value))
+                    stats['string_bytes'] += value_size
+        elif isinstance(node, (VFSNode, UnionDirectory)):
+            # Узел копии или точки подключения, еще не созданный:
+            # обход пришел к узлу источника
+            stats['shared'] += 1
+        else:
+            stats['store_nodes'] += 1
+
+        size = 0
+        if node.type == 'directory':
+            stats['directories'] += 1
+        else:
+            stats['files'] += 1
+            encoded, size, stored = _content_sizes(node)
+            stats['encoded'] += encoded
+            stats['decoded'] += size
+            stats['stored'] += stored
+
+        if node.type == 'directory':
+            # Размер и число узлов директории добавляются к родителю при ее закрытии
+            stack.append([path.rstrip('/') + '/', path, 0, 1])
+        elif stack:
+            stack[-1][2] += size
+            stack[-1][3] += 1
+
+    while stack:
+        close_directory()
+
+    stats['strings'] = len(strings)
+    stats['largest'] = sorted(largest, reverse=True)
+    stats['blobs'] = vfs.blobs.stats()
+    stats['compressed'] = vfs.blobs.compression_stats()
+    stats['cache'] = vfs.blobs.cache_stats()
+    stats['store_bytes'] = vfs.store.memory_usage() if vfs.store is not None else 0
+    stats['image_cost'] = vfs.image_cost()
+    stats['rss'], stats['peak_rss'] = rss_bytes()
+    return stats
+
+
+def format_stats(vfs, stats):
+    size = vfs.format_size
+    lines = [
+        f"Nodes:            {stats['files'] + stats['directories']} "
+        f"({stats['files']} files, {stats['directories']} directories)",
+        f"Content:          {size(stats['decoded'])} decoded, {size(stats['encoded'])} in image",
+    ]
+    if vfs.blobs.compression is not None:
+        lines[-1] += f", {size(stats['stored'])} stored"
+
+    objects = stats['objects']
+    if objects:
+        object_bytes = stats['object_bytes'] + stats['string_bytes']
+        lines.append(f"Node objects:     {objects}, {object_bytes / objects:.0f} bytes/node "
+                     f"(estimate {NODE_OVERHEAD} bytes/node)")
+        lines.append(f"Interned strings: {stats['strings']} strings for {stats['string_fields']} "
+                     f"type/name/encoding fields, "
+                     f"{size(stats['string_field_bytes'] - stats['string_bytes'])} saved")
+    if stats['shared']:
+        lines.append(f"Shared by copies: {stats['shared']} nodes of cp copies not created yet (copy-on-write)")
+    if stats['store_nodes'] or stats['store_bytes']:
+        store_nodes = len(vfs.store) if vfs.store is not None else 0
+        per_node = stats['store_bytes'] / store_nodes if store_nodes else 0
+        lines.append(f"Columnar store:   {stats['store_nodes']} nodes not materialized, "
+                     f"{size(stats['store_bytes'])} ({per_node:.0f} bytes/node)")
+
+    blobs, references, logical, stored = stats['blobs']
+    lines.append(f"Shared contents:  {blobs} bodies for {references} files, "
+                 f"{size(logical - stored)} saved")
+
+    if vfs.blobs.compression is not None:
+        bodies, logical, stored = stats['compressed']
+        cached, cached_bytes, hits, misses = stats['cache']
+        lines.append(f"Compressed:       {bodies} bodies ({vfs.blobs.compression}, "
+                     f"from {size(vfs.blobs.threshold)}), {size(logical)} -> {size(stored)}")
+        lines.append(f"Content cache:    {cached} bodies, {size(cached_bytes)} of "
+                     f"{size(vfs.blobs.cache_size)}, {hits} hits, {misses} misses")
+
+    if vfs.mounts:
+        loaded = sum(1 for mount in vfs.mounts if mount.image is not None)
+        lines.append(f"Mounted images:   {len(vfs.mounts)} ({loaded} loaded)")
+
+    quota = f" of {size(vfs.memory_quota)} quota" if vfs.memory_quota is not None else ""
+    lines.append(f"Image estimate:   {size(stats['image_cost'])}{quota}")
+
+    rss, peak = stats['rss'], stats['peak_rss']
+    lines.append(f"Process RSS:      {size(rss) if rss is not None else 'n/a'} "
+                 f"(peak {size(peak) if peak is not None else 'n/a'})")
+
+    if stats['largest']:
+        lines.append("Largest subtrees:")
+        for content_bytes, nodes, path in stats['largest']:
+            lines.append(f"  {size(content_bytes):>10}  {nodes:>8} nodes  {path}")
+    return "\n".join(lines)